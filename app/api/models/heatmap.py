@@ -0,0 +1,47 @@
+import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.api.models.incident import Coordinates
+from app.utils import geo
+
+
+class HeatmapBounds(BaseModel):
+    min_latitude: float
+    min_longitude: float
+    max_latitude: float
+    max_longitude: float
+
+
+class HeatmapCell(BaseModel):
+    geohash: str
+    count: int
+    center: Coordinates
+    bounds: HeatmapBounds
+
+    @staticmethod
+    def from_rollup(cell: str, count: int):
+        min_lat, min_lng, max_lat, max_lng = geo.decode_bounds(cell)
+        return HeatmapCell(
+            geohash=cell,
+            count=count,
+            center=Coordinates(
+                latitude=(min_lat + max_lat) / 2, longitude=(min_lng + max_lng) / 2
+            ),
+            bounds=HeatmapBounds(
+                min_latitude=min_lat,
+                min_longitude=min_lng,
+                max_latitude=max_lat,
+                max_longitude=max_lng,
+            ),
+        )
+
+
+class HeatmapResponse(BaseModel):
+    precision: int
+    start: datetime.date
+    end: datetime.date
+    category: Optional[str]
+    count: int
+    data: list[HeatmapCell]
@@ -91,3 +91,9 @@ class IncidentsResponse(BaseModel):
     count: int
     data: list[Incident]
     # TODO pagination
+
+
+class UnitAssignmentsResponse(BaseModel):
+    short_name: str
+    count: int
+    data: list[Incident]
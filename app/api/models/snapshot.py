@@ -0,0 +1,19 @@
+import datetime
+
+from pydantic import BaseModel
+
+
+class SnapshotFile(BaseModel):
+    date: datetime.date
+    format: str
+    filename: str
+    url: str
+    size: int
+    sha256: str
+    incidents: int
+    created_at: datetime.datetime
+
+
+class SnapshotManifestResponse(BaseModel):
+    count: int
+    data: list[SnapshotFile]
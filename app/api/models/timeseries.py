@@ -0,0 +1,23 @@
+import datetime
+
+from pydantic import BaseModel
+
+
+class TimeseriesPoint(BaseModel):
+    bucket: datetime.datetime
+    count: int
+
+
+class TimeseriesSeries(BaseModel):
+    value: str
+    total: int
+    points: list[TimeseriesPoint]
+
+
+class TimeseriesResponse(BaseModel):
+    bucket: str
+    group_by: str
+    start: datetime.datetime
+    end: datetime.datetime
+    count: int
+    data: list[TimeseriesSeries]
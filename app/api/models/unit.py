@@ -13,3 +13,24 @@ class Unit(BaseModel):
     removed_at: Optional[datetime.datetime]
     last_seen: datetime.datetime
     automatically_removed: bool
+
+
+class UnitHistoryEntry(BaseModel):
+    incident_id: uuid.UUID
+    incident_number: int
+    category: str
+    description: str
+    municipality: str
+    dispatched_at: datetime.datetime
+    added_at: datetime.datetime
+    removed_at: Optional[datetime.datetime]
+    last_seen: datetime.datetime
+    automatically_removed: bool
+
+
+class UnitHistoryResponse(BaseModel):
+    short_name: str
+    page: int
+    per_page: int
+    count: int
+    data: list[UnitHistoryEntry]
@@ -5,7 +5,7 @@ from typing import Optional
 from fastapi import APIRouter, HTTPException
 from playhouse.shortcuts import model_to_dict
 from app.api.models.agency import AgenciesResponse, Agency as AgencyOutput
-from app.database.models.agency import Agency
+from app.services.agencyindex import agency_index
 from fastapi_cache.decorator import cache
 
 agency_router = APIRouter(
@@ -18,7 +18,7 @@ logger = logging.getLogger(__name__)
 
 
 @agency_router.get("/search")
-@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"))
+@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"), namespace="agencies")
 async def search_agencies(
     category: Optional[IncidentCategory] = None,
     station_id: Optional[str] = None,
@@ -30,84 +30,59 @@ async def search_agencies(
     zip_code: Optional[str] = None,
     phone: Optional[str] = None,
 ) -> AgenciesResponse:
-    """Search for agencies"""
-
-    agencies = []
-
-    if category:
-        agencies = Agency.select().where(Agency.category == category)
-    if station_id:
-        agencies = Agency.select().where(Agency.station_id == station_id)
-    if name:
-        agencies = Agency.select().where(Agency.name == name)
-    if url:
-        agencies = Agency.select().where(Agency.url == url)
-    if address:
-        agencies = Agency.select().where(Agency.address == address)
-    if city:
-        agencies = Agency.select().where(Agency.city == city)
-    if state:
-        agencies = Agency.select().where(Agency.state == state)
-    if zip_code:
-        agencies = Agency.select().where(Agency.zip_code == zip_code)
-    if phone:
-        agencies = Agency.select().where(Agency.phone == phone)
+    """Search for agencies matching all of the given fields, none are returned without any"""
+
+    agencies = agency_index.current().search(
+        category=category,
+        station_id=station_id,
+        name=name,
+        url=url,
+        address=address,
+        city=city,
+        state=state,
+        zip_code=zip_code,
+        phone=phone,
+    )
 
     output_agencies = []
-    for incident in agencies:
-        output_agencies.append(AgencyOutput.from_db_model(incident))
+    for agency in agencies:
+        output_agencies.append(AgencyOutput.from_db_model(agency))
     return AgenciesResponse(count=len(output_agencies), data=output_agencies)
 
 
 @agency_router.get("/stats")
-@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"))
+@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"), namespace="agencies")
 async def agency_stats():
     """Get agency stats"""
 
-    stats = {}
-    try:
-        stats = {
-            "total": Agency.select().count(),
-            "fire": Agency.select()
-            .where(Agency.category == IncidentCategory.FIRE)
-            .count(),
-            "medical": Agency.select()
-            .where(Agency.category == IncidentCategory.MEDICAL)
-            .count(),
-            "traffic": Agency.select()
-            .where(Agency.category == IncidentCategory.TRAFFIC)
-            .count(),
-        }
-    except Agency.DoesNotExist:
-        raise HTTPException(status_code=404, detail="Agencies not found")
-    return stats
+    snapshot = agency_index.current()
+    return {
+        "total": snapshot.count(),
+        "fire": snapshot.count(IncidentCategory.FIRE),
+        "medical": snapshot.count(IncidentCategory.MEDICAL),
+        "traffic": snapshot.count(IncidentCategory.TRAFFIC),
+    }
 
 
 @agency_router.get("/{category}")
-@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"))
+@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"), namespace="agencies")
 async def agencies(category: IncidentCategory) -> AgenciesResponse:
     """Get all agencies for a given category"""
 
-    agencies = []
-    try:
-        agencies = Agency.select().where(Agency.category == category)
-    except Agency.DoesNotExist:
-        raise HTTPException(status_code=404, detail="Agencies not found")
+    agencies = agency_index.current().search(category=category)
 
     output_agencies = []
-    for incident in agencies:
-        output_agencies.append(AgencyOutput.from_db_model(incident))
+    for agency in agencies:
+        output_agencies.append(AgencyOutput.from_db_model(agency))
     return AgenciesResponse(count=len(output_agencies), data=output_agencies)
 
 
 @agency_router.get("/{category}/{id}")
-@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"))
+@cache(expire=os.getenv("CACHE_AGENCIES_EXPIRE"), namespace="agencies")
 async def agency(category: IncidentCategory, id: str):
     """Get a single agency for a given category and ID"""
 
-    agency = None
-    try:
-        agency = Agency.get(Agency.category == category and Agency.station_id == id)
-    except Agency.DoesNotExist:
+    agency = agency_index.current().get(category, id)
+    if agency is None:
         raise HTTPException(status_code=404, detail="Agency not found")
     return model_to_dict(agency)
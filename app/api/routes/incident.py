@@ -10,6 +10,7 @@ from app.api.models.incident import (
 )
 from app.database.models.incident import Incident
 from app.database.models.unit import Unit
+from app.services import archiver
 from fastapi_cache.decorator import cache
 
 router = APIRouter(
@@ -22,10 +23,12 @@ logger = logging.getLogger(__name__)
 
 
 @router.get("/number/{incident_number}")
-@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def incident(incident_number: int) -> IncidentResponse:
     try:
-        incident = Incident.select().where(Incident.number == incident_number).get()
+        incident = archiver.get_incident(
+            lambda model: [model.number == incident_number]
+        )
     except Incident.DoesNotExist:
         raise HTTPException(
             status_code=404, detail=f"Incident with {incident_number=} does not exist."
@@ -34,10 +37,10 @@ async def incident(incident_number: int) -> IncidentResponse:
 
 
 @router.get("/{incident_id}")
-@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def incident(incident_id: str) -> IncidentResponse:
     try:
-        incident = Incident.get(incident_id)
+        incident = archiver.get_incident(lambda model: [model.id == incident_id])
     except Incident.DoesNotExist:
         raise HTTPException(
             status_code=404, detail=f"Incident with {incident_id=} does not exist."
@@ -2,8 +2,10 @@ import datetime
 import logging
 import os
 from typing import Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from app.api.models.heatmap import HeatmapCell, HeatmapResponse
 from app.api.models.incident import (
     Incident as IncidentOutput,
     IncidentStats,
@@ -11,6 +13,14 @@ from app.api.models.incident import (
 )
 from app.database.models.incident import Incident
 from app.database.models.unit import Unit
+from app.database.models.archive import ArchivedIncident
+from app.services import archiver, export, geosearch
+from app.api.models.timeseries import (
+    TimeseriesPoint,
+    TimeseriesResponse,
+    TimeseriesSeries,
+)
+from app.services.rollups import heatmap_rollup, timeseries_rollup
 from fastapi_cache.decorator import cache
 
 router = APIRouter(
@@ -21,22 +31,31 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+MAX_SPATIAL_RADIUS = 50000  # meters
+MAX_SPATIAL_RESULTS = 1000
+DEFAULT_HEATMAP_DAYS = 30
+DEFAULT_TIMESERIES_DAYS = 30
+MAX_HOURLY_TIMESERIES_DAYS = 31
+
 
 class ResponseModel(BaseModel):
     data: Optional[dict] = None
 
 
 @router.get("/stats")
-@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def stats() -> IncidentStats:
     """Returns various statistics about the API"""
 
-    total_incidents = Incident.select().count()
+    # archived incidents are always resolved
+    total_archived_incidents = ArchivedIncident.select().count()
+    total_incidents = Incident.select().count() + total_archived_incidents
     total_active_incidents = (
         Incident.select().where(Incident.resolved_at.is_null()).count()
     )
     total_resolved_incidents = (
         Incident.select().where(Incident.resolved_at.is_null(False)).count()
+        + total_archived_incidents
     )
 
     return IncidentStats(
@@ -47,7 +66,7 @@ async def stats() -> IncidentStats:
 
 
 @router.get("/active")
-@cache(expire=os.getenv("CACHE_ACTIVE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_ACTIVE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def incidents(
     category: str = None,
     description: str = None,
@@ -77,23 +96,188 @@ async def incidents(
     return IncidentsResponse(count=len(output_incidents), data=output_incidents)
 
 
+@router.get("/near")
+@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"), namespace="incidents")
+async def near(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=MAX_SPATIAL_RADIUS),
+    active: bool = False,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    limit: int = Query(100, gt=0, le=MAX_SPATIAL_RESULTS),
+) -> IncidentsResponse:
+    """Returns the most recent incidents within radius meters of the given coordinates, closest first"""
+
+    results = geosearch.incidents_near(lat, lng, radius, active, start, end, limit)
+    results.sort(key=lambda result: result[1])
+
+    output_incidents = [IncidentOutput.from_db_model(item) for item, _ in results]
+
+    return IncidentsResponse(count=len(output_incidents), data=output_incidents)
+
+
+@router.get("/within")
+@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"), namespace="incidents")
+async def within(
+    bbox: str = Query(..., description="min_lng,min_lat,max_lng,max_lat"),
+    active: bool = False,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    limit: int = Query(100, gt=0, le=MAX_SPATIAL_RESULTS),
+) -> IncidentsResponse:
+    """Returns the most recent incidents within the given bounding box"""
+
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(value) for value in bbox.split(",")]
+    except ValueError:
+        raise HTTPException(
+            status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat"
+        )
+
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise HTTPException(status_code=400, detail=f"Invalid bounding box: {bbox}")
+
+    incidents = geosearch.incidents_within(
+        min_lat, min_lng, max_lat, max_lng, active, start, end, limit
+    )
+
+    output_incidents = [IncidentOutput.from_db_model(item) for item in incidents]
+
+    return IncidentsResponse(count=len(output_incidents), data=output_incidents)
+
+
+@router.get("/heatmap")
+@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"), namespace="incidents")
+async def heatmap(
+    zoom: int = Query(12, ge=0, le=22),
+    start: datetime.date = None,
+    end: datetime.date = None,
+    category: str = None,
+    bbox: str = Query(None, description="min_lng,min_lat,max_lng,max_lat"),
+) -> HeatmapResponse:
+    """Returns the number of incidents per map cell, sized for the given zoom level, dispatched between the start and end dates"""
+
+    end = end or datetime.date.today()
+    start = start or end - datetime.timedelta(days=DEFAULT_HEATMAP_DAYS)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    bounds = None
+    if bbox:
+        try:
+            min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            raise HTTPException(
+                status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat"
+            )
+        bounds = (min_lat, min_lng, max_lat, max_lng)
+
+    precision = heatmap_rollup.precision_for_zoom(zoom)
+
+    cells = []
+    for cell, count in heatmap_rollup.query(precision, start, end, category):
+        output_cell = HeatmapCell.from_rollup(cell, count)
+        if bounds and not (
+            output_cell.bounds.max_latitude >= bounds[0]
+            and output_cell.bounds.max_longitude >= bounds[1]
+            and output_cell.bounds.min_latitude <= bounds[2]
+            and output_cell.bounds.min_longitude <= bounds[3]
+        ):
+            continue
+        cells.append(output_cell)
+
+    return HeatmapResponse(
+        precision=precision,
+        start=start,
+        end=end,
+        category=category,
+        count=len(cells),
+        data=cells,
+    )
+
+
+@router.get("/timeseries")
+@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"), namespace="incidents")
+async def timeseries(
+    bucket: str = Query("day", regex="^(hour|day|week)$"),
+    group_by: str = Query("category", regex="^(category|municipality|agency)$"),
+    start: datetime.date = None,
+    end: datetime.date = None,
+    value: str = None,
+) -> TimeseriesResponse:
+    """Returns the number of incidents per hour, day or week dispatched between the start and end dates (UTC), grouped by category, municipality or agency
+
+    Buckets without any incidents are omitted.
+    """
+
+    end = end or datetime.date.today()
+    start = start or end - datetime.timedelta(days=DEFAULT_TIMESERIES_DAYS)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if bucket == "hour" and (end - start).days >= MAX_HOURLY_TIMESERIES_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"hourly buckets are limited to {MAX_HOURLY_TIMESERIES_DAYS} days",
+        )
+
+    range_start = datetime.datetime.combine(start, datetime.time())
+    range_end = datetime.datetime.combine(end, datetime.time()) + datetime.timedelta(
+        days=1
+    )
+    if bucket == "week":
+        # widen the range to whole weeks so the first and last buckets are complete
+        range_start = timeseries_rollup.week_start(range_start)
+        range_end = timeseries_rollup.week_start(
+            range_end + datetime.timedelta(days=6)
+        )
+
+    series = timeseries_rollup.query(bucket, group_by, range_start, range_end, value)
+
+    data = []
+    for series_value, points in sorted(series.items()):
+        data.append(
+            TimeseriesSeries(
+                value=series_value,
+                total=sum(points.values()),
+                points=[
+                    TimeseriesPoint(bucket=point_bucket, count=count)
+                    for point_bucket, count in sorted(points.items())
+                ],
+            )
+        )
+
+    return TimeseriesResponse(
+        bucket=bucket,
+        group_by=group_by,
+        start=range_start,
+        end=range_end,
+        count=len(data),
+        data=data,
+    )
+
+
 @router.get("/related/{incident_number}")
-@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def related(incident_number: str, delta_minutes: int = 60):
     try:
-        incident = Incident.get(Incident.number == incident_number)
+        incident = archiver.get_incident(lambda model: [model.number == incident_number])
     except Incident.DoesNotExist:
         raise HTTPException(
             status_code=404, detail=f"Incident with {incident_number=} does not exist."
         )
 
-    related = Incident.select().where(
-        Incident.intersection == incident.intersection,
-        Incident.id != incident.id,
-        Incident.added_at.between(
-            incident.added_at - datetime.timedelta(minutes=delta_minutes),
-            incident.added_at + datetime.timedelta(minutes=delta_minutes),
-        ),
+    related = list(
+        archiver.select_incidents(
+            lambda model: [
+                model.intersection == incident.intersection,
+                model.id != incident.id,
+                model.added_at.between(
+                    incident.added_at - datetime.timedelta(minutes=delta_minutes),
+                    incident.added_at + datetime.timedelta(minutes=delta_minutes),
+                ),
+            ]
+        )
     )
 
     data = {
@@ -105,12 +289,12 @@ async def related(incident_number: str, delta_minutes: int = 60):
 
 
 @router.get("/by-date-range/{start}/{end}")
-@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
 async def incident(start: datetime.date, end: datetime.date):
-    incidents = (
-        Incident.select()
-        .where(Incident.dispatched_at.between(start, end))
-        .order_by(Incident.dispatched_at.desc())
+    incidents = list(
+        archiver.select_incidents(
+            lambda model: [model.dispatched_at.between(start, end)]
+        )
     )
 
     data = {
@@ -122,7 +306,7 @@ async def incident(start: datetime.date, end: datetime.date):
 
 
 @router.get("/search")
-@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"))
+@cache(expire=os.getenv("CACHE_INCIDENT_SEARCH_EXPIRE"), namespace="incidents")
 async def incident(
     category: str = None,
     description: str = None,
@@ -132,24 +316,47 @@ async def incident(
 ) -> IncidentsResponse:
     """Returns a list of incidents matching the query parameters"""
 
-    incidents = Incident.select()
-
-    if category:
-        incidents = incidents.where(Incident.category == category)
-    if description:
-        incidents = incidents.where(Incident.description.contains(description))
-    if intersection:
-        incidents = incidents.where(Incident.intersection.contains(intersection))
-    if municipality:
-        incidents = incidents.where(Incident.municipality.contains(municipality))
-    if agency:
-        incidents = incidents.where(Incident.agency.contains(agency))
-
-    incidents.order_by(Incident.dispatched_at.desc())
+    conditions = export.search_conditions(
+        category, description, intersection, municipality, agency
+    )
 
     output_incidents = []
 
-    for incident in incidents:
+    for incident in archiver.select_incidents(conditions):
         output_incidents.append(IncidentOutput.from_db_model(incident))
 
     return IncidentsResponse(count=len(output_incidents), data=output_incidents)
+
+
+@router.get("/export")
+async def export_incidents(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    start: datetime.date = None,
+    end: datetime.date = None,
+    category: str = None,
+    description: str = None,
+    intersection: str = None,
+    municipality: str = None,
+    agency: str = None,
+) -> StreamingResponse:
+    """Streams every incident matching the query parameters, hot and archived, oldest first, as NDJSON or CSV
+
+    Takes the same filters as /search, plus the range of dispatch dates (inclusive).
+    Memory use does not depend on the number of incidents exported.
+    """
+
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    conditions = export.search_conditions(
+        category, description, intersection, municipality, agency, start, end
+    )
+    filename = f"incidents-{start or 'all'}-{end or datetime.date.today()}.{format}"
+
+    return StreamingResponse(
+        export.stream_history(
+            conditions, format, chunk_size=int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+        ),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -1,4 +1,7 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from fastapi_cache import FastAPICache
+from app.cache.backends import LayeredBackend
+from app.services.unitnames import unit_names
 from app.utils.info import get_lcwc_version
 
 router = APIRouter(
@@ -9,9 +12,27 @@ router = APIRouter(
 
 
 @router.get("/stats")
-async def stats():
+async def stats(request: Request):
     """Returns various statistics about the API"""
 
-    data = {"lcwc_version": get_lcwc_version()}
+    data = {"lcwc_version": get_lcwc_version(), "unit_names": unit_names.stats()}
+
+    cache_backend = FastAPICache.get_backend()
+    if isinstance(cache_backend, LayeredBackend):
+        data["cache"] = cache_backend.stats()
+
+    # set up by main.py, which owns their configuration
+    for name in (
+        "feed",
+        "circuit_breakers",
+        "resolver",
+        "rate_limiter",
+        "load_shedder",
+        "log_pipeline",
+        "query_profiler",
+    ):
+        component = getattr(request.app.state, name, None)
+        if component is not None:
+            data[name] = component.stats()
 
     return data
@@ -0,0 +1,80 @@
+import os
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from app.api.models.snapshot import SnapshotFile, SnapshotManifestResponse
+from app.services.snapshots import MEDIA_TYPES, snapshot_store
+from app.utils.ranges import FileRangeResponse, RangeNotSatisfiable, parse_range
+
+router = APIRouter(
+    prefix="/snapshots",
+    tags=["snapshots"],
+    responses={404: {"description": "Not found"}},
+)
+
+# snapshots never change once written
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@router.get("")
+async def manifest(request: Request) -> SnapshotManifestResponse:
+    """Lists the daily snapshot files of the incident history (UTC days), with their size and SHA-256 checksum"""
+
+    files = [
+        SnapshotFile(
+            **entry,
+            url=str(request.url_for("snapshot", filename=entry["filename"])),
+        )
+        for entry in snapshot_store.manifest()
+    ]
+
+    return SnapshotManifestResponse(count=len(files), data=files)
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"], name="snapshot")
+async def snapshot(filename: str, request: Request) -> Response:
+    """Serves a snapshot file, whole or a single byte range of it"""
+
+    # only files listed in the manifest are served, which also rules out path traversal
+    entry = snapshot_store.get(filename)
+    if entry is None:
+        raise HTTPException(
+            status_code=404, detail=f"Snapshot with {filename=} does not exist."
+        )
+
+    path = snapshot_store.path(entry)
+    size = os.path.getsize(path)
+    etag = f'"{entry["sha256"]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE, "Accept-Ranges": "bytes"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    # a range of a different version of the file must not be combined with this one
+    if request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return FileResponse(
+            path,
+            headers=headers,
+            media_type=MEDIA_TYPES[entry["format"]],
+            filename=filename,
+            method=request.method,
+            stat_result=os.stat(path),
+        )
+
+    return FileRangeResponse(
+        path,
+        *byte_range,
+        size,
+        headers=headers,
+        media_type=MEDIA_TYPES[entry["format"]],
+        filename=filename,
+        method=request.method,
+    )
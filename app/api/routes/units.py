@@ -4,12 +4,20 @@ import os
 from fastapi.encoders import jsonable_encoder
 from lcwc.category import IncidentCategory
 from typing import Optional
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from playhouse.shortcuts import model_to_dict
 from peewee import fn
 from pydantic import BaseModel
-from app.api.models.incident import Incident
+from app.api.models.incident import (
+    Incident as IncidentOutput,
+    UnitAssignmentsResponse,
+)
+from app.api.models.unit import UnitHistoryEntry, UnitHistoryResponse
 from app.database.models.agency import Agency
+from app.database.models.incident import Incident
+from app.services import archiver
+from app.services.unitactivity import unit_activity, unit_history
+from app.services.unitnames import unit_names
 from fastapi_cache.decorator import cache
 
 units_router = APIRouter(
@@ -21,13 +29,90 @@ units_router = APIRouter(
 logger = logging.getLogger(__name__)
 
 
+MAX_BATCH_UNITS = 500
+
+
+class UnitInfoBatchRequest(BaseModel):
+    names: list[str]
+    category: IncidentCategory = IncidentCategory.MEDICAL
+
+
 @units_router.get("/info/{name}")
 @cache(expire=os.getenv("CACHE_UNITS_EXPIRE"))
 async def unit_info(name: str):
     """Gets unit information for the Unit via its shortname"""
 
-    from lcwc.utils.unitparser import UnitParser
+    u = unit_names.parse(name, IncidentCategory.MEDICAL)
+    if u is None:
+        raise HTTPException(status_code=400, detail=f"Unable to parse unit {name}")
+    return jsonable_encoder(u)
+
+
+@units_router.post("/info/batch")
+async def unit_info_batch(request: UnitInfoBatchRequest):
+    """Gets unit information for many units via their shortnames, unparseable names map to null"""
+
+    if len(request.names) > MAX_BATCH_UNITS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BATCH_UNITS} units per request"
+        )
+
+    data = {}
+    for name in request.names:
+        if name not in data:
+            data[name] = unit_names.parse(name, request.category)
+
+    return {"count": len(data), "data": jsonable_encoder(data)}
+
+
+@units_router.get("/{short_name}/current")
+@cache(expire=os.getenv("CACHE_ACTIVE_INCIDENTS_EXPIRE"), namespace="incidents")
+async def unit_current(short_name: str) -> UnitAssignmentsResponse:
+    """Returns the active incidents the unit is currently assigned to"""
+
+    incidents = []
+    for assignment in unit_activity.current(short_name):
+        try:
+            incident = archiver.get_incident(
+                lambda model: [model.id == assignment.incident_id]
+            )
+        except Incident.DoesNotExist:
+            # deleted since the last snapshot
+            continue
+        incidents.append(IncidentOutput.from_db_model(incident))
+
+    return UnitAssignmentsResponse(
+        short_name=short_name, count=len(incidents), data=incidents
+    )
+
+
+@units_router.get("/{short_name}/history")
+@cache(expire=os.getenv("CACHE_INCIDENTS_EXPIRE"), namespace="incidents")
+async def unit_assignment_history(
+    short_name: str,
+    page: int = Query(1, ge=1),
+    per_page: int = Query(50, ge=1, le=500),
+) -> UnitHistoryResponse:
+    """Returns the incidents the unit has been assigned to, most recent first"""
+
+    units = unit_history(short_name, offset=(page - 1) * per_page, limit=per_page)
+
+    data = [
+        UnitHistoryEntry(
+            incident_id=unit.incident.id,
+            incident_number=unit.incident.number,
+            category=unit.incident.category,
+            description=unit.incident.description,
+            municipality=unit.incident.municipality,
+            dispatched_at=unit.incident.dispatched_at,
+            added_at=unit.added_at,
+            removed_at=unit.removed_at,
+            last_seen=unit.last_seen,
+            automatically_removed=unit.automatically_removed,
+        )
+        for unit in units
+    ]
 
-    u = UnitParser.parse_unit(name, IncidentCategory.MEDICAL)
-    u = jsonable_encoder(u)
-    return u
+    return UnitHistoryResponse(
+        short_name=short_name, page=page, per_page=per_page, count=len(data), data=data
+    )
@@ -0,0 +1,276 @@
+""" Cache backends used by fastapi-cache """
+
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Optional, Tuple, Union
+
+from fastapi_cache.backends import Backend
+
+cache_refresh: contextvars.ContextVar[bool] = contextvars.ContextVar(
+    "cache_refresh", default=False
+)
+""" When set, reads through the layered backend miss so the cached endpoint is recomputed and stored again """
+
+
+@dataclass
+class LocalCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class LocalCache:
+    """Bounded in-process LRU cache with per-entry expiry, limited by the size of the stored values in bytes"""
+
+    def __init__(self, max_bytes: int, max_ttl: int):
+        """Initializes the local cache
+
+        Args:
+            max_bytes (int): The maximum combined size of all stored values
+            max_ttl (int): The maximum number of seconds an entry is kept, regardless of the expiry it was stored with
+        """
+
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.size = 0
+        self.stats = LocalCacheStats()
+        self._entries: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return 0, None
+
+        expires_at, value = entry
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return 0, None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return math.ceil(remaining), value
+
+    def set(self, key: str, value: Union[str, bytes], expire: Optional[int] = None):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+
+        self._remove(key)
+
+        # values that could never fit would just flush the whole cache
+        if len(value) > self.max_bytes:
+            return
+
+        ttl = self.max_ttl if not expire else min(int(expire), self.max_ttl)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.size += len(value)
+
+        while self.size > self.max_bytes:
+            evicted_key = next(iter(self._entries))
+            self._remove(evicted_key)
+            self.stats.evictions += 1
+
+    def delete(self, key: str) -> bool:
+        removed = self._remove(key)
+        if removed:
+            self.stats.invalidations += 1
+        return removed
+
+    def clear(self, namespace: Optional[str] = None) -> int:
+        """Removes every entry, or only the entries within the given namespace"""
+        if namespace:
+            keys = [key for key in self._entries if key.startswith(namespace)]
+        else:
+            keys = list(self._entries)
+
+        for key in keys:
+            self._remove(key)
+
+        self.stats.invalidations += len(keys)
+        return len(keys)
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= len(entry[1])
+        return True
+
+
+class LayeredBackend(Backend):
+    """Serves cache reads from a bounded in-process tier before falling back to a shared backend (Redis)
+
+    Writes go to both tiers. Every write and clear is broadcast over Redis pub/sub
+    so the local tier of every other worker drops its copy of the affected keys.
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        local: LocalCache,
+        redis=None,
+        channel: Optional[str] = None,
+    ):
+        """Initializes the layered backend
+
+        Args:
+            backend (Backend): The shared backend that holds the authoritative copy of each entry
+            local (LocalCache): The in-process tier
+            redis: The async Redis client used for pub/sub eviction, or None to disable it
+            channel (str): The pub/sub channel eviction messages are exchanged on
+        """
+
+        self.backend = backend
+        self.local = local
+        self.redis = redis
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.logger = logging.getLogger(__name__)
+
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        if cache_refresh.get():
+            return 0, None
+
+        ttl, value = self.local.get_with_ttl(key)
+        if value is not None:
+            return ttl, value
+
+        ttl, value = await self.backend.get_with_ttl(key)
+        # -1 means the key has no expiry, -2 that it does not exist
+        if value is not None and ttl != -2:
+            self.local.set(key, value, ttl if ttl > 0 else None)
+        return ttl, value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        _, value = await self.get_with_ttl(key)
+        return value
+
+    async def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        await self.backend.set(key, value, expire)
+        self.local.set(key, value, expire)
+        await self._publish(key=key)
+
+    async def clear(
+        self, namespace: Optional[str] = None, key: Optional[str] = None
+    ) -> int:
+        count = await self.backend.clear(namespace, key)
+        self._evict(namespace, key)
+        await self._publish(namespace=namespace, key=key)
+        return count
+
+    async def start(self) -> None:
+        """Subscribes to the eviction channel"""
+        if self.redis is None or self._listener is not None:
+            return
+
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """Unsubscribes from the eviction channel"""
+        if self._listener is None:
+            return
+
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+        self._listener = None
+
+    def stats(self) -> dict:
+        stats = asdict(self.local.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(
+            {
+                "entries": len(self.local),
+                "bytes": self.local.size,
+                "max_bytes": self.local.max_bytes,
+                "hit_ratio": stats["hits"] / lookups if lookups else 0.0,
+                "pubsub": self._listener is not None,
+            }
+        )
+        return stats
+
+    def _evict(self, namespace: Optional[str] = None, key: Optional[str] = None):
+        if namespace:
+            self.local.clear(namespace)
+        elif key:
+            self.local.delete(key)
+
+    async def _publish(
+        self, namespace: Optional[str] = None, key: Optional[str] = None
+    ) -> None:
+        if self.redis is None:
+            return
+
+        message = json.dumps(
+            {"origin": self.origin, "namespace": namespace, "key": key}
+        )
+        try:
+            await self.redis.publish(self.channel, message)
+        except Exception as e:
+            self.logger.warning(f"Error publishing cache eviction: {e}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                self._pubsub = self.redis.pubsub()
+                await self._pubsub.subscribe(self.channel)
+                self.logger.info(f"Listening for cache evictions on {self.channel}")
+
+                async for message in self._pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    self._handle_message(message["data"])
+            except asyncio.CancelledError:
+                await self._close_pubsub()
+                raise
+            except Exception as e:
+                self.logger.error(f"Cache eviction listener failed: {e}")
+
+            # anything published while we were disconnected is lost, so start over
+            self.local.clear()
+            await self._close_pubsub()
+            await asyncio.sleep(1)
+
+    def _handle_message(self, data: Union[str, bytes]) -> None:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            self.logger.warning(f"Ignoring malformed cache eviction: {data!r}")
+            return
+
+        if message.get("origin") == self.origin:
+            return
+
+        self._evict(message.get("namespace"), message.get("key"))
+
+    async def _close_pubsub(self) -> None:
+        if self._pubsub is None:
+            return
+        try:
+            await self._pubsub.close()
+        except Exception:
+            pass
+        self._pubsub = None
@@ -0,0 +1,77 @@
+""" Response body compression and Accept-Encoding negotiation """
+
+import gzip
+from typing import Iterable, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+IDENTITY = "identity"
+
+
+def available_encodings() -> tuple[str, ...]:
+    """Returns the supported content encodings, most preferred first"""
+    if brotli is not None:
+        return ("br", "gzip")
+    return ("gzip",)
+
+
+def compress(
+    body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 5
+) -> bytes:
+    if encoding == "gzip":
+        # a fixed mtime keeps the output stable for identical bodies
+        return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=brotli_quality)
+    if encoding == IDENTITY:
+        return body
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def negotiate(accept_encoding: Optional[str], encodings: Iterable[str]) -> str:
+    """Picks the content encoding for a response from the Accept-Encoding request header
+
+    Args:
+        accept_encoding (str): The Accept-Encoding header, if any
+        encodings (Iterable[str]): The supported encodings, most preferred first
+
+    Returns:
+        str: The chosen encoding, or identity when none of the supported ones are acceptable
+    """
+
+    if not accept_encoding:
+        return IDENTITY
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+
+    best, best_weight = IDENTITY, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        # ties go to the earlier, more preferred encoding
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Returns the ETag of the given encoding of a representation, which must differ from the identity one"""
+    if encoding == IDENTITY:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
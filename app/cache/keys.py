@@ -0,0 +1,41 @@
+""" Cache and request keys """
+
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi_cache.key_builder import default_key_builder
+from starlette.datastructures import URL
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.cache.versions import data_versions
+
+
+def request_key(url: URL) -> str:
+    """Returns the path and query string of the URL, with the query parameters in a stable order"""
+    query = sorted(parse_qsl(url.query, keep_blank_values=True))
+    if query:
+        return f"{url.path}?{urlencode(query)}"
+    return url.path
+
+
+async def versioned_key_builder(
+    func: Callable,
+    namespace: Optional[str] = "",
+    request: Optional[Request] = None,
+    response: Optional[Response] = None,
+    args: Optional[tuple] = None,
+    kwargs: Optional[dict] = None,
+) -> str:
+    """Builds the default cache key, suffixed with the data version of the namespace
+
+    A new version moves every endpoint in the namespace to fresh keys, so nothing
+    computed before an update is served after it.
+    """
+
+    key = default_key_builder(func, namespace, request, response, args, kwargs)
+    if not namespace:
+        return key
+
+    version = await data_versions.get(namespace)
+    return f"{key}:v{version}"
@@ -0,0 +1,113 @@
+""" Approximate request frequency tracking used to pick which cache keys are worth warming """
+
+import hashlib
+import time
+from typing import Iterable, Optional
+
+
+class AccessSketch:
+    """Count-min sketch of request keys with a bounded set of heavy hitters
+
+    Counts are halved every half-life so the heavy hitters follow recent traffic
+    rather than everything seen since startup.
+    """
+
+    def __init__(
+        self,
+        width: int = 2048,
+        depth: int = 4,
+        capacity: int = 256,
+        half_life: float = 3600,
+    ):
+        """Initializes the sketch
+
+        Args:
+            width (int): The number of counters per row
+            depth (int): The number of rows (independent hash functions)
+            capacity (int): The number of heavy hitters to keep track of
+            half_life (float): The number of seconds after which all counts are halved
+        """
+
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+        self.half_life = half_life
+        self.total = 0
+
+        self._table = [[0] * width for _ in range(depth)]
+        self._heavy_hitters: dict[str, int] = {}
+        self._floor = 0
+        self._last_decay = time.monotonic()
+
+    def record(self, key: str) -> int:
+        """Records a single access of the given key and returns its estimated count"""
+        self._decay_if_due()
+
+        columns = self._columns(key)
+        estimate = min(self._table[row][col] for row, col in enumerate(columns)) + 1
+
+        # conservative update, only the counters holding the minimum are raised
+        for row, col in enumerate(columns):
+            if self._table[row][col] < estimate:
+                self._table[row][col] = estimate
+
+        self.total += 1
+        self._track(key, estimate)
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """Returns the estimated number of accesses of the given key"""
+        return min(self._table[row][col] for row, col in enumerate(self._columns(key)))
+
+    def top(
+        self,
+        count: int,
+        prefixes: Optional[Iterable[str]] = None,
+        min_hits: int = 1,
+    ) -> list[tuple[str, int]]:
+        """Returns the most frequently accessed keys, optionally limited to the given path prefixes"""
+        prefixes = tuple(prefixes) if prefixes else None
+
+        candidates = [
+            (key, hits)
+            for key, hits in self._heavy_hitters.items()
+            if hits >= min_hits and (prefixes is None or key.startswith(prefixes))
+        ]
+        candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+        return candidates[:count]
+
+    def _columns(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], "little")
+        h2 = int.from_bytes(digest[4:], "little") | 1
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def _track(self, key: str, estimate: int) -> None:
+        if key in self._heavy_hitters or len(self._heavy_hitters) < self.capacity:
+            self._heavy_hitters[key] = estimate
+            return
+
+        # the floor can lag behind the real minimum, which only makes this check conservative
+        if estimate <= self._floor:
+            return
+
+        coldest = min(self._heavy_hitters, key=self._heavy_hitters.get)
+        if estimate > self._heavy_hitters[coldest]:
+            del self._heavy_hitters[coldest]
+            self._heavy_hitters[key] = estimate
+        self._floor = min(self._heavy_hitters.values())
+
+    def _decay_if_due(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decay < self.half_life:
+            return
+
+        self._last_decay = now
+        for row in self._table:
+            for col in range(self.width):
+                row[col] >>= 1
+
+        self._heavy_hitters = {
+            key: hits >> 1 for key, hits in self._heavy_hitters.items() if hits >> 1
+        }
+        self._floor = min(self._heavy_hitters.values(), default=0)
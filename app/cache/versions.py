@@ -0,0 +1,100 @@
+""" Version numbers of the data behind cached responses, bumped whenever the updaters store new data """
+
+import hashlib
+import logging
+import time
+from typing import Optional
+
+
+class DataVersions:
+    """Tracks a version number per data domain (incidents, agencies), shared across workers through Redis"""
+
+    MAX_ETAGS = 4096
+    """ The maximum number of memoized ETags per domain and version """
+
+    def __init__(self):
+        self.redis = None
+        self.prefix = ""
+        self.refresh_interval = 1.0
+        self.logger = logging.getLogger(__name__)
+
+        self._versions: dict[str, tuple[float, int]] = {}
+        self._etags: dict[str, tuple[int, dict[str, str]]] = {}
+
+    def init(self, redis, prefix: str, refresh_interval: float = 1.0) -> None:
+        """Shares the versions through the given async Redis client
+
+        Args:
+            redis: The async Redis client
+            prefix (str): The prefix of the Redis keys holding the versions
+            refresh_interval (float): The number of seconds a version read from Redis is reused for
+        """
+
+        self.redis = redis
+        self.prefix = prefix
+        self.refresh_interval = refresh_interval
+        self._versions.clear()
+
+    async def get(self, domain: str) -> int:
+        """Returns the current version of the given domain"""
+        fetched_at, version = self._versions.get(domain, (None, 0))
+
+        if self.redis is None or (
+            fetched_at is not None
+            and time.monotonic() - fetched_at < self.refresh_interval
+        ):
+            return version
+
+        try:
+            version = int(await self.redis.get(self.__key(domain)) or 0)
+        except Exception as e:
+            self.logger.warning(f"Error reading {domain} data version: {e}")
+
+        self._versions[domain] = (time.monotonic(), version)
+        return version
+
+    async def bump(self, domain: str) -> int:
+        """Marks the data of the given domain as changed and returns the new version"""
+        _, version = self._versions.get(domain, (None, 0))
+
+        if self.redis is None:
+            version += 1
+        else:
+            try:
+                version = int(await self.redis.incr(self.__key(domain)))
+            except Exception as e:
+                self.logger.warning(f"Error bumping {domain} data version: {e}")
+                version += 1
+
+        self._versions[domain] = (time.monotonic(), version)
+        return version
+
+    async def etag(self, domain: str, key: str) -> str:
+        """Returns the strong ETag of the response for the given request key at the current version
+
+        ETags are memoized for the lifetime of a version, so they are only hashed once per version
+        """
+
+        version = await self.get(domain)
+
+        memo_version, etags = self._etags.get(domain, (None, None))
+        if memo_version != version:
+            etags = {}
+            self._etags[domain] = (version, etags)
+
+        etag = etags.get(key)
+        if etag is None:
+            digest = hashlib.blake2b(
+                f"{domain}:{version}:{key}".encode("utf-8"), digest_size=12
+            ).hexdigest()
+            etag = f'"{digest}"'
+            if len(etags) < self.MAX_ETAGS:
+                etags[key] = etag
+
+        return etag
+
+    def __key(self, domain: str) -> str:
+        return f"{self.prefix}:version:{domain}"
+
+
+data_versions = DataVersions()
@@ -0,0 +1,147 @@
+""" Recomputes the most requested cached responses right after the underlying data changes """
+
+import asyncio
+import logging
+import time
+from typing import Iterable
+
+from fastapi_cache import FastAPICache
+
+from app.cache.backends import LayeredBackend, cache_refresh
+from app.cache.sketch import AccessSketch
+
+WARMING_SCOPE_KEY = "lcwc.cache_warming"
+""" Marks requests issued by the warmer so they are not counted as real traffic
+
+It is set in the ASGI scope rather than as a header, so clients cannot claim it.
+"""
+
+
+def is_warming(scope: dict) -> bool:
+    """Returns whether the request of the given ASGI scope was issued by the warmer"""
+    return scope.get(WARMING_SCOPE_KEY, False)
+
+
+class CacheWarmer:
+    def __init__(
+        self,
+        app,
+        sketch: AccessSketch,
+        max_keys: int,
+        time_budget: float,
+        cpu_budget: float,
+        min_hits: int = 2,
+    ):
+        """Initializes the cache warmer
+
+        Args:
+            app: The ASGI application the requests are dispatched to
+            sketch (AccessSketch): The access frequencies of real traffic
+            max_keys (int): The maximum number of keys warmed per run
+            time_budget (float): The maximum number of wall-clock seconds spent per run
+            cpu_budget (float): The maximum number of CPU seconds spent per run
+            min_hits (int): The minimum estimated number of accesses for a key to be warmed
+        """
+
+        self.app = app
+        self.sketch = sketch
+        self.max_keys = max_keys
+        self.time_budget = time_budget
+        self.cpu_budget = cpu_budget
+        self.min_hits = min_hits
+        self.logger = logging.getLogger(__name__)
+
+    async def warm(self, prefixes: Iterable[str]) -> int:
+        """Recomputes the hottest cached responses under the given path prefixes
+
+        Returns:
+            int: The number of keys that were warmed
+        """
+
+        if not isinstance(FastAPICache.get_backend(), LayeredBackend):
+            self.logger.debug("Cache warming requires the layered cache backend")
+            return 0
+
+        keys = self.sketch.top(self.max_keys, prefixes, self.min_hits)
+        if not keys:
+            return 0
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        warmed = 0
+
+        for key, hits in keys:
+            if (
+                time.perf_counter() - wall_start >= self.time_budget
+                or time.process_time() - cpu_start >= self.cpu_budget
+            ):
+                break
+
+            token = cache_refresh.set(True)
+            try:
+                status = await self.__dispatch(key)
+            except Exception as e:
+                self.logger.error(f"Error warming {key}: {e}")
+                continue
+            finally:
+                cache_refresh.reset(token)
+
+            if status == 200:
+                warmed += 1
+            else:
+                self.logger.debug(f"Warming {key} returned {status}")
+
+            # keep the event loop responsive between keys
+            await asyncio.sleep(0)
+
+        self.logger.info(
+            f"Warmed {warmed}/{len(keys)} cache keys in {time.perf_counter() - wall_start:0.2f} seconds "
+            f"({time.process_time() - cpu_start:0.2f} CPU seconds)"
+        )
+        return warmed
+
+    async def __dispatch(self, key: str) -> int:
+        """Issues an in-process GET request for the given path and query string"""
+
+        path, _, query = key.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode("latin-1"),
+            "root_path": "",
+            "query_string": query.encode("latin-1"),
+            "headers": [(b"host", b"localhost")],
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+            WARMING_SCOPE_KEY: True,
+        }
+
+        status = None
+        request_sent = False
+        response_complete = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # only report a disconnect once the response is done, otherwise it is abandoned
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                response_complete.set()
+
+        await self.app(scope, receive, send)
+        response_complete.set()
+        return status
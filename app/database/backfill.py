@@ -0,0 +1,50 @@
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from app.database.connection import create_database
+from app.services.rollups import heatmap_rollup, timeseries_rollup
+
+""" Rebuilds the pre-aggregated incident counts from the incidents table
+
+Usage: python -m app.database.backfill [heatmap] [timeseries]
+"""
+
+ROLLUPS = {
+    "heatmap": heatmap_rollup,
+    "timeseries": timeseries_rollup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuilds the pre-aggregated incident counts from the incidents table"
+    )
+    parser.add_argument(
+        "rollups",
+        nargs="*",
+        choices=sorted(ROLLUPS),
+        help="The rollups to rebuild, all of them when omitted",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-2s %(message)s")
+    logger = logging.getLogger(__name__)
+
+    load_dotenv(".env")
+    database = create_database()
+    database.connect()
+
+    for name in args.rollups or sorted(ROLLUPS):
+        rollup = ROLLUPS[name]
+        database.create_tables([rollup.model])
+        counted = rollup.rebuild(batch_size=args.batch_size)
+        logger.info(f"Rebuilt {name} from {counted} incident(s)")
+
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import os
+from peewee import Database, MySQLDatabase, SqliteDatabase
+
+from app.database.models import database_proxy
+
+
+def create_database() -> Database:
+    """Creates the database configured in the environment and binds the models to it"""
+
+    sqlite_db = os.getenv("SQLITE_DB")
+
+    if sqlite_db:
+        database = SqliteDatabase(sqlite_db)
+    else:
+        database = MySQLDatabase(
+            os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=int(os.getenv("DB_PORT")),
+        )
+
+    database_proxy.initialize(database)
+    return database
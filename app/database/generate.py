@@ -0,0 +1,670 @@
+import argparse
+import bisect
+import csv
+import datetime
+import itertools
+import logging
+import math
+import os
+import time
+import uuid
+from typing import Iterator, Optional
+from zoneinfo import ZoneInfo
+
+import faker
+from dotenv import load_dotenv
+from lcwc.category import IncidentCategory
+from peewee import fn
+
+from app.database.connection import create_database
+from app.database.migrations import migrate_schema
+from app.database.models.agency import Agency
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+from app.database.seed import AgencyProvider, IncidentProvider, UnitProvider
+from app.services.rollups import heatmap_rollup, timeseries_rollup
+from app.utils import geo
+
+""" Generates a large synthetic incident dataset for performance work
+
+Usage:
+    python -m app.database.generate --incidents 1000000 [--days 365] [--seed 0]
+    python -m app.database.generate --incidents 1000000 --output dataset/
+
+Incidents are spread over the municipalities of Lancaster County with Zipf-distributed
+frequencies, happen at a set of recurring intersections per municipality and follow a
+per-category time of day pattern. The same seed always produces the same dataset.
+
+By default the rows are written to the database configured in the environment in
+batched transactions, and the rollups are rebuilt afterwards. With --output, CSV files
+suitable for bulk loading (LOAD DATA INFILE, or .import in sqlite3) are written instead.
+"""
+
+LANCASTER_BOUNDS = (39.72, -76.72, 40.32, -75.87)
+""" Bounding box of Lancaster County as (south, west, north, east) """
+
+MUNICIPALITIES = [
+    "LANCASTER CITY",
+    "MANHEIM TOWNSHIP",
+    "EAST HEMPFIELD TOWNSHIP",
+    "LANCASTER TOWNSHIP",
+    "EAST LAMPETER TOWNSHIP",
+    "WEST LAMPETER TOWNSHIP",
+    "WARWICK TOWNSHIP",
+    "MANOR TOWNSHIP",
+    "EPHRATA BOROUGH",
+    "ELIZABETHTOWN BOROUGH",
+    "COLUMBIA BOROUGH",
+    "EPHRATA TOWNSHIP",
+    "WEST HEMPFIELD TOWNSHIP",
+    "RAPHO TOWNSHIP",
+    "MOUNT JOY BOROUGH",
+    "LITITZ BOROUGH",
+    "EARL TOWNSHIP",
+    "EAST EARL TOWNSHIP",
+    "PENN TOWNSHIP",
+    "SALISBURY TOWNSHIP",
+    "MILLERSVILLE BOROUGH",
+    "UPPER LEACOCK TOWNSHIP",
+    "WEST DONEGAL TOWNSHIP",
+    "MOUNT JOY TOWNSHIP",
+    "EAST COCALICO TOWNSHIP",
+    "WEST EARL TOWNSHIP",
+    "MANHEIM BOROUGH",
+    "NEW HOLLAND BOROUGH",
+    "CONESTOGA TOWNSHIP",
+    "STRASBURG TOWNSHIP",
+    "PARADISE TOWNSHIP",
+    "LEACOCK TOWNSHIP",
+    "EAST DONEGAL TOWNSHIP",
+    "WEST COCALICO TOWNSHIP",
+    "SADSBURY TOWNSHIP",
+    "DRUMORE TOWNSHIP",
+    "PROVIDENCE TOWNSHIP",
+    "MARTIC TOWNSHIP",
+    "COLERAIN TOWNSHIP",
+    "CLAY TOWNSHIP",
+    "BRECKNOCK TOWNSHIP",
+    "CAERNARVON TOWNSHIP",
+    "CONOY TOWNSHIP",
+    "PEQUEA TOWNSHIP",
+    "FULTON TOWNSHIP",
+    "LITTLE BRITAIN TOWNSHIP",
+    "BART TOWNSHIP",
+    "EDEN TOWNSHIP",
+    "EAST DRUMORE TOWNSHIP",
+    "ELIZABETH TOWNSHIP",
+    "QUARRYVILLE BOROUGH",
+    "DENVER BOROUGH",
+    "AKRON BOROUGH",
+    "MOUNTVILLE BOROUGH",
+    "EAST PETERSBURG BOROUGH",
+    "MARIETTA BOROUGH",
+    "STRASBURG BOROUGH",
+    "ADAMSTOWN BOROUGH",
+    "TERRE HILL BOROUGH",
+    "CHRISTIANA BOROUGH",
+]
+""" Municipalities in (roughly) decreasing order of call volume, the rank of the Zipf distribution """
+
+CATEGORY_WEIGHTS = {
+    IncidentCategory.MEDICAL: 0.62,
+    IncidentCategory.TRAFFIC: 0.21,
+    IncidentCategory.FIRE: 0.17,
+}
+
+DESCRIPTIONS = {
+    IncidentCategory.FIRE: (
+        "FIRE ALARM",
+        "BUILDING FIRE",
+        "VEHICLE FIRE",
+        "GAS LEAK",
+        "BRUSH FIRE",
+        "CARBON MONOXIDE ALARM",
+        "WIRES DOWN",
+    ),
+    IncidentCategory.MEDICAL: (
+        "MEDICAL EMERGENCY",
+        "FALLS",
+        "BREATHING PROBLEMS",
+        "SICK PERSON",
+        "CHEST PAINS",
+        "UNCONSCIOUS PERSON",
+        "STROKE",
+    ),
+    IncidentCategory.TRAFFIC: (
+        "VEHICLE ACCIDENT-NO INJURIES",
+        "VEHICLE ACCIDENT-INJURIES",
+        "DISABLED VEHICLE",
+        "ROAD OBSTRUCTION",
+        "TRAFFIC CONTROL",
+    ),
+}
+
+HOURLY_WEIGHTS = {
+    # medical calls follow the waking day
+    IncidentCategory.MEDICAL: (
+        3, 3, 2, 2, 2, 2, 3, 4, 5, 6, 6, 6, 6, 6, 6, 6, 6, 6, 5, 5, 5, 4, 4, 3,
+    ),
+    # crashes peak with the morning and evening commutes
+    IncidentCategory.TRAFFIC: (
+        2, 1, 1, 1, 1, 2, 4, 8, 7, 5, 5, 5, 6, 6, 7, 9, 10, 9, 6, 5, 4, 3, 3, 2,
+    ),
+    # alarms and fires peak around dinner time
+    IncidentCategory.FIRE: (
+        3, 3, 2, 2, 2, 2, 3, 4, 5, 5, 6, 6, 6, 6, 6, 7, 7, 8, 8, 7, 6, 5, 4, 3,
+    ),
+}
+""" Relative call volume per hour of the local day """
+
+MEDIAN_DURATION = {
+    IncidentCategory.MEDICAL: 45,
+    IncidentCategory.TRAFFIC: 40,
+    IncidentCategory.FIRE: 60,
+}
+""" Median time in minutes between dispatch and resolution, durations are log-normal around it """
+
+TIMEZONE = ZoneInfo("America/New_York")
+
+INCIDENT_FIELDS = [
+    Incident.id,
+    Incident.category,
+    Incident.description,
+    Incident.intersection,
+    Incident.municipality,
+    Incident.dispatched_at,
+    Incident.number,
+    Incident.priority,
+    Incident.agency,
+    Incident.latitude,
+    Incident.longitude,
+    Incident.geohash,
+    Incident.added_at,
+    Incident.updated_at,
+    Incident.resolved_at,
+    Incident.client,
+    Incident.automatically_resolved,
+]
+
+UNIT_FIELDS = [
+    Unit.id,
+    Unit.incident,
+    Unit.name,
+    Unit.short_name,
+    Unit.added_at,
+    Unit.removed_at,
+    Unit.last_seen,
+    Unit.automatically_removed,
+]
+
+AGENCY_FIELDS = [
+    Agency.id,
+    Agency.category,
+    Agency.station_id,
+    Agency.name,
+    Agency.url,
+    Agency.address,
+    Agency.city,
+    Agency.state,
+    Agency.zip_code,
+    Agency.phone,
+    Agency.updated_at,
+]
+
+CLIENT = "generator"
+""" Stored as the client of generated incidents, so they can be told apart from real ones """
+
+STREET_POOL = 2000
+""" Number of distinct street names intersections are made of """
+
+INSERT_ROWS = 1000
+""" Rows per INSERT statement, keeps the number of bound parameters within SQLite's limit """
+
+
+def zipf_weights(count: int, exponent: float) -> list[float]:
+    return [1 / (rank**exponent) for rank in range(1, count + 1)]
+
+
+class Municipality:
+    """A municipality with its recurring intersections and the stations that serve it"""
+
+    def __init__(self, name: str, latitude: float, longitude: float):
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.intersections: list[tuple[str, float, float, str]] = []
+        self.intersection_weights: list[float] = []
+        self.stations: dict[IncidentCategory, Agency] = {}
+
+
+class DatasetGenerator:
+    """Generates incidents, units and agencies from a seed
+
+    Args:
+        seed (int): Seed of every random choice, the same seed produces the same dataset
+        start (datetime.datetime): The earliest dispatch time, in UTC
+        end (datetime.datetime): The latest dispatch time, in UTC
+        municipality_exponent (float): Exponent of the Zipf distribution of incidents over municipalities
+        intersection_share (float): Share of incidents at one of the recurring intersections
+    """
+
+    def __init__(
+        self,
+        seed: int,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        municipality_exponent: float = 1.0,
+        intersection_share: float = 0.7,
+    ):
+        self.fake = faker.Faker("en_US")
+        self.fake.add_provider(AgencyProvider)
+        self.fake.add_provider(IncidentProvider)
+        self.fake.add_provider(UnitProvider)
+        self.fake.seed_instance(seed)
+        self.random = self.fake.random
+
+        self.start = start
+        self.end = end
+        self.intersection_share = intersection_share
+
+        self.categories = list(CATEGORY_WEIGHTS)
+        self.category_weights = list(
+            itertools.accumulate(CATEGORY_WEIGHTS[c] for c in self.categories)
+        )
+        self.hour_weights = {
+            category: list(itertools.accumulate(weights))
+            for category, weights in HOURLY_WEIGHTS.items()
+        }
+
+        # drawing from a pool is far cheaper than asking faker for every incident
+        self.streets = [self.fake.street_name().upper() for _ in range(STREET_POOL)]
+        self.municipalities = self.__create_municipalities()
+        self.municipality_weights = list(
+            itertools.accumulate(
+                zipf_weights(len(self.municipalities), municipality_exponent)
+            )
+        )
+
+    def __create_municipalities(self) -> list[Municipality]:
+        south, west, north, east = LANCASTER_BOUNDS
+        municipalities = []
+        station_ids = iter(range(1, 100))
+
+        for rank, name in enumerate(MUNICIPALITIES, start=1):
+            municipality = Municipality(
+                name,
+                self.random.uniform(south + 0.05, north - 0.05),
+                self.random.uniform(west + 0.05, east - 0.05),
+            )
+
+            # busier municipalities are larger and have more distinct trouble spots
+            spread = 0.01 + 0.03 * (1 - 1 / math.sqrt(rank))
+            for _ in range(max(8, int(240 / math.sqrt(rank)))):
+                latitude, longitude = self.__near(municipality, spread)
+                municipality.intersections.append(
+                    (
+                        self.__intersection(),
+                        latitude,
+                        longitude,
+                        geo.encode(latitude, longitude),
+                    )
+                )
+            municipality.intersection_weights = list(
+                itertools.accumulate(zipf_weights(len(municipality.intersections), 1.1))
+            )
+
+            station_id = f"{next(station_ids):02d}"
+            # drop the "TOWNSHIP" or "BOROUGH" suffix
+            city = name.rsplit(" ", 1)[0].title()
+            for category in self.categories:
+                municipality.stations[category] = Agency(
+                    id=self.__uuid(),
+                    category=category.value,
+                    station_id=station_id,
+                    name=self.fake.agency_company(city, category),
+                    url=self.fake.url(),
+                    address=self.fake.street_address(),
+                    city=city,
+                    state="PA",
+                    zip_code=str(self.random.randint(17501, 17603)),
+                    phone=self.fake.phone_number(),
+                    updated_at=self.start,
+                )
+
+            municipalities.append(municipality)
+
+        return municipalities
+
+    def __near(self, municipality: Municipality, spread: float) -> tuple[float, float]:
+        south, west, north, east = LANCASTER_BOUNDS
+        latitude = min(max(self.random.gauss(municipality.latitude, spread), south), north)
+        longitude = min(max(self.random.gauss(municipality.longitude, spread), west), east)
+        return round(latitude, 6), round(longitude, 6)
+
+    def __intersection(self) -> str:
+        return f"{self.random.choice(self.streets)} / {self.random.choice(self.streets)}"
+
+    def __uuid(self) -> uuid.UUID:
+        return uuid.UUID(int=self.random.getrandbits(128), version=4)
+
+    def __pick(self, elements: list, cumulative_weights: list[float]):
+        point = self.random.random() * cumulative_weights[-1]
+        return elements[bisect.bisect(cumulative_weights, point)]
+
+    def __dispatch_time(self, category: IncidentCategory) -> datetime.datetime:
+        """Picks a dispatch time within the range, weighted by the local hour of day"""
+        days = (self.end - self.start).days or 1
+        while True:
+            day = self.start.date() + datetime.timedelta(days=self.random.randrange(days))
+            hour = self.__pick(range(24), self.hour_weights[category])
+            local = datetime.datetime(
+                day.year,
+                day.month,
+                day.day,
+                hour,
+                self.random.randrange(60),
+                self.random.randrange(60),
+                tzinfo=TIMEZONE,
+            )
+            dispatched_at = local.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            if self.start <= dispatched_at < self.end:
+                return dispatched_at
+
+    def agencies(self) -> list[Agency]:
+        return [
+            station
+            for municipality in self.municipalities
+            for station in municipality.stations.values()
+        ]
+
+    def incidents(
+        self, count: int, first_number: int, now: datetime.datetime
+    ) -> Iterator[tuple[tuple, list[tuple]]]:
+        """Yields the row of every incident, in the order of INCIDENT_FIELDS, with the rows of its units
+
+        Incidents still going on at the given time are left unresolved.
+        """
+
+        for number in range(first_number, first_number + count):
+            category = self.__pick(self.categories, self.category_weights)
+            municipality = self.__pick(self.municipalities, self.municipality_weights)
+            dispatched_at = self.__dispatch_time(category)
+
+            if self.random.random() < self.intersection_share:
+                intersection, latitude, longitude, geohash = self.__pick(
+                    municipality.intersections, municipality.intersection_weights
+                )
+            else:
+                intersection = self.__intersection()
+                latitude, longitude = self.__near(municipality, 0.03)
+                geohash = geo.encode(latitude, longitude)
+
+            duration = datetime.timedelta(
+                seconds=round(
+                    60
+                    * self.random.lognormvariate(math.log(MEDIAN_DURATION[category]), 0.6)
+                )
+            )
+            resolved_at = dispatched_at + duration
+            if resolved_at > now:
+                resolved_at = None
+
+            added_at = dispatched_at + datetime.timedelta(seconds=self.random.randint(15, 120))
+            incident_id = self.__uuid()
+            station = municipality.stations[category]
+
+            units = {}
+            # most calls get the local station, larger ones a neighbouring one as well
+            for _ in range(self.random.choices((1, 2, 3, 4), (50, 30, 15, 5))[0]):
+                serving = station
+                if units and self.random.random() < 0.4:
+                    serving = self.__pick(
+                        self.municipalities, self.municipality_weights
+                    ).stations[category]
+                short_name = self.fake.unit_short_name(category, serving.station_id)
+                if short_name in units:
+                    continue
+
+                unit_added_at = added_at + datetime.timedelta(
+                    seconds=self.random.randint(0, 300)
+                )
+                removed_at = None
+                if resolved_at is not None:
+                    removed_at = max(
+                        unit_added_at,
+                        resolved_at - datetime.timedelta(seconds=self.random.randint(0, 600)),
+                    )
+                units[short_name] = (
+                    self.__uuid(),
+                    incident_id,
+                    None,
+                    short_name,
+                    unit_added_at,
+                    removed_at,
+                    removed_at or now,
+                    False,
+                )
+
+            yield (
+                incident_id,
+                category.value,
+                self.random.choice(DESCRIPTIONS[category]),
+                intersection,
+                municipality.name,
+                dispatched_at,
+                number,
+                None if category == IncidentCategory.FIRE else self.random.randint(1, 3),
+                station.name,
+                latitude,
+                longitude,
+                geohash,
+                added_at,
+                resolved_at or added_at,
+                resolved_at,
+                CLIENT,
+                False,
+            ), list(units.values())
+
+
+class DatabaseWriter:
+    """Inserts the generated rows in batched transactions"""
+
+    def __init__(self, database, batch_size: int):
+        self.database = database
+        self.batch_size = batch_size
+
+    def write_agencies(self, agencies: list[Agency]):
+        rows = [
+            tuple(getattr(agency, field.name) for field in AGENCY_FIELDS)
+            for agency in agencies
+        ]
+        # stations that already exist, real or generated earlier, are kept as they are
+        with self.database.atomic():
+            self.__insert(Agency, AGENCY_FIELDS, rows, ignore_conflicts=True)
+
+    def write_incidents(self, incidents: Iterator) -> Iterator[int]:
+        """Writes the incidents, yielding the number written after every batch"""
+        written = 0
+        while True:
+            batch = list(itertools.islice(incidents, self.batch_size))
+            if not batch:
+                break
+
+            with self.database.atomic():
+                self.__insert(Incident, INCIDENT_FIELDS, [row for row, _ in batch])
+                self.__insert(
+                    Unit, UNIT_FIELDS, [unit for _, units in batch for unit in units]
+                )
+
+            written += len(batch)
+            yield written
+
+    @staticmethod
+    def __insert(model, fields: list, rows: list[tuple], ignore_conflicts: bool = False):
+        for start in range(0, len(rows), INSERT_ROWS):
+            query = model.insert_many(rows[start : start + INSERT_ROWS], fields=fields)
+            if ignore_conflicts:
+                query = query.on_conflict_ignore()
+            query.execute()
+
+
+class CsvWriter:
+    """Writes the generated rows to CSV files for bulk loading, with \\N for nulls"""
+
+    def __init__(self, directory: str, batch_size: int):
+        self.directory = directory
+        self.batch_size = batch_size
+        os.makedirs(directory, exist_ok=True)
+
+    def __open(self, model, fields: list):
+        file = open(
+            os.path.join(self.directory, f"{model._meta.table_name}.csv"),
+            "w",
+            newline="",
+            encoding="utf-8",
+        )
+        writer = csv.writer(file)
+        writer.writerow([field.column_name for field in fields])
+        return file, writer
+
+    @staticmethod
+    def __format(fields: list, row: tuple) -> list:
+        values = []
+        for field, value in zip(fields, row):
+            value = field.db_value(value)
+            if value is None:
+                values.append("\\N")
+            elif isinstance(value, bool):
+                values.append(int(value))
+            else:
+                values.append(value)
+        return values
+
+    def write_agencies(self, agencies: list[Agency]):
+        file, writer = self.__open(Agency, AGENCY_FIELDS)
+        with file:
+            for agency in agencies:
+                row = tuple(getattr(agency, field.name) for field in AGENCY_FIELDS)
+                writer.writerow(self.__format(AGENCY_FIELDS, row))
+
+    def write_incidents(self, incidents: Iterator) -> Iterator[int]:
+        incident_file, incident_writer = self.__open(Incident, INCIDENT_FIELDS)
+        unit_file, unit_writer = self.__open(Unit, UNIT_FIELDS)
+
+        with incident_file, unit_file:
+            written = 0
+            for row, units in incidents:
+                incident_writer.writerow(self.__format(INCIDENT_FIELDS, row))
+                for unit in units:
+                    unit_writer.writerow(self.__format(UNIT_FIELDS, unit))
+
+                written += 1
+                if written % self.batch_size == 0:
+                    yield written
+
+            if written % self.batch_size:
+                yield written
+
+
+def next_incident_number(first_number: Optional[int]) -> int:
+    """Continues after the highest stored incident number, so generated incidents never collide with existing ones"""
+    if first_number is not None:
+        return first_number
+
+    highest = max(
+        model.select(fn.MAX(model.number)).scalar() or 0
+        for model in (Incident, ArchivedIncident)
+    )
+    return max(highest + 1, 10000000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates a large synthetic incident dataset for performance work"
+    )
+    parser.add_argument("--incidents", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365, help="spread incidents over this many days up to now")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10000, help="incidents per transaction")
+    parser.add_argument(
+        "--first-number",
+        type=int,
+        help="number of the first incident, after the highest stored one when omitted",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        help="the latest dispatch time in UTC, now when omitted (set it to reproduce a dataset exactly)",
+    )
+    parser.add_argument(
+        "--municipality-exponent",
+        type=float,
+        default=1.0,
+        help="exponent of the Zipf distribution of incidents over municipalities",
+    )
+    parser.add_argument(
+        "--output",
+        help="write CSV files for bulk loading to this directory instead of the database",
+    )
+    parser.add_argument(
+        "--truncate",
+        action="store_true",
+        help="delete the stored incidents, units and agencies first, archived ones included",
+    )
+    parser.add_argument(
+        "--skip-rollups",
+        action="store_true",
+        help="do not rebuild the rollups afterwards",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-2s %(message)s")
+    logger = logging.getLogger(__name__)
+
+    end = args.end or datetime.datetime.utcnow().replace(microsecond=0)
+    start = end - datetime.timedelta(days=args.days)
+    generator = DatasetGenerator(
+        args.seed, start, end, municipality_exponent=args.municipality_exponent
+    )
+
+    database = None
+    if args.output:
+        writer = CsvWriter(args.output, args.batch_size)
+        first_number = args.first_number or 10000000
+    else:
+        load_dotenv(".env")
+        database = create_database()
+        database.connect()
+        models = [Incident, Unit, Agency, ArchivedIncident, ArchivedUnit]
+        database.create_tables(models)
+        migrate_schema(database, models)
+
+        if args.truncate:
+            with database.atomic():
+                for model in (ArchivedUnit, ArchivedIncident, Unit, Incident, Agency):
+                    model.delete().execute()
+
+        writer = DatabaseWriter(database, args.batch_size)
+        first_number = next_incident_number(args.first_number)
+
+    writer.write_agencies(generator.agencies())
+
+    started = time.perf_counter()
+    incidents = generator.incidents(args.incidents, first_number, end)
+    for written in writer.write_incidents(incidents):
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"Generated {written}/{args.incidents} incident(s) ({written / elapsed:0.0f}/s)"
+        )
+
+    if database is not None:
+        if not args.skip_rollups:
+            for rollup in (heatmap_rollup, timeseries_rollup):
+                database.create_tables([rollup.model])
+                rollup.rebuild()
+        database.close()
+
+
+if __name__ == "__main__":
+    main()
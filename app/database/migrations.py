@@ -0,0 +1,50 @@
+import logging
+from peewee import Database, Model
+from playhouse.migrate import SchemaMigrator, migrate
+
+""" Brings existing tables up to date with the models, since create_tables only creates missing tables """
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_schema(database: Database, models: list[Model]) -> None:
+    """Adds the columns and indexes of the given models that are missing from their tables"""
+    for model in models:
+        add_missing_columns(database, model)
+        add_missing_indexes(database, model)
+
+
+def add_missing_columns(database: Database, model: Model) -> list[str]:
+    table = model._meta.table_name
+    existing = {column.name for column in database.get_columns(table)}
+    migrator = SchemaMigrator.from_database(database)
+
+    added = []
+    operations = []
+    for field in model._meta.sorted_fields:
+        if field.column_name in existing:
+            continue
+        operations.extend(migrator.add_column(table, field.column_name, field))
+        added.append(field.column_name)
+
+    if operations:
+        logger.info(f"Adding column(s) {', '.join(added)} to {table}")
+        with database.atomic():
+            migrate(*operations)
+
+    return added
+
+
+def add_missing_indexes(database: Database, model: Model) -> list[str]:
+    table = model._meta.table_name
+    existing = {index.name for index in database.get_indexes(table)}
+
+    added = []
+    for index in model._meta.fields_to_index():
+        if index._name in existing:
+            continue
+        logger.info(f"Adding index {index._name} to {table}")
+        database.execute(model._schema._create_index(index, safe=False))
+        added.append(index._name)
+
+    return added
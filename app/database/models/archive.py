@@ -0,0 +1,24 @@
+from peewee import *
+
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+
+""" Cold tier of incidents and units, resolved long enough ago that they no longer change
+
+Rows are moved here by app.services.archiver, and keep the ids they had in the hot tables.
+"""
+
+
+class ArchivedIncident(Incident):
+    class Meta:
+        table_name = "incidents_archive"
+        # history is always read by date range
+        indexes = ((("dispatched_at",), False),)
+
+
+class ArchivedUnit(Unit):
+    incident = ForeignKeyField(ArchivedIncident, backref="units")
+
+    class Meta:
+        table_name = "units_archive"
+        primary_key = CompositeKey("incident", "short_name")
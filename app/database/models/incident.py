@@ -23,6 +23,8 @@ class Incident(BaseModel):
     # TODO Use Point data type
     latitude = DecimalField(null=True)
     longitude = DecimalField(null=True)
+    # spatial index, populated at ingest (see app.utils.geo)
+    geohash = CharField(null=True, index=True, max_length=12)
 
     # meta data
     added_at = DateTimeField()
@@ -34,3 +36,5 @@ class Incident(BaseModel):
 
     class Meta:
         table_name = "incidents"
+        # exports walk the table in dispatch order
+        indexes = ((("dispatched_at",), False),)
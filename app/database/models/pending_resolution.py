@@ -0,0 +1,14 @@
+import uuid
+from app.database.models import BaseModel
+from peewee import *
+
+
+class PendingResolution(BaseModel):
+    """An unresolved incident that has dropped out of the live feed, resolved once its grace period has passed"""
+
+    incident = UUIDField(primary_key=True)
+    number = IntegerField()
+    missing_since = DateTimeField()
+
+    class Meta:
+        table_name = "pending_resolutions"
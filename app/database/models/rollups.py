@@ -0,0 +1,31 @@
+from app.database.models import BaseModel
+from peewee import *
+
+
+class HeatmapCell(BaseModel):
+    """Number of incidents per geohash cell, category and day or month"""
+
+    precision = IntegerField()
+    period = CharField(max_length=5)  # day or month
+    bucket = DateField()  # first day of the period
+    category = CharField()
+    cell = CharField(max_length=12)
+    count = IntegerField(default=0)
+
+    class Meta:
+        table_name = "incident_heatmap"
+        primary_key = CompositeKey("precision", "period", "bucket", "category", "cell")
+
+
+class IncidentCount(BaseModel):
+    """Number of incidents per hour or day, grouped by a single dimension (category, municipality or agency)"""
+
+    period = CharField(max_length=4)  # hour or day
+    dimension = CharField(max_length=12)
+    bucket = DateTimeField()  # start of the period, UTC
+    value = CharField()
+    count = IntegerField(default=0)
+
+    class Meta:
+        table_name = "incident_counts"
+        primary_key = CompositeKey("period", "dimension", "bucket", "value")
@@ -18,3 +18,5 @@ class Unit(BaseModel):
     class Meta:
         table_name = "units"
         primary_key = CompositeKey("incident", "short_name")
+        # the primary key leads with the incident, unit history is read by short name
+        indexes = ((("short_name", "added_at"), False),)
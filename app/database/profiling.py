@@ -0,0 +1,208 @@
+import contextlib
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from peewee import Database
+
+""" Opt-in SQL profiling: counts and times every statement per request or background job, and flags slow queries and N+1 patterns """
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow")
+
+LITERALS = [
+    # quoted strings and numbers, in case a statement was built with inlined values
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    # IN lists of any length have the same shape
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize(sql: str) -> str:
+    """Reduces a statement to its shape, so statements differing only in their values compare equal"""
+    for pattern, replacement in LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(shape: str) -> str:
+    return hashlib.sha1(shape.encode("utf-8")).hexdigest()[:12]
+
+
+class QueryScope:
+    """The statements issued by one request or one run of a background job"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.duration = 0.0
+        self.shapes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, shape: str, duration: float) -> None:
+        # statements of a scope may run in several worker threads at once
+        with self._lock:
+            self.queries += 1
+            self.duration += duration
+            self.shapes[shape] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Returns the statement shapes issued at least threshold times, most frequent first"""
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+current_scope: contextvars.ContextVar[Optional[QueryScope]] = contextvars.ContextVar(
+    "query_scope", default=None
+)
+""" The scope statements are attributed to, carried into worker threads by asyncio.to_thread and run_in_threadpool """
+
+
+class QueryProfiler:
+    """Wraps the execute_sql of a database to attribute every statement to the current scope
+
+    Nothing is wrapped unless init is called, so a disabled profiler costs
+    nothing beyond a no-op context manager per scope.
+    """
+
+    MAX_SUSPECTS = 50
+    """ The number of most recent suspected N+1 patterns kept for /meta/stats """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_threshold = 0.1
+        self.repeat_threshold = 10
+
+        self.scopes: dict[str, dict] = {}
+        self.slow_queries = 0
+        self.suspects: deque = deque(maxlen=self.MAX_SUSPECTS)
+        self._shapes: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def init(
+        self, database: Database, slow_threshold: float, repeat_threshold: int
+    ) -> None:
+        """
+        Args:
+            database (Database): The database whose statements are profiled
+            slow_threshold (float): The duration in seconds beyond which a statement is logged as slow
+            repeat_threshold (int): The number of identical statement shapes within one scope flagged as a suspected N+1
+        """
+
+        self.enabled = True
+        self.slow_threshold = slow_threshold
+        self.repeat_threshold = repeat_threshold
+
+        execute_sql = database.execute_sql
+
+        def profiled_execute_sql(sql, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return execute_sql(sql, *args, **kwargs)
+            finally:
+                self.__record(sql, time.perf_counter() - start)
+
+        # models reach the database through database_proxy, which resolves to this instance attribute
+        database.execute_sql = profiled_execute_sql
+        logger.info(
+            f"Profiling SQL, slow queries above {slow_threshold * 1000:.0f}ms"
+        )
+
+    def __shape(self, sql: str) -> str:
+        # the same few hundred statements are issued over and over
+        shape = self._shapes.get(sql)
+        if shape is None:
+            shape = normalize(sql)
+            if len(self._shapes) < 10000:
+                self._shapes[sql] = shape
+        return shape
+
+    def __record(self, sql: str, duration: float) -> None:
+        shape = self.__shape(sql)
+        scope = current_scope.get()
+        if scope is not None:
+            scope.record(shape, duration)
+
+        if duration >= self.slow_threshold:
+            with self._lock:
+                self.slow_queries += 1
+            slow_query_logger.warning(
+                f"Slow query ({duration * 1000:.0f}ms) in {scope.name if scope else 'unscoped'}: {shape}",
+                extra={
+                    "fingerprint": fingerprint(shape),
+                    "duration_ms": round(duration * 1000, 1),
+                    "scope": scope.name if scope else None,
+                },
+            )
+
+    @contextlib.contextmanager
+    def scope(self, name: str):
+        """Attributes the statements issued within the block to a scope of the given name
+
+        Yields:
+            QueryScope: The scope, None while the profiler is disabled
+        """
+
+        if not self.enabled:
+            yield None
+            return
+
+        scope = QueryScope(name)
+        token = current_scope.set(scope)
+        try:
+            yield scope
+        finally:
+            current_scope.reset(token)
+            self.finish(scope)
+
+    def finish(self, scope: QueryScope) -> None:
+        """Adds a closed scope to the totals and reports its repeated statement shapes"""
+        repeated = scope.repeated(self.repeat_threshold)
+
+        with self._lock:
+            totals = self.scopes.setdefault(
+                scope.name,
+                {"runs": 0, "queries": 0, "duration": 0.0, "max_queries": 0, "n_plus_one": 0},
+            )
+            totals["runs"] += 1
+            totals["queries"] += scope.queries
+            totals["duration"] += scope.duration
+            totals["max_queries"] = max(totals["max_queries"], scope.queries)
+            if repeated:
+                totals["n_plus_one"] += 1
+
+        for shape, count in repeated:
+            self.suspects.append(
+                {
+                    "scope": scope.name,
+                    "fingerprint": fingerprint(shape),
+                    "statement": shape,
+                    "count": count,
+                }
+            )
+            logger.warning(
+                f"Suspected N+1 in {scope.name}: {count} x {shape}",
+                extra={"fingerprint": fingerprint(shape), "count": count, "scope": scope.name},
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "scopes": {name: dict(totals) for name, totals in self.scopes.items()},
+                "slow_queries": self.slow_queries,
+                "suspects": list(self.suspects),
+            }
+
+
+query_profiler = QueryProfiler()
@@ -1,4 +1,3 @@
-import peewee
 import faker
 from faker.providers import BaseProvider
 
@@ -6,9 +5,9 @@ from faker.providers import BaseProvider
 from lcwc.category import IncidentCategory
 
 
-from app.api.models.agency import Agency
-from app.api.models.incident import Incident
-from app.api.models.unit import Unit
+from app.database.models.agency import Agency
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
 
 
 class AgencyProvider(BaseProvider):
@@ -51,9 +50,20 @@ class IncidentProvider(BaseProvider):
 
 
 class UnitProvider(BaseProvider):
+    UNIT_PREFIXES = {
+        IncidentCategory.FIRE: ("ENG", "TRK", "SQ", "RES", "TAN", "BR"),
+        IncidentCategory.MEDICAL: ("MED", "AMB", "INT"),
+        IncidentCategory.TRAFFIC: ("POL", "ENG", "TRK"),
+    }
+
     def unit_name(self):
         return f"{''.join(self.random_letters(3)).upper()}-{self.random_int(min=10, max=99)}"
 
+    def unit_short_name(self, category: IncidentCategory, station_id: str):
+        """A short name in the feed's format, e.g. ENG641 for engine 1 of station 64"""
+        prefix = self.random_element(elements=self.UNIT_PREFIXES[category])
+        return f"{prefix}{int(station_id)}{self.random_int(min=1, max=4)}"
+
 
 fake = faker.Faker()
 fake.add_provider(AgencyProvider)
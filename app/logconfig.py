@@ -0,0 +1,273 @@
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+""" Logging pipeline that keeps log I/O off the event loop: records are queued and written by a background thread """
+
+# attributes every LogRecord has, anything else was passed through extra=
+STANDARD_ATTRIBUTES = set(
+    logging.LogRecord("", logging.INFO, "", 0, "", None, None).__dict__
+) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-2s %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_rules(value: Optional[str]) -> dict[str, float]:
+    """Parses comma separated "logger=value" pairs, e.g. "app.services.updater=0.1,uvicorn.access=0.5" """
+    rules = {}
+    for rule in (value or "").split(","):
+        if not rule.strip():
+            continue
+        name, number = rule.split("=")
+        rules[name.strip()] = float(number)
+    return rules
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object, including any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+
+        return json.dumps(entry, default=str)
+
+
+class ModuleFilter(logging.Filter):
+    """Samples and rate limits chatty loggers, warnings and above always pass
+
+    A rule applies to the logger it names and every logger below it, the most
+    specific rule wins. Suppressed records are counted per rule.
+    """
+
+    def __init__(self, sampling: dict[str, float], rate_limits: dict[str, float]):
+        """
+        Args:
+            sampling (dict[str, float]): The fraction of records kept per logger, e.g. 0.1
+            rate_limits (dict[str, float]): The records kept per second per logger
+        """
+
+        super().__init__()
+        self.sampling = sampling
+        self.rate_limits = rate_limits
+        self.suppressed: dict[str, int] = {}
+
+        self._windows: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def __match(name: str, rules: dict[str, float]) -> Optional[str]:
+        while name:
+            if name in rules:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rule = self.__match(record.name, self.sampling)
+        if rule is not None and random.random() >= self.sampling[rule]:
+            self.__suppress(rule)
+            return False
+
+        rule = self.__match(record.name, self.rate_limits)
+        if rule is not None:
+            second = int(time.monotonic())
+            with self._lock:
+                window, count = self._windows.get(rule, (second, 0))
+                if window != second:
+                    window, count = second, 0
+                self._windows[rule] = (window, count + 1)
+            if count >= self.rate_limits[rule]:
+                self.__suppress(rule)
+                return False
+
+        return True
+
+    def __suppress(self, rule: str) -> None:
+        with self._lock:
+            self.suppressed[rule] = self.suppressed.get(rule, 0) + 1
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without ever blocking, dropping them when the queue is full
+
+    Drops are counted, and reported with a warning once the queue has room again.
+    """
+
+    def __init__(self, queue: queue.Queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the arguments are merged now, as they may change before the listener gets to
+        # them, but the rest of the formatting is left to the listener's thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            return
+
+        if self._unreported:
+            dropped, self._unreported = self._unreported, 0
+            warning = logging.LogRecord(
+                __name__,
+                logging.WARNING,
+                __file__,
+                0,
+                f"Dropped {dropped} log record(s), the log queue was full",
+                None,
+                None,
+            )
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self._unreported += dropped
+
+
+class LoggingPipeline:
+    """Routes every record through a bounded queue to the file and console handlers, written by a listener thread"""
+
+    def __init__(self):
+        self.handler: Optional[DroppingQueueHandler] = None
+        self.filter: Optional[ModuleFilter] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+
+    def init(
+        self,
+        directory: str,
+        level: int = logging.DEBUG,
+        file_level: int = logging.DEBUG,
+        console_level: int = logging.INFO,
+        json_output: bool = True,
+        queue_size: int = 10000,
+        sampling: dict[str, float] = None,
+        rate_limits: dict[str, float] = None,
+    ) -> None:
+        """
+        Args:
+            directory (str): Where the daily rotated log files are written
+            level (int): The level of the root logger
+            file_level (int): The lowest level written to the log file
+            console_level (int): The lowest level written to the console
+            json_output (bool): Whether to write JSON lines rather than plain text
+            queue_size (int): The number of records queued before new ones are dropped
+            sampling (dict[str, float]): The fraction of records kept per logger
+            rate_limits (dict[str, float]): The records kept per second per logger
+        """
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if json_output:
+            file_formatter = console_formatter = JsonFormatter()
+        else:
+            file_formatter = logging.Formatter(TEXT_FORMAT)
+            console_formatter = logging.Formatter(TEXT_FORMAT, datefmt=TEXT_DATE_FORMAT)
+
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            os.path.join(directory, "server.log"), when="midnight"
+        )
+        file_handler.setFormatter(file_formatter)
+        file_handler.setLevel(file_level)
+
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(console_formatter)
+        console_handler.setLevel(console_level)
+
+        self.filter = ModuleFilter(sampling or {}, rate_limits or {})
+        self.handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.handler.addFilter(self.filter)
+        # records below both handlers' levels are not worth queueing
+        self.handler.setLevel(min(file_level, console_level))
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(level)
+        root_logger.addHandler(self.handler)
+
+        # started from its CLI, uvicorn has already given its loggers their own
+        # synchronous handlers, send their records through the queue instead
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+
+        self.listener = logging.handlers.QueueListener(
+            self.handler.queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True,
+        )
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Writes the records still queued and stops the listener"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self) -> dict:
+        if self.handler is None:
+            return {}
+
+        return {
+            "queued": self.handler.queue.qsize(),
+            "capacity": self.handler.queue.maxsize,
+            "dropped": self.handler.dropped,
+            "suppressed": dict(self.filter.suppressed),
+        }
+
+
+log_pipeline = LoggingPipeline()
+
+
+def configure_logging() -> LoggingPipeline:
+    """Sets up the logging pipeline from the LOG_* environment variables"""
+    log_pipeline.init(
+        os.getenv("LOG_DIRECTORY", "logs"),
+        level=logging.getLevelName(os.getenv("LOG_LEVEL", "DEBUG").upper()),
+        file_level=logging.getLevelName(os.getenv("LOG_FILE_LEVEL", "DEBUG").upper()),
+        console_level=logging.getLevelName(
+            os.getenv("LOG_CONSOLE_LEVEL", "INFO").upper()
+        ),
+        json_output=os.getenv("LOG_FORMAT", "json").lower() == "json",
+        queue_size=int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+        sampling=parse_rules(os.getenv("LOG_SAMPLING")),
+        rate_limits=parse_rules(os.getenv("LOG_RATE_LIMITS")),
+    )
+    return log_pipeline
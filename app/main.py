@@ -1,21 +1,53 @@
 from distutils.util import strtobool
+import asyncio
 import logging
 import os
 import aioredis
 from fastapi_cache import FastAPICache
 import redis
+from app.cache.backends import LayeredBackend, LocalCache
+from app.cache.keys import versioned_key_builder
+from app.cache.sketch import AccessSketch
+from app.cache.versions import data_versions
+from app.cache.warmer import CacheWarmer
 import uvicorn
 from datetime import timedelta
 from app.database.models.feed_request import FeedRequest
-from app.middleware import ProcessTimeHeaderMiddleware
-from app.database.models import database_proxy
+from app.database.models.pending_resolution import PendingResolution
+from app.middleware import (
+    AccessRecorderMiddleware,
+    CompressionMiddleware,
+    ConditionalRequestMiddleware,
+    LoadSheddingMiddleware,
+    ProcessTimeHeaderMiddleware,
+    QueryProfilerMiddleware,
+    RateLimitMiddleware,
+    StaleDataMiddleware,
+)
+from app.database.connection import create_database
+from app.database.migrations import migrate_schema
+from app.database.profiling import query_profiler
 from app.database.models.incident import Incident as IncidentModel
 from app.database.models.unit import Unit as UnitModel
 from app.database.models.agency import Agency as AgencyModel
-from app.api.routes import incident, incidents, root, agencies, meta, units
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.rollups import HeatmapCell, IncidentCount
+from app.logconfig import configure_logging, log_pipeline
+from app.api.routes import incident, incidents, root, agencies, meta, snapshots, units
+from app.services.agencyindex import agency_index
 from app.services.agencyupdater import AgencyUpdater
+from app.services.archiver import IncidentArchiver
+from app.services.circuitbreaker import circuit_breakers
+from app.services.feedcapture import FeedRecorder
+from app.services.feedsources import HedgedFeed
 from app.services.geocoder import IncidentGeocoder
+from app.services.geosearch import backfill_geohashes
 from app.services.incidentresolver import IncidentResolver
+from app.services.loadshedding import LoadShedder
+from app.services.ratelimit import Limit, RateLimiter
+from app.services.rollups import heatmap_rollup, timeseries_rollup
+from app.services.snapshots import snapshot_store
+from app.services.unitactivity import unit_activity
 from app.services.updater import IncidentUpdater
 from app.utils.info import get_lcwc_version
 from dotenv import load_dotenv
@@ -27,48 +59,34 @@ from fastapi_cache.backends.redis import RedisBackend
 
 env = load_dotenv(".env")
 
-LOG_DIRECTORY = "logs"
-
+configure_logging()
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
-
-if not os.path.exists(LOG_DIRECTORY):
-    os.makedirs(LOG_DIRECTORY)
-
-file_logger = logging.handlers.TimedRotatingFileHandler(
-    os.path.join(LOG_DIRECTORY, "server.log"), when="midnight"
-)
-file_logger.setFormatter(logging.Formatter("%(asctime)s %(levelname)-2s %(message)s"))
-file_logger.setLevel(logging.DEBUG)
-root_logger.addHandler(file_logger)
-
-console_logger = logging.StreamHandler()
-console_logger.setLevel(logging.INFO)
-console_logger.setFormatter(
-    logging.Formatter(
-        "%(asctime)s %(levelname)-2s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-    )
-)
-root_logger.addHandler(console_logger)
 
 root_logger.info("Connecting to database...")
 
-sqlite_db = os.getenv("SQLITE_DB")
-
-if sqlite_db:
-    database = SqliteDatabase(sqlite_db)
-else:
-    database = MySQLDatabase(
-        os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        host=os.getenv("DB_HOST"),
-        port=int(os.getenv("DB_PORT")),
+database = create_database()
+database.connect()
+
+if strtobool(os.getenv("SQL_PROFILING_ENABLED")):
+    query_profiler.init(
+        database,
+        slow_threshold=int(os.getenv("SQL_PROFILING_SLOW_QUERY")) / 1000,
+        repeat_threshold=int(os.getenv("SQL_PROFILING_REPEAT_THRESHOLD")),
     )
 
-database_proxy.initialize(database)
-database.connect()
-database.create_tables([IncidentModel, UnitModel, AgencyModel, FeedRequest])
+models = [
+    IncidentModel,
+    UnitModel,
+    AgencyModel,
+    FeedRequest,
+    PendingResolution,
+    HeatmapCell,
+    IncidentCount,
+    ArchivedIncident,
+    ArchivedUnit,
+]
+database.create_tables(models)
+migrate_schema(database, models)
 
 
 redis_client = redis.Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"))
@@ -85,6 +103,100 @@ app = FastAPI(
     },
 )
 
+# routes whose responses only change when the updaters store new data
+versioned_routes = {
+    "/api/v1/incidents": "incidents",
+    "/api/v1/incident/": "incidents",
+    "/api/v1/agencies": "agencies",
+}
+
+app.add_middleware(
+    CompressionMiddleware,
+    versions=data_versions,
+    routes=versioned_routes,
+    store=LocalCache(
+        max_bytes=int(os.getenv("COMPRESSION_STORE_MAX_BYTES")),
+        max_ttl=int(os.getenv("COMPRESSION_STORE_MAX_TTL")),
+    ),
+    min_size=int(os.getenv("COMPRESSION_MIN_SIZE")),
+    gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL")),
+    brotli_quality=int(os.getenv("COMPRESSION_BROTLI_QUALITY")),
+)
+
+app.add_middleware(
+    ConditionalRequestMiddleware,
+    versions=data_versions,
+    routes=versioned_routes,
+)
+
+access_sketch = AccessSketch(half_life=int(os.getenv("CACHE_WARMING_HALF_LIFE")))
+app.add_middleware(AccessRecorderMiddleware, sketch=access_sketch, prefix="/api/v1/")
+
+# circuit breakers of the upstream services, while one is open the data it feeds is served as stale
+breaker_options = dict(
+    failure_threshold=int(os.getenv("CIRCUIT_BREAKER_FAILURES")),
+    reset_timeout=int(os.getenv("CIRCUIT_BREAKER_RESET")),
+)
+feed_breaker = circuit_breakers.register("feed", **breaker_options)
+agency_breaker = circuit_breakers.register("agencies", **breaker_options)
+geocoder_breaker = circuit_breakers.register("geocoder", **breaker_options)
+
+# outside the compression store, so stored responses are not marked stale
+app.add_middleware(
+    StaleDataMiddleware,
+    breakers={"incidents": feed_breaker, "agencies": agency_breaker},
+    routes=versioned_routes,
+)
+
+# outside the compression store, so stored responses do not carry a stale query count
+if query_profiler.enabled:
+    app.add_middleware(QueryProfilerMiddleware, profiler=query_profiler)
+    app.state.query_profiler = query_profiler
+
+# routes that mostly miss the cache and hit the database, and routes that never do
+route_classes = {
+    "/api/v1/incidents/search": "search",
+    "/api/v1/incidents/near": "search",
+    "/api/v1/incidents/within": "search",
+    "/api/v1/incidents/export": "search",
+    "/api/v1/incidents/by-date-range": "search",
+    "/api/v1/incidents/related": "search",
+    "/api/v1/snapshots": "snapshots",
+}
+
+rate_limiter = RateLimiter(
+    limits={
+        "default": Limit.parse(os.getenv("RATE_LIMIT_DEFAULT")),
+        "search": Limit.parse(os.getenv("RATE_LIMIT_SEARCH")),
+        "snapshots": Limit.parse(os.getenv("RATE_LIMIT_SNAPSHOTS")),
+    },
+    routes=route_classes,
+)
+if strtobool(os.getenv("RATE_LIMIT_ENABLED")):
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=rate_limiter,
+        trust_forwarded=strtobool(os.getenv("RATE_LIMIT_TRUST_FORWARDED")),
+    )
+
+# outside every other layer but timing and CORS, so overload is detected before any other work is done
+load_shedder = LoadShedder(
+    max_in_flight=int(os.getenv("LOAD_SHEDDING_MAX_IN_FLIGHT")),
+    max_db_latency=int(os.getenv("LOAD_SHEDDING_MAX_DB_LATENCY")) / 1000,
+    retry_after=int(os.getenv("LOAD_SHEDDING_RETRY_AFTER")),
+    expensive=("search",),
+    exempt=("snapshots",),
+)
+load_shedding_enabled = strtobool(os.getenv("LOAD_SHEDDING_ENABLED"))
+if load_shedding_enabled:
+    app.add_middleware(
+        LoadSheddingMiddleware, shedder=load_shedder, limiter=rate_limiter
+    )
+
+# outermost, so the responses answered by the layers within (304s, stored
+# responses, 429s and 503s) are timed and readable by browsers too
+app.add_middleware(ProcessTimeHeaderMiddleware)
+
 # TODO shove CORS into config
 app.add_middleware(
     CORSMiddleware,
@@ -92,9 +204,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # so browser clients can back off when they are limited or shed
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining"],
 )
 
-app.add_middleware(ProcessTimeHeaderMiddleware)
+# reported by /meta/stats
+app.state.rate_limiter = rate_limiter
+app.state.load_shedder = load_shedder
+app.state.log_pipeline = log_pipeline
+app.state.circuit_breakers = circuit_breakers
 
 app.include_router(root.router, include_in_schema=False)
 app.include_router(meta.router, prefix="/api/v1")
@@ -102,16 +220,90 @@ app.include_router(incidents.router, prefix="/api/v1")
 app.include_router(incident.router, prefix="/api/v1")
 app.include_router(agencies.agency_router, prefix="/api/v1")
 app.include_router(units.units_router, prefix="/api/v1")
+app.include_router(snapshots.router, prefix="/api/v1")
 
 root_logger.info("Starting LCWC API...")
 root_logger.info("Database: %s", database.database)
 
 root_logger.info("lcwc version: %s", get_lcwc_version())
 
-geocoder = IncidentGeocoder(os.getenv("GOOGLE_MAPS_API_KEY"), redis_client)
+geocoder = IncidentGeocoder(
+    os.getenv("GOOGLE_MAPS_API_KEY"), redis_client, breaker=geocoder_breaker
+)
+
+# caching
+
+
+@app.on_event("startup")
+async def startup():
+    redis = aioredis.from_url(
+        f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}"
+    )
+    cache_prefix = os.getenv("CACHE_REDIS_KEY")
+    data_versions.init(redis, cache_prefix)
+    rate_limiter.init(redis, cache_prefix)
+
+    cache_backend = RedisBackend(redis)
+
+    if strtobool(os.getenv("CACHE_LOCAL_ENABLED", "True")):
+        cache_backend = LayeredBackend(
+            cache_backend,
+            LocalCache(
+                max_bytes=int(os.getenv("CACHE_LOCAL_MAX_BYTES")),
+                max_ttl=int(os.getenv("CACHE_LOCAL_MAX_TTL")),
+            ),
+            redis=redis,
+            channel=f"{cache_prefix}:evictions",
+        )
+        await cache_backend.start()
+
+    FastAPICache.init(
+        cache_backend, prefix=cache_prefix, key_builder=versioned_key_builder
+    )
+
+
+@app.on_event("startup")
+async def backfill():
+    # incidents stored before geohashes were tracked, updated off the event loop
+    with query_profiler.scope("job backfill_geohashes"):
+        await asyncio.to_thread(backfill_geohashes)
+
+
+# cache warming after each update
+cache_warming_enabled = strtobool(os.getenv("CACHE_WARMING_ENABLED"))
+cache_warmer = CacheWarmer(
+    app,
+    access_sketch,
+    max_keys=int(os.getenv("CACHE_WARMING_MAX_KEYS")),
+    time_budget=float(os.getenv("CACHE_WARMING_TIME_BUDGET")),
+    cpu_budget=float(os.getenv("CACHE_WARMING_CPU_BUDGET")),
+)
 
 # incident updater
-updater = IncidentUpdater(database)
+updater = IncidentUpdater(
+    database,
+    rollups=[heatmap_rollup, timeseries_rollup],
+    resolution_grace=timedelta(minutes=int(os.getenv("INCIDENT_RESOLUTION_GRACE"))),
+    heartbeat_interval=timedelta(minutes=int(os.getenv("UNIT_HEARTBEAT_INTERVAL"))),
+    unit_activity=unit_activity,
+    recorder=FeedRecorder(os.getenv("FEED_CAPTURE_PATH"))
+    if os.getenv("FEED_CAPTURE_PATH")
+    else None,
+    # arcgis is the only client with incident numbers, so the default "arcgis,arcgis"
+    # hedges with a second request to the same feed rather than a different one
+    feed=HedgedFeed.from_names(
+        [name.strip() for name in os.getenv("LCWC_FEED_SOURCES").split(",")],
+        hedge_percentile=int(os.getenv("LCWC_FEED_HEDGE_PERCENTILE")) / 100,
+        initial_delay=float(os.getenv("LCWC_FEED_HEDGE_DELAY")),
+    ),
+    breaker=feed_breaker,
+    # a fetch never runs into the next poll
+    deadline=min(
+        float(os.getenv("LCWC_FEED_DEADLINE")),
+        float(os.getenv("LCWC_UPDATE_INTERVAL")),
+    ),
+)
+app.state.feed = updater.feed
 
 
 @app.on_event("startup")
@@ -119,12 +311,36 @@ updater = IncidentUpdater(database)
     seconds=timedelta(seconds=int(os.getenv("LCWC_UPDATE_INTERVAL"))).total_seconds()
 )
 async def update_repeater():
-    await updater.update_incidents()
+    # readers are shed earlier while the incidents are fetched and stored
+    async with load_shedder.prioritize():
+        with query_profiler.scope("job update_incidents"):
+            updated = await updater.update_incidents()
+    if not updated:
+        return
+
+    await data_versions.bump("incidents")
+    if cache_warming_enabled:
+        await cache_warmer.warm(("/api/v1/incidents", "/api/v1/incident/"))
+
+
+# database latency probe of the load shedder
+if load_shedding_enabled:
+
+    @app.on_event("startup")
+    @repeat_every(seconds=float(os.getenv("LOAD_SHEDDING_PROBE_INTERVAL")))
+    async def update_repeater():
+        await load_shedder.probe(database)
 
 
 # agency updater
 
-agency_updater = AgencyUpdater(database, redis_client)
+agency_updater = AgencyUpdater(
+    database,
+    redis_client,
+    agency_index=agency_index,
+    breaker=agency_breaker,
+    deadline=float(os.getenv("LCWC_AGENCY_DEADLINE")),
+)
 
 
 @app.on_event("startup")
@@ -134,32 +350,83 @@ agency_updater = AgencyUpdater(database, redis_client)
     ).total_seconds()
 )
 async def update_repeater():
-    await agency_updater.update_agencies()
+    with query_profiler.scope("job update_agencies"):
+        updated = await agency_updater.update_agencies()
+    if not updated:
+        return
+
+    await data_versions.bump("agencies")
+    if cache_warming_enabled:
+        await cache_warmer.warm(("/api/v1/agencies",))
 
 
 # automatic incident resolver
 if strtobool(os.getenv("INCIDENT_RESOLVER_ENABLED")):
     resolver = IncidentResolver(
         timedelta(minutes=int(os.getenv("INCIDENT_RESOLVER_THRESHOLD"))),
+        chunk_size=int(os.getenv("INCIDENT_RESOLVER_CHUNK_SIZE")),
     )
+    app.state.resolver = resolver
 
     @app.on_event("startup")
     @repeat_every(
         seconds=timedelta(
-            hours=int(os.getenv("INCIDENT_RESOLVER_INTERVAL"))
+            minutes=int(os.getenv("INCIDENT_RESOLVER_INTERVAL"))
         ).total_seconds()
     )
     async def update_repeater():
-        await resolver.resolve_hanging_incidents()
+        with query_profiler.scope("job resolve_hanging_incidents"):
+            run = await resolver.resolve_hanging_incidents()
+        if run.incidents or run.units:
+            await data_versions.bump("incidents")
+
+
+# archival of old resolved incidents
+if strtobool(os.getenv("ARCHIVE_ENABLED")):
+    archiver = IncidentArchiver(
+        database,
+        timedelta(days=int(os.getenv("ARCHIVE_RETENTION"))),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE")),
+    )
 
+    @app.on_event("startup")
+    @repeat_every(
+        seconds=timedelta(minutes=int(os.getenv("ARCHIVE_INTERVAL"))).total_seconds()
+    )
+    async def update_repeater():
+        with query_profiler.scope("job archive"):
+            await archiver.archive()
 
-@app.on_event("startup")
-async def startup():
-    redis = aioredis.from_url(
-        f"redis://{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}"
+
+# daily snapshot files of the incident history
+if strtobool(os.getenv("SNAPSHOT_ENABLED")):
+    snapshot_store.init(
+        os.getenv("SNAPSHOT_DIRECTORY"),
+        formats=tuple(f.strip() for f in os.getenv("SNAPSHOT_FORMATS").split(",")),
+        delay=timedelta(hours=int(os.getenv("SNAPSHOT_DELAY"))),
+        chunk_size=int(os.getenv("EXPORT_CHUNK_SIZE")),
     )
-    FastAPICache.init(RedisBackend(redis), prefix=os.getenv("CACHE_REDIS_KEY"))
+
+    @app.on_event("startup")
+    @repeat_every(
+        seconds=timedelta(minutes=int(os.getenv("SNAPSHOT_INTERVAL"))).total_seconds()
+    )
+    async def update_repeater():
+        with query_profiler.scope("job write_snapshots"):
+            await snapshot_store.write_closed_days()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    cache_backend = FastAPICache.get_backend()
+    if isinstance(cache_backend, LayeredBackend):
+        await cache_backend.stop()
+
+    log_pipeline.stop()
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=os.getenv("HOSTNAME"), port=int(os.getenv("PORT")))
+    # uvicorn's own handlers would write on the event loop, let its records reach the pipeline
+    uvicorn.run(
+        app, host=os.getenv("HOSTNAME"), port=int(os.getenv("PORT")), log_config=None
+    )
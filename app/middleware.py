@@ -1,8 +1,29 @@
+import json
 import time
+from typing import Optional
 from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
 
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from app.cache.backends import LocalCache
+from app.cache.compression import (
+    IDENTITY,
+    available_encodings,
+    compress,
+    encoded_etag,
+    negotiate,
+)
+from app.cache.keys import request_key
+from app.cache.sketch import AccessSketch
+from app.cache.versions import DataVersions
+from app.cache.warmer import is_warming
+from app.database.profiling import QueryProfiler
+from app.services.circuitbreaker import CircuitBreaker
+from app.services.loadshedding import LoadShedder
+from app.services.ratelimit import RateLimiter
+
 
 class ProcessTimeHeaderMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request, call_next):
@@ -11,3 +32,352 @@ class ProcessTimeHeaderMiddleware(BaseHTTPMiddleware):
         process_time = time.time() - start_time
         response.headers["X-Process-Time"] = str(process_time)
         return response
+
+
+class AccessRecorderMiddleware(BaseHTTPMiddleware):
+    """Records successful GET requests in an access sketch so the hottest ones can be warmed"""
+
+    def __init__(self, app, sketch: AccessSketch, prefix: str = "/"):
+        super().__init__(app)
+        self.sketch = sketch
+        self.prefix = prefix
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+
+        if (
+            request.method == "GET"
+            and response.status_code in (200, 304)
+            and request.url.path.startswith(self.prefix)
+            and not is_warming(request.scope)
+            # streamed responses are never cached, so there is nothing to warm
+            and "content-length" in response.headers
+        ):
+            # parameter order does not change the response, so it should not split the counts
+            self.sketch.record(request_key(request.url))
+
+        return response
+
+
+class ConditionalRequestMiddleware(BaseHTTPMiddleware):
+    """Adds strong ETags derived from the data version to the given routes and answers matching If-None-Match requests with 304"""
+
+    def __init__(self, app, versions: DataVersions, routes: dict[str, str]):
+        """
+        Args:
+            versions (DataVersions): The data versions the ETags are derived from
+            routes (dict[str, str]): The data domain of each path prefix
+        """
+        super().__init__(app)
+        self.versions = versions
+        self.routes = routes
+        self.encodings = (IDENTITY,) + available_encodings()
+
+    async def dispatch(self, request, call_next):
+        domain = route_domain(self.routes, request.url.path)
+        if domain is None or request.method not in ("GET", "HEAD"):
+            return await call_next(request)
+
+        etag = await self.versions.etag(domain, request_key(request.url))
+
+        # the route is never called, so neither the cache nor the database is touched
+        matched = etag_match(
+            request.headers.get("if-none-match"),
+            [encoded_etag(etag, encoding) for encoding in self.encodings],
+        )
+        if matched is not None:
+            return Response(status_code=304, headers={"ETag": matched})
+
+        response = await call_next(request)
+        if response.status_code == 200:
+            encoding = response.headers.get("content-encoding", IDENTITY)
+            response.headers["ETag"] = encoded_etag(etag, encoding)
+        return response
+
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """Answers clients that exceed the limit of a route class with 429 and Retry-After"""
+
+    def __init__(self, app, limiter: RateLimiter, trust_forwarded: bool = False):
+        """
+        Args:
+            limiter (RateLimiter): Holds the token buckets
+            trust_forwarded (bool): Identifies clients by X-Forwarded-For, only safe behind a proxy that sets it
+        """
+        super().__init__(app)
+        self.limiter = limiter
+        self.trust_forwarded = trust_forwarded
+
+    def client(self, request: Request) -> str:
+        forwarded = request.headers.get("x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    async def dispatch(self, request, call_next):
+        if is_warming(request.scope):
+            return await call_next(request)
+
+        decision = await self.limiter.acquire(
+            self.client(request), self.limiter.classify(request.url.path)
+        )
+        if decision is None:
+            return await call_next(request)
+
+        headers = {
+            "X-RateLimit-Limit": str(decision.limit.burst),
+            "X-RateLimit-Remaining": str(int(decision.remaining)),
+        }
+        if not decision.allowed:
+            headers["Retry-After"] = str(decision.retry_after)
+            return JSONResponse(
+                {"detail": "Too many requests"}, status_code=429, headers=headers
+            )
+
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
+
+
+class LoadSheddingMiddleware(BaseHTTPMiddleware):
+    """Answers with 503 and Retry-After while the load shedder says the database needs relief"""
+
+    def __init__(self, app, shedder: LoadShedder, limiter: RateLimiter):
+        """
+        Args:
+            shedder (LoadShedder): Decides which requests to shed
+            limiter (RateLimiter): Classifies the routes
+        """
+        super().__init__(app)
+        self.shedder = shedder
+        self.limiter = limiter
+
+    async def dispatch(self, request, call_next):
+        if not is_warming(request.scope) and self.shedder.should_shed(
+            self.limiter.classify(request.url.path)
+        ):
+            return JSONResponse(
+                {"detail": "Service temporarily overloaded"},
+                status_code=503,
+                headers={"Retry-After": str(self.shedder.retry_after)},
+            )
+
+        with self.shedder.track():
+            return await call_next(request)
+
+
+class StaleDataMiddleware(BaseHTTPMiddleware):
+    """Marks responses with X-Data-Stale while the upstream service their data comes from is failing
+
+    The database keeps the last data fetched successfully, so it is still served,
+    the header holds its age in seconds ("unknown" before the first success).
+    """
+
+    def __init__(
+        self, app, breakers: dict[str, CircuitBreaker], routes: dict[str, str]
+    ):
+        """
+        Args:
+            breakers (dict[str, CircuitBreaker]): The breaker of each data domain
+            routes (dict[str, str]): The data domain of each path prefix
+        """
+        super().__init__(app)
+        self.breakers = breakers
+        self.routes = routes
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+
+        breaker = self.breakers.get(route_domain(self.routes, request.url.path))
+        if breaker is not None and not breaker.healthy:
+            response.headers["X-Data-Stale"] = (
+                str(int(time.time() - breaker.last_success_at))
+                if breaker.last_success_at is not None
+                else "unknown"
+            )
+        return response
+
+
+class QueryProfilerMiddleware(BaseHTTPMiddleware):
+    """Profiles the SQL issued by each request, reporting the count in X-Query-Count
+
+    Statements of a streamed body run after the headers are sent, so they are
+    attributed to the request but not included in its header.
+    """
+
+    def __init__(self, app, profiler: QueryProfiler):
+        super().__init__(app)
+        self.profiler = profiler
+        self.route_paths = {}
+
+    def route_path(self, request: Request) -> str:
+        """Returns the path template of the route that handled the request, so the totals do not grow per id"""
+        endpoint = request.scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+
+        if endpoint not in self.route_paths:
+            self.route_paths[endpoint] = next(
+                (
+                    route.path
+                    for route in request.app.routes
+                    if getattr(route, "endpoint", None) is endpoint
+                ),
+                endpoint.__name__,
+            )
+        return self.route_paths[endpoint]
+
+    async def dispatch(self, request, call_next):
+        with self.profiler.scope(f"{request.method} {request.url.path}") as scope:
+            response = await call_next(request)
+            # the router stores the matched endpoint in the shared scope
+            scope.name = f"{request.method} {self.route_path(request)}"
+            response.headers["X-Query-Count"] = str(scope.queries)
+            response.headers["X-Query-Time"] = f"{scope.duration * 1000:.1f}"
+            return response
+
+
+class CompressionMiddleware(BaseHTTPMiddleware):
+    """Compresses JSON responses according to Accept-Encoding
+
+    Responses of the versioned routes are compressed in every supported encoding
+    once per data version and stored alongside the raw body and the headers of
+    the route's response, so repeated requests are served from the store without
+    calling the route or compressing again.
+    """
+
+    REPLACED_HEADERS = ("content-length", "content-encoding")
+    """ Headers of the route's response that depend on the encoding and are not stored """
+
+    def __init__(
+        self,
+        app,
+        versions: DataVersions,
+        routes: dict[str, str],
+        store: LocalCache,
+        min_size: int,
+        gzip_level: int = 6,
+        brotli_quality: int = 5,
+    ):
+        """
+        Args:
+            versions (DataVersions): The data versions the stored bodies are keyed by
+            routes (dict[str, str]): The data domain of each path prefix
+            store (LocalCache): Holds the raw and compressed bodies
+            min_size (int): Bodies smaller than this many bytes are not compressed
+        """
+        super().__init__(app)
+        self.versions = versions
+        self.routes = routes
+        self.store = store
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = available_encodings()
+
+    async def dispatch(self, request, call_next):
+        encoding = negotiate(request.headers.get("accept-encoding"), self.encodings)
+
+        etag = None
+        domain = route_domain(self.routes, request.url.path)
+        if domain is not None and request.method == "GET":
+            etag = await self.versions.etag(domain, request_key(request.url))
+
+            _, stored_headers = self.store.get_with_ttl(f"{etag}:headers")
+            if stored_headers is not None:
+                for candidate in (encoding, IDENTITY):
+                    _, body = self.store.get_with_ttl(f"{etag}:{candidate}")
+                    if body is not None:
+                        return self.__response(
+                            body, candidate, json.loads(stored_headers), stored=True
+                        )
+
+        response = await call_next(request)
+
+        # streamed responses have no length and are passed through untouched
+        if (
+            response.status_code != 200
+            or "content-encoding" in response.headers
+            or "content-length" not in response.headers
+            or not response.headers.get("content-type", "").startswith(
+                "application/json"
+            )
+        ):
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+
+        if len(body) < self.min_size:
+            variants = {IDENTITY: body}
+        elif etag is not None:
+            variants = {IDENTITY: body}
+            for variant in self.encodings:
+                variants[variant] = await run_in_threadpool(
+                    compress, body, variant, self.gzip_level, self.brotli_quality
+                )
+        elif encoding != IDENTITY:
+            variants = {
+                encoding: await run_in_threadpool(
+                    compress, body, encoding, self.gzip_level, self.brotli_quality
+                )
+            }
+        else:
+            variants = {IDENTITY: body}
+
+        headers = {
+            key: value
+            for key, value in response.headers.items()
+            if key not in self.REPLACED_HEADERS
+        }
+
+        if etag is not None:
+            for variant, variant_body in variants.items():
+                self.store.set(f"{etag}:{variant}", variant_body)
+            # stored last, so it is not evicted before the bodies it belongs to
+            self.store.set(f"{etag}:headers", json.dumps(headers))
+
+        if encoding not in variants:
+            encoding = IDENTITY
+
+        return self.__response(
+            variants[encoding], encoding, dict(headers), etag is not None
+        )
+
+    def __response(
+        self, body: bytes, encoding: str, headers: dict, stored: bool
+    ) -> Response:
+        if encoding != IDENTITY:
+            headers["Content-Encoding"] = encoding
+        if stored or encoding != IDENTITY:
+            vary = headers.get("vary")
+            headers["vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+        return Response(content=body, headers=headers, media_type="application/json")
+
+
+def route_domain(routes: dict[str, str], path: str) -> Optional[str]:
+    """Returns the data domain of the first route prefix matching the path"""
+    for prefix, domain in routes.items():
+        if path.startswith(prefix):
+            return domain
+    return None
+
+
+def etag_match(if_none_match: Optional[str], etags: list[str]) -> Optional[str]:
+    """Compares an If-None-Match header against the current ETags using the weak comparison required by RFC 7232
+
+    Returns:
+        str: The matching ETag, or None when the client's copy is out of date
+    """
+
+    if not if_none_match:
+        return None
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return etags[0]
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in etags:
+            return candidate
+    return None
@@ -0,0 +1,150 @@
+import bisect
+import datetime
+import logging
+import re
+import threading
+from typing import Iterable, Optional
+
+from app.database.models.agency import Agency
+
+""" In-memory index of the agency table, which is small and only changes when the agency updater runs """
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize(value) -> str:
+    value = getattr(value, "value", value)
+    return str(value).strip().lower() if value is not None else ""
+
+
+def tokenize(value) -> list[str]:
+    return TOKEN_PATTERN.findall(normalize(value))
+
+
+class AgencySnapshot:
+    """An immutable set of agencies with hash indexes on the exact-match fields and token indexes on the text fields"""
+
+    HASHED_FIELDS = ("category", "station_id", "city", "zip_code")
+    TOKENIZED_FIELDS = ("name", "address")
+    SCANNED_FIELDS = ("url", "state", "phone")
+
+    def __init__(self, agencies: Iterable[Agency]):
+        self.agencies: tuple[Agency, ...] = tuple(
+            sorted(agencies, key=lambda a: (str(a.category), a.station_id))
+        )
+        self.built_at = datetime.datetime.utcnow()
+
+        self.hashed: dict[str, dict[str, frozenset[int]]] = {}
+        for field in self.HASHED_FIELDS:
+            index = {}
+            for position, agency in enumerate(self.agencies):
+                index.setdefault(normalize(getattr(agency, field)), set()).add(position)
+            self.hashed[field] = {key: frozenset(ids) for key, ids in index.items()}
+
+        # token -> positions, and the sorted tokens for prefix lookups
+        self.tokens: dict[str, dict[str, frozenset[int]]] = {}
+        self.sorted_tokens: dict[str, list[str]] = {}
+        for field in self.TOKENIZED_FIELDS:
+            index = {}
+            for position, agency in enumerate(self.agencies):
+                for token in tokenize(getattr(agency, field)):
+                    index.setdefault(token, set()).add(position)
+            self.tokens[field] = {key: frozenset(ids) for key, ids in index.items()}
+            self.sorted_tokens[field] = sorted(index)
+
+        self.keys = {
+            (normalize(agency.category), normalize(agency.station_id)): agency
+            for agency in self.agencies
+        }
+
+    def __len__(self) -> int:
+        return len(self.agencies)
+
+    def get(self, category, station_id: str) -> Optional[Agency]:
+        return self.keys.get((normalize(category), normalize(station_id)))
+
+    def __prefix_matches(self, field: str, prefix: str) -> set[int]:
+        tokens = self.sorted_tokens[field]
+        matches = set()
+        start = bisect.bisect_left(tokens, prefix)
+        for token in tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches |= self.tokens[field][token]
+        return matches
+
+    def search(self, **filters) -> list[Agency]:
+        """Returns the agencies matching every given filter
+
+        category, station_id, city and zip_code match exactly (case insensitive),
+        every word of name and address must prefix a word of the field, and
+        url, state and phone match exactly on the remaining candidates. Without
+        any filter nothing matches, the agencies of a category are searched by it.
+        """
+
+        if all(value is None for value in filters.values()):
+            return []
+
+        candidates: Optional[set[int]] = None
+
+        def narrow(ids: Iterable[int]):
+            nonlocal candidates
+            candidates = set(ids) if candidates is None else candidates & set(ids)
+
+        for field in self.HASHED_FIELDS:
+            value = filters.get(field)
+            if value is not None:
+                narrow(self.hashed[field].get(normalize(value), ()))
+
+        for field in self.TOKENIZED_FIELDS:
+            value = filters.get(field)
+            if value is not None:
+                for token in tokenize(value):
+                    narrow(self.__prefix_matches(field, token))
+
+        if candidates is None:
+            # only scanned fields were given
+            candidates = range(len(self.agencies))
+
+        results = []
+        for position in sorted(candidates):
+            agency = self.agencies[position]
+            if all(
+                normalize(getattr(agency, field)) == normalize(filters[field])
+                for field in self.SCANNED_FIELDS
+                if filters.get(field) is not None
+            ):
+                results.append(agency)
+        return results
+
+    def count(self, category=None) -> int:
+        if category is None:
+            return len(self.agencies)
+        return len(self.hashed["category"].get(normalize(category), ()))
+
+
+class AgencyIndex:
+    """Holds the current agency snapshot, replaced as a whole after each refresh"""
+
+    def __init__(self):
+        self.snapshot: Optional[AgencySnapshot] = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def refresh(self) -> AgencySnapshot:
+        """Rebuilds the snapshot from the agency table"""
+        snapshot = AgencySnapshot(Agency.select())
+        self.snapshot = snapshot
+        self.logger.info(f"Indexed {len(snapshot)} agencies")
+        return snapshot
+
+    def current(self) -> AgencySnapshot:
+        """Returns the current snapshot, building it on first use"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshot or self.refresh()
+        return snapshot
+
+
+agency_index = AgencyIndex()
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import aiohttp
 import time
@@ -8,87 +9,244 @@ import redis
 from lcwc.category import IncidentCategory
 from app.database.models.agency import Agency as AgencyModel
 from lcwc.agencies.agencyclient import AgencyClient
+from app.services.agencyindex import AgencyIndex
+from app.services.circuitbreaker import CircuitBreaker
+from app.utils import upstream
 
 
 class AgencyUpdater:
     """Updates the agency list from the LCWC website"""
 
+    COMPARED_FIELDS = ("name", "url", "address", "city", "state", "zip_code", "phone")
+    BATCH_SIZE = 500
+
     def __init__(
         self,
         db: peewee.Database,
         redis: redis.Redis,
+        agency_index: AgencyIndex = None,
+        breaker: CircuitBreaker = None,
+        deadline: float = None,
     ):
+        """
+        Args:
+            db (peewee.Database): The database connection
+            redis (redis.Redis): The Redis client
+            agency_index (AgencyIndex): The index to refresh after the agencies change
+            breaker (CircuitBreaker): Stops scraping the website after repeated failures, if set
+            deadline (float): The number of seconds the fetch of a category may take
+        """
+
         self.db = db
         self.redis = redis
+        self.agency_index = agency_index
         self.agency_client = AgencyClient()
+        self.breaker = breaker or CircuitBreaker("agencies")
+        self.deadline = deadline
         self.last_update = None
         self.logger = logging.getLogger(__name__)
 
         self.update_count = 0
+        self.last_timings = {}
 
     @property
     def last_updated(self) -> datetime.datetime:
         return self.last_update
 
-    async def update_agencies(self) -> None:
+    async def update_agencies(self) -> bool:
+        """Fetches the agency list and applies the differences to the database, returning whether the database was updated"""
         self.logger.info("Updating agencies...")
 
-        agencies = []
+        categories = [
+            IncidentCategory.FIRE,
+            IncidentCategory.MEDICAL,
+            IncidentCategory.TRAFFIC,
+        ]
 
-        async with aiohttp.ClientSession() as session:
-            fetch_start = time.perf_counter()
-            try:
-                categories = [
-                    IncidentCategory.FIRE,
-                    IncidentCategory.MEDICAL,
-                    IncidentCategory.TRAFFIC,
-                ]
-                agencies = await self.agency_client.get_agencies(session, categories)
-                fetch_end = time.perf_counter()
-                self.logger.info(
-                    f"Found {len(agencies)} live agencies in {fetch_end - fetch_start:0.2f} seconds"
-                )
-            except Exception as e:
-                self.logger.error(f"Error fetching agencies: {e}")
-                return
+        if not self.breaker.allow():
+            self.logger.warning(
+                f"Not fetching agencies: circuit breaker of {self.breaker.name} is open"
+            )
+            return False
 
+        async with upstream.create_session() as session:
+            results = await asyncio.gather(
+                *[self.__fetch_category(session, category) for category in categories]
+            )
+
+        # one refresh is one call to the website, however many of its categories failed
+        if all(error for *_, error in results):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        timings = {}
+        fetched = {}
+        for category, agencies, elapsed, _ in results:
+            timings[category.value] = {"fetch": elapsed}
+            if agencies is not None:
+                fetched[category] = agencies
+
+        if not fetched:
+            self.logger.error("Error fetching agencies: every category failed")
+            return False
+
+        apply_start = time.perf_counter()
         try:
             with self.db.atomic():
-                for agency in agencies:
-                    r = (
-                        AgencyModel.insert(
-                            category=agency.category,
-                            station_id=agency.station_number,
-                            name=agency.name,
-                            url=agency.url,
-                            address=agency.address,
-                            city=agency.city,
-                            state=agency.state,
-                            zip_code=agency.zip_code,
-                            phone=agency.phone,
-                        )
-                        .on_conflict(
-                            conflict_target=[
-                                AgencyModel.category,
-                                AgencyModel.station_id,
-                            ],
-                            update={
-                                AgencyModel.name: agency.name,
-                                AgencyModel.url: agency.url,
-                                AgencyModel.address: agency.address,
-                                AgencyModel.city: agency.city,
-                                AgencyModel.state: agency.state,
-                                AgencyModel.zip_code: agency.zip_code,
-                                AgencyModel.phone: agency.phone,
-                                AgencyModel.updated_at: datetime.datetime.utcnow(),
-                            },
-                        )
-                        .execute()
-                    )
-
+                changes = self.__apply_changes(fetched)
         except Exception as e:
             self.logger.error(f"Error saving agencies: {e}")
-            return
+            return False
+        apply_elapsed = time.perf_counter() - apply_start
+
+        for category, (inserted, updated, removed) in changes.items():
+            timings[category.value].update(
+                inserted=inserted, updated=updated, removed=removed
+            )
+        timings["apply"] = apply_elapsed
+        self.last_timings = timings
+
+        self.logger.info(
+            "Agency refresh: "
+            + ", ".join(
+                f"{category.value} fetched in {timings[category.value]['fetch']:0.2f}s"
+                for category in categories
+            )
+            + f", applied in {apply_elapsed:0.2f}s"
+        )
 
         self.update_count += 1
         self.last_update = datetime.datetime.utcnow()
+
+        if not any(sum(counts) for counts in changes.values()):
+            self.logger.info("Agencies are unchanged")
+            return False
+
+        if self.agency_index is not None:
+            try:
+                self.agency_index.refresh()
+            except Exception as e:
+                self.logger.error(f"Error indexing agencies: {e}")
+
+        return True
+
+    async def __fetch_category(
+        self, session: aiohttp.ClientSession, category: IncidentCategory
+    ) -> tuple:
+        """Fetches the agencies of a single category
+
+        Returns:
+            tuple: The category, its agencies (None when the fetch failed), the time taken and whether the website failed
+        """
+
+        fetch_start = time.perf_counter()
+        try:
+            agencies = await asyncio.wait_for(
+                self.agency_client.get_agencies(session, [category]),
+                timeout=self.deadline,
+            )
+        except asyncio.TimeoutError:
+            self.logger.error(
+                f"Error fetching {category.value} agencies: no response within the {self.deadline} second deadline"
+            )
+            return category, None, time.perf_counter() - fetch_start, True
+        except Exception as e:
+            self.logger.error(f"Error fetching {category.value} agencies: {e}")
+            return category, None, time.perf_counter() - fetch_start, True
+
+        elapsed = time.perf_counter() - fetch_start
+        self.logger.info(
+            f"Found {len(agencies)} live {category.value} agencies in {elapsed:0.2f} seconds"
+        )
+
+        # an empty page is far more likely a parsing problem than every agency disbanding
+        if not agencies:
+            self.logger.error(f"No {category.value} agencies found, skipping category")
+            return category, None, elapsed, False
+
+        return category, agencies, elapsed, False
+
+    def __apply_changes(self, fetched: dict[IncidentCategory, list]) -> dict:
+        """Inserts, updates and removes the agencies of the fetched categories that differ from the table
+
+        Returns:
+            dict: The number of agencies inserted, updated and removed per category
+        """
+
+        now = datetime.datetime.utcnow()
+        existing = {
+            (agency.category, agency.station_id): agency
+            for agency in AgencyModel.select().where(
+                AgencyModel.category.in_([category.value for category in fetched])
+            )
+        }
+
+        changes = {}
+        inserts = []
+        updates = []
+        for category, agencies in fetched.items():
+            inserted = updated = 0
+            seen = set()
+
+            for agency in agencies:
+                key = (category.value, agency.station_number)
+                if key in seen:
+                    self.logger.warning(
+                        f"{category.value} agency {agency.station_number} is listed twice, keeping the first"
+                    )
+                    continue
+                seen.add(key)
+
+                row = {
+                    "category": category.value,
+                    "station_id": agency.station_number,
+                    "name": agency.name,
+                    "url": agency.url,
+                    "address": agency.address,
+                    "city": agency.city,
+                    "state": agency.state,
+                    "zip_code": str(agency.zip_code),
+                    "phone": agency.phone,
+                    "updated_at": now,
+                }
+
+                current = existing.get(key)
+                if current is None:
+                    inserts.append(row)
+                    inserted += 1
+                elif any(
+                    getattr(current, field) != row[field] for field in self.COMPARED_FIELDS
+                ):
+                    updates.append(row)
+                    updated += 1
+
+            missing = [
+                station_id
+                for (existing_category, station_id) in existing
+                if existing_category == category.value
+                and (existing_category, station_id) not in seen
+            ]
+            if missing:
+                self.logger.warning(
+                    f"{len(missing)} {category.value} agencies disappeared upstream: {', '.join(missing)}"
+                )
+                AgencyModel.delete().where(
+                    AgencyModel.category == category.value,
+                    AgencyModel.station_id.in_(missing),
+                ).execute()
+
+            changes[category] = (inserted, updated, len(missing))
+
+        # inserts upsert too, in case a concurrent refresh inserted the same station meanwhile
+        rows = inserts + updates
+        for start in range(0, len(rows), self.BATCH_SIZE):
+            AgencyModel.insert_many(rows[start : start + self.BATCH_SIZE]).on_conflict(
+                conflict_target=[AgencyModel.category, AgencyModel.station_id],
+                preserve=[
+                    *[getattr(AgencyModel, field) for field in self.COMPARED_FIELDS],
+                    AgencyModel.updated_at,
+                ],
+            ).execute()
+
+        return changes
@@ -0,0 +1,151 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from typing import Callable, Iterator, Optional
+
+import peewee
+
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+
+""" Moves old resolved incidents and their units from the hot tables to the archive tables, and reads across both tiers """
+
+TIERS = (Incident, ArchivedIncident)
+""" The incident tables, hot tier first """
+
+
+class IncidentArchiver:
+    def __init__(
+        self,
+        db: peewee.Database,
+        retention: datetime.timedelta,
+        batch_size: int = 500,
+    ):
+        """Initializes the incident archiver
+
+        Args:
+            db (peewee.Database): The database connection
+            retention (datetime.timedelta): How long resolved incidents stay in the hot tables
+            batch_size (int): The number of incidents moved per transaction
+        """
+
+        self.db = db
+        self.retention = retention
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+
+    async def archive(self) -> int:
+        """Moves every incident resolved before the retention period to the archive, one batch at a time
+
+        Each batch is its own short transaction run off the event loop, so the
+        updater is never blocked behind the whole move.
+
+        Returns:
+            int: The number of incidents archived
+        """
+
+        cutoff = datetime.datetime.utcnow() - self.retention
+        self.logger.info(f"Archiving incidents resolved before {cutoff}")
+
+        start = time.perf_counter()
+        archived = 0
+        while True:
+            try:
+                moved = await asyncio.to_thread(self.__archive_batch, cutoff)
+            except Exception as e:
+                self.logger.error(f"Error archiving incidents: {e}")
+                break
+
+            archived += moved
+            if moved < self.batch_size:
+                break
+
+            # let the updater and requests run between batches
+            await asyncio.sleep(0)
+
+        self.logger.info(
+            f"Archived {archived} incident(s) in {time.perf_counter() - start:0.2f} seconds"
+        )
+        return archived
+
+    def __archive_batch(self, cutoff: datetime.datetime) -> int:
+        with self.db.atomic():
+            ids = [
+                row.id
+                for row in Incident.select(Incident.id)
+                .where(
+                    Incident.resolved_at.is_null(False),
+                    Incident.resolved_at < cutoff,
+                )
+                .order_by(Incident.resolved_at)
+                .limit(self.batch_size)
+            ]
+            if not ids:
+                return 0
+
+            # copied column for column, the archive tables mirror the hot ones
+            incident_fields = Incident._meta.sorted_fields
+            ArchivedIncident.insert_from(
+                Incident.select(*incident_fields).where(Incident.id.in_(ids)),
+                fields=[ArchivedIncident._meta.fields[f.name] for f in incident_fields],
+            ).execute()
+
+            unit_fields = Unit._meta.sorted_fields
+            ArchivedUnit.insert_from(
+                Unit.select(*unit_fields).where(Unit.incident.in_(ids)),
+                fields=[ArchivedUnit._meta.fields[f.name] for f in unit_fields],
+            ).execute()
+
+            Unit.delete().where(Unit.incident.in_(ids)).execute()
+            Incident.delete().where(Incident.id.in_(ids)).execute()
+
+        return len(ids)
+
+
+def select_incidents(
+    conditions: Callable[[type[Incident]], list] = None,
+    limit: Optional[int] = None,
+) -> Iterator[Incident]:
+    """Selects incidents from both tiers, most recently dispatched first
+
+    Args:
+        conditions (Callable): Builds the where clauses for the given incident table
+        limit (int): The maximum number of incidents to return
+
+    Returns:
+        Iterator[Incident]: The matching incidents, either hot or archived
+    """
+
+    tiers = []
+    for model in TIERS:
+        query = model.select().order_by(model.dispatched_at.desc())
+        where = conditions(model) if conditions else []
+        if where:
+            query = query.where(*where)
+        if limit is not None:
+            query = query.limit(limit)
+        tiers.append(iter(query))
+
+    merged = heapq.merge(*tiers, key=lambda incident: incident.dispatched_at, reverse=True)
+    if limit is not None:
+        return itertools.islice(merged, limit)
+    return merged
+
+
+def get_incident(conditions: Callable[[type[Incident]], list]) -> Incident:
+    """Returns the single incident matching the conditions from either tier
+
+    Raises:
+        Incident.DoesNotExist: When neither tier has a matching incident
+    """
+
+    for model in TIERS:
+        try:
+            return model.select().where(*conditions(model)).get()
+        except model.DoesNotExist:
+            continue
+    raise Incident.DoesNotExist()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+""" Circuit breakers that stop calling an upstream service after repeated failures, and probe it again later """
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream service while its breaker is open"""
+
+
+class CircuitBreaker:
+    """Tracks the failures of calls to one upstream service
+
+    After failure_threshold consecutive failures the breaker opens and calls are
+    rejected without reaching the service. Once reset_timeout has passed, a single
+    probe call is let through (half-open): its success closes the breaker, its
+    failure opens it for another reset_timeout.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        reset_timeout: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            name (str): The name of the upstream service, used in logs and stats
+            failure_threshold (int): The number of consecutive failures that open the breaker
+            reset_timeout (float): The number of seconds the breaker stays open before probing
+            clock (Callable): Returns the monotonic time in seconds, tests substitute their own
+        """
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.logger = logging.getLogger(__name__)
+
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self.opened_at: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the last calls succeeded, i.e. the data fetched through the breaker is current"""
+        return self.state == CLOSED
+
+    def allow(self) -> bool:
+        """Returns whether a call may go through, moving an expired open breaker to half-open"""
+        if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probing = False
+
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            self.logger.info(f"Circuit breaker of {self.name} closed")
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+        self.last_success_at = time.time()
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or (
+            self.state == CLOSED and self.failures >= self.failure_threshold
+        ):
+            if self.state == CLOSED:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = self.clock()
+            self._probing = False
+            self.logger.warning(
+                f"Circuit breaker of {self.name} open after {self.failures} failure(s), probing again in {self.reset_timeout} seconds"
+            )
+
+    async def call(
+        self, func: Callable[..., Awaitable], *args, timeout: float = None, **kwargs
+    ):
+        """Awaits func(*args, **kwargs) within the timeout, counting timeouts as failures
+
+        Raises:
+            CircuitOpenError: When the breaker is open, func is not called
+        """
+
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit breaker of {self.name} is open")
+
+        try:
+            result = await asyncio.wait_for(func(*args, **kwargs), timeout=timeout)
+        except BaseException as e:
+            # a cancelled probe says nothing about the service, let the next call probe
+            if isinstance(e, asyncio.CancelledError):
+                self._probing = False
+            else:
+                self.record_failure()
+            raise
+
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "last_success_at": self.last_success_at,
+        }
+
+
+class CircuitBreakers:
+    """The breakers of every upstream service, reported together on /meta/stats"""
+
+    def __init__(self):
+        self.breakers: dict[str, CircuitBreaker] = {}
+
+    def register(self, name: str, **kwargs) -> CircuitBreaker:
+        self.breakers[name] = CircuitBreaker(name, **kwargs)
+        return self.breakers[name]
+
+    def get(self, name: str) -> Optional[CircuitBreaker]:
+        return self.breakers.get(name)
+
+    def stats(self) -> dict:
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+
+
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,217 @@
+import asyncio
+import csv
+import datetime
+import heapq
+import io
+import itertools
+import logging
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from peewee import Tuple
+
+from app.api.models.incident import Incident as IncidentOutput
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+
+""" Streams the incident history of both tiers in chunks, for exports of arbitrary size """
+
+UNIT_MODELS = {Incident: Unit, ArchivedIncident: ArchivedUnit}
+
+CSV_COLUMNS = [
+    "id",
+    "number",
+    "category",
+    "description",
+    "intersection",
+    "municipality",
+    "agency",
+    "priority",
+    "dispatched_at",
+    "latitude",
+    "longitude",
+    "added_at",
+    "updated_at",
+    "resolved_at",
+    "client",
+    "automatically_resolved",
+    "units",
+]
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def search_conditions(
+    category: Optional[str] = None,
+    description: Optional[str] = None,
+    intersection: Optional[str] = None,
+    municipality: Optional[str] = None,
+    agency: Optional[str] = None,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+) -> Callable[[type[Incident]], list]:
+    """Builds the where clauses of an incident search for either tier
+
+    Args:
+        start (datetime.date): The earliest dispatch date, inclusive
+        end (datetime.date): The latest dispatch date, inclusive
+    """
+
+    def conditions(model: type[Incident]) -> list:
+        where = []
+        if category:
+            where.append(model.category == category)
+        if description:
+            where.append(model.description.contains(description))
+        if intersection:
+            where.append(model.intersection.contains(intersection))
+        if municipality:
+            where.append(model.municipality.contains(municipality))
+        if agency:
+            where.append(model.agency.contains(agency))
+        if start:
+            where.append(model.dispatched_at >= start)
+        if end:
+            where.append(model.dispatched_at < end + datetime.timedelta(days=1))
+        return where
+
+    return conditions
+
+
+def tier_chunks(
+    model: type[Incident], conditions: Callable, chunk_size: int
+) -> Iterator[list[Incident]]:
+    """Yields the matching incidents of a tier in dispatch order, a chunk at a time, with their units attached
+
+    Each chunk is a separate keyset query on (dispatched_at, id), so no cursor or
+    transaction is held open between chunks and every chunk costs the same however
+    deep into the table it is.
+    """
+
+    unit_model = UNIT_MODELS[model]
+    key = Tuple(model.dispatched_at, model.id)
+    where = conditions(model)
+    last = None
+
+    while True:
+        query = (
+            model.select()
+            .order_by(model.dispatched_at, model.id)
+            .limit(chunk_size)
+        )
+        if where:
+            query = query.where(*where)
+        if last is not None:
+            # row values are not converted by the fields, so convert the bounds here
+            query = query.where(
+                key
+                > Tuple(
+                    model.dispatched_at.db_value(last.dispatched_at),
+                    model.id.db_value(last.id),
+                )
+            )
+
+        chunk = list(query)
+        if not chunk:
+            return
+
+        units = {}
+        for unit in (
+            unit_model.select()
+            .where(unit_model.incident.in_([incident.id for incident in chunk]))
+            .order_by(unit_model.added_at)
+        ):
+            units.setdefault(unit.incident_id, []).append(unit)
+        for incident in chunk:
+            # shadows the backref, so serializing the incident does not query its units again
+            incident.units = units.get(incident.id, [])
+
+        yield chunk
+
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+
+
+def select_history(conditions: Callable, chunk_size: int) -> Iterator[Incident]:
+    """Merges the incidents of both tiers in dispatch order, holding at most one chunk per tier"""
+    tiers = [
+        itertools.chain.from_iterable(tier_chunks(model, conditions, chunk_size))
+        for model in UNIT_MODELS
+    ]
+    return heapq.merge(
+        *tiers, key=lambda incident: (incident.dispatched_at, str(incident.id))
+    )
+
+
+def to_ndjson(incidents: list[Incident]) -> bytes:
+    return "".join(
+        IncidentOutput.from_db_model(incident).json() + "\n" for incident in incidents
+    ).encode("utf-8")
+
+
+def to_csv(incidents: list[Incident], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(CSV_COLUMNS)
+
+    for incident in incidents:
+        writer.writerow(
+            [
+                incident.id,
+                incident.number,
+                incident.category,
+                incident.description,
+                incident.intersection,
+                incident.municipality,
+                incident.agency,
+                incident.priority,
+                incident.dispatched_at,
+                incident.latitude,
+                incident.longitude,
+                incident.added_at,
+                incident.updated_at,
+                incident.resolved_at,
+                incident.client,
+                incident.automatically_resolved,
+                " ".join(unit.short_name for unit in incident.units),
+            ]
+        )
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_history(
+    conditions: Callable, format: str, chunk_size: int = 1000
+) -> AsyncIterator[bytes]:
+    """Yields the matching incidents of both tiers serialized as NDJSON or CSV, a chunk per write
+
+    Chunks are fetched and serialized in a worker thread, and only once the previous
+    one has been handed to the server, so a slow client slows down the export instead
+    of letting it pile up in memory.
+    """
+
+    incidents = select_history(conditions, chunk_size)
+
+    def next_chunk() -> list[Incident]:
+        return list(itertools.islice(incidents, chunk_size))
+
+    serialize = to_csv if format == "csv" else to_ndjson
+
+    if format == "csv":
+        yield to_csv([], header=True)
+
+    exported = 0
+    while True:
+        chunk = await asyncio.to_thread(next_chunk)
+        if not chunk:
+            break
+        exported += len(chunk)
+        yield await asyncio.to_thread(serialize, chunk)
+
+    logger.info(f"Exported {exported} incident(s) as {format}")
@@ -0,0 +1,114 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+import threading
+from typing import Iterator, Optional
+
+from lcwc.arcgis import ArcGISIncident
+from lcwc.arcgis.incident import Coordinates
+from lcwc.category import IncidentCategory
+from lcwc.utils.unitparser import UnitParser
+
+""" Records the feed snapshots fetched by the updater to an append-only capture file, and reads them back for replay """
+
+
+def serialize_incident(incident: ArcGISIncident) -> dict:
+    """Returns the fields of the incident as the feed reported them"""
+    coordinates = incident.coordinates
+    return {
+        "category": getattr(incident.category, "value", incident.category),
+        "date": incident.date.isoformat(),
+        "description": incident.description,
+        "municipality": incident.municipality,
+        "intersection": incident.intersection,
+        "units": [unit.full_name for unit in incident.units],
+        "number": incident.number,
+        "priority": incident.priority,
+        "agency": incident.agency,
+        "public": incident.public,
+        "coordinates": [coordinates.longitude, coordinates.latitude]
+        if coordinates is not None
+        else None,
+    }
+
+
+def deserialize_incident(data: dict) -> ArcGISIncident:
+    """Rebuilds an incident, parsing its units the same way the feed client does"""
+    category = IncidentCategory(data["category"])
+    coordinates = data["coordinates"]
+    return ArcGISIncident(
+        category,
+        datetime.datetime.fromisoformat(data["date"]),
+        data["description"],
+        data["municipality"],
+        data["intersection"],
+        [UnitParser.parse_unit(name, category) for name in data["units"]],
+        data["number"],
+        data["priority"],
+        data["agency"],
+        data["public"],
+        Coordinates(*coordinates) if coordinates is not None else None,
+    )
+
+
+class FeedRecorder:
+    """Appends each feed snapshot as a JSON line to a gzip capture file
+
+    Every snapshot is written as its own gzip member, so the file stays valid after
+    every append and a capture can be read while it is still being recorded.
+    """
+
+    def __init__(self, path: str, compresslevel: int = 6):
+        self.path = path
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        self.snapshots = 0
+        self.logger = logging.getLogger(__name__)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(
+        self,
+        incidents: list[ArcGISIncident],
+        fetched_at: Optional[datetime.datetime] = None,
+        fetch_time: Optional[float] = None,
+    ):
+        snapshot = {
+            "fetched_at": (fetched_at or datetime.datetime.utcnow()).isoformat(),
+            "fetch_time": fetch_time,
+            "incidents": [serialize_incident(incident) for incident in incidents],
+        }
+        line = json.dumps(snapshot, separators=(",", ":")).encode("utf-8") + b"\n"
+
+        with self.lock:
+            with gzip.open(self.path, "ab", compresslevel=self.compresslevel) as f:
+                f.write(line)
+            self.snapshots += 1
+
+
+def read_capture(path: str) -> Iterator[tuple[datetime.datetime, list[ArcGISIncident]]]:
+    """Yields the time and incidents of every snapshot in the capture file, in recording order
+
+    A snapshot cut short by a crash while recording ends the capture.
+    """
+
+    with gzip.open(path, "rb") as f:
+        while True:
+            try:
+                line = f.readline()
+            except (EOFError, gzip.BadGzipFile):
+                return
+            if not line:
+                return
+            if not line.endswith(b"\n"):
+                return
+
+            snapshot = json.loads(line)
+            yield (
+                datetime.datetime.fromisoformat(snapshot["fetched_at"]),
+                [deserialize_incident(data) for data in snapshot["incidents"]],
+            )
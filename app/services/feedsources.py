@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from lcwc import Client
+from lcwc.arcgis import ArcGISClient
+
+""" Fetches the live incidents from several feed sources, hedging slow requests with a second source """
+
+CLIENTS: dict[str, type[Client]] = {
+    "arcgis": ArcGISClient,
+}
+""" The clients a source can be configured with, by name
+
+The feed and web clients of lcwc are not listed, their incidents carry no
+incident number, which the updater keys every incident on.
+"""
+
+
+class InvalidFeedError(Exception):
+    """Raised when a source responds with incidents the updater cannot store"""
+
+
+def validate(incidents: list) -> None:
+    """Checks that every incident has the fields the updater keys on and stores
+
+    Raises:
+        InvalidFeedError: When the response is not a list or an incident is incomplete
+    """
+
+    if not isinstance(incidents, list):
+        raise InvalidFeedError(f"Expected a list of incidents, got {type(incidents).__name__}")
+
+    for incident in incidents:
+        for field in ("number", "category", "date"):
+            if getattr(incident, field, None) is None:
+                raise InvalidFeedError(
+                    f"{type(incident).__name__} is missing its {field}"
+                )
+
+
+class FeedSource:
+    """A client of the feed, and the latencies of its recent successful requests"""
+
+    SAMPLES = 100
+    """ The number of recent latencies kept """
+
+    def __init__(self, name: str, client: Client):
+        self.name = name
+        self.client = client
+        self.latencies: deque[float] = deque(maxlen=self.SAMPLES)
+
+        self.requests = 0
+        self.wins = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Returns the given percentile (0-1) of the recent latencies, None without any"""
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "wins": self.wins,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+        }
+
+
+class HedgedFeed:
+    """Fetches the incidents from the fastest source, and hedges with the next one when it is slow
+
+    The source with the lowest median latency is asked first. If it has not
+    answered within the hedge percentile of its own recent latencies, the next
+    source is asked as well, and the first valid response wins. A source that
+    fails or answers with invalid incidents is replaced by the next one right
+    away, so the sources double as a fallback chain.
+    """
+
+    MIN_SAMPLES = 10
+    """ The number of latencies a source needs before its percentile is trusted over the initial delay """
+
+    def __init__(
+        self,
+        sources: list[FeedSource],
+        hedge_percentile: float = 0.9,
+        initial_delay: float = 2.0,
+    ):
+        """
+        Args:
+            sources (list[FeedSource]): The sources, in order of preference until their latencies are known
+            hedge_percentile (float): The percentile (0-1) of the latencies after which a request is hedged
+            initial_delay (float): The hedge delay in seconds of a source with too few latencies
+        """
+
+        self.sources = sources
+        self.hedge_percentile = hedge_percentile
+        self.initial_delay = initial_delay
+        self.hedges = 0
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def from_names(names: list[str], **kwargs) -> "HedgedFeed":
+        """Creates a feed from client names, repeated names are separate replicas of the same client
+
+        Sources are named after their client, e.g. "ArcGISClient" and "ArcGISClient/2".
+        The replica suffix only appears in stats and logs, Incident.client gets the
+        client name alone.
+        """
+
+        sources = []
+        for name in names:
+            client = CLIENTS[name]()
+            replica = sum(source.client.name == client.name for source in sources) + 1
+            sources.append(
+                FeedSource(
+                    client.name if replica == 1 else f"{client.name}/{replica}", client
+                )
+            )
+        return HedgedFeed(sources, **kwargs)
+
+    def ranked(self) -> list[FeedSource]:
+        """Returns the sources fastest first
+
+        Sources with too few latencies come last, untried ones first among them,
+        so every source gets measured before the medians are trusted.
+        """
+        return sorted(
+            self.sources,
+            key=lambda source: (
+                len(source.latencies) < self.MIN_SAMPLES,
+                source.percentile(0.5) or 0.0,
+            ),
+        )
+
+    def hedge_delay(self, source: FeedSource) -> float:
+        if len(source.latencies) < self.MIN_SAMPLES:
+            return self.initial_delay
+        return source.percentile(self.hedge_percentile)
+
+    async def __fetch(self, source: FeedSource, session) -> tuple[list, float]:
+        source.requests += 1
+        start = time.perf_counter()
+        incidents = await source.client.get_incidents(session, throw_on_error=True)
+        validate(incidents)
+        return incidents, time.perf_counter() - start
+
+    async def get_incidents(self, session) -> tuple[FeedSource, list, float]:
+        """Fetches the incidents, returning the source that won, its incidents and its latency
+
+        Raises:
+            Exception: The error of the last source to fail, when every source failed
+        """
+
+        waiting = self.ranked()
+        running: dict[asyncio.Task, FeedSource] = {}
+        error: Exception = None
+
+        def start_next() -> None:
+            source = waiting.pop(0)
+            running[asyncio.create_task(self.__fetch(source, session))] = source
+
+        start_next()
+        try:
+            while running:
+                # the hedge timer follows the most recently started request
+                newest = list(running.values())[-1]
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=self.hedge_delay(newest) if waiting else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+
+                if not done:
+                    self.hedges += 1
+                    self.logger.info(
+                        f"No response from {newest.name} after {self.hedge_delay(newest):0.2f} seconds, hedging with {waiting[0].name}"
+                    )
+                    start_next()
+                    continue
+
+                for task in done:
+                    source = running.pop(task)
+                    try:
+                        incidents, latency = task.result()
+                    except Exception as e:
+                        source.failures += 1
+                        error = e
+                        self.logger.warning(f"Feed source {source.name} failed: {e}")
+                        if waiting and not running:
+                            start_next()
+                        continue
+
+                    source.latencies.append(latency)
+                    source.wins += 1
+                    return source, incidents, latency
+        finally:
+            for task, source in running.items():
+                task.cancel()
+                source.cancelled += 1
+
+        raise error
+
+    def stats(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "sources": {source.name: source.stats() for source in self.sources},
+        }
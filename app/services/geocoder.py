@@ -3,15 +3,23 @@ import hashlib
 import json
 import logging
 import redis
+from app.services.circuitbreaker import CircuitBreaker
 from lcwc.arcgis import ArcGISIncident as Incident
 
 
 class IncidentGeocoder:
     """Geocodes incidents using the Google Maps API using Redis as a cache"""
 
-    def __init__(self, client: googlemaps.Client, redis: redis.Redis) -> None:
+    def __init__(
+        self,
+        client: googlemaps.Client,
+        redis: redis.Redis,
+        breaker: CircuitBreaker = None,
+    ) -> None:
         self.client = client
         self.redis = redis
+        # the Google Maps client enforces its own timeout, the breaker only remembers failures
+        self.breaker = breaker or CircuitBreaker("geocoder")
         self.logger = logging.getLogger(__name__)
 
     def get_absolute_address(self, incident: Incident) -> str:
@@ -50,11 +58,21 @@ class IncidentGeocoder:
             # self.logger.debug(f'Found cached coordinates for address: {absolute_address} - {coords}')
             return coords
 
+        if not self.breaker.allow():
+            self.logger.debug(f"Not geocoding address, the geocoder is failing: {absolute_address}")
+            return None
+
         self.logger.debug(f"Geocoding address: {absolute_address}")
 
         try:
             geocode_result = self.client.geocode(absolute_address)
+        except Exception as e:
+            self.breaker.record_failure()
+            self.logger.error(f"Error geocoding address: {e}")
+            return None
+        self.breaker.record_success()
 
+        try:
             if len(geocode_result) == 0:
                 return None
 
@@ -0,0 +1,138 @@
+import datetime
+import logging
+import operator
+from functools import reduce
+from typing import Callable, Optional
+
+from peewee import Case
+
+from app.database.models.incident import Incident
+from app.services import archiver
+from app.utils import geo
+
+""" Spatial incident queries backed by the geohash index, over both the hot and the archived incidents """
+
+logger = logging.getLogger(__name__)
+
+
+def incidents_within(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    active_only: bool = False,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    limit: int = 500,
+) -> list[Incident]:
+    """Returns the most recent incidents within the given bounding box"""
+
+    conditions = _conditions(min_lat, min_lng, max_lat, max_lng, active_only, start, end)
+    return list(archiver.select_incidents(conditions, limit=limit))
+
+
+def incidents_near(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    active_only: bool = False,
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    limit: int = 500,
+) -> list[tuple[Incident, float]]:
+    """Returns the most recent incidents within the given radius in meters, along with their distance"""
+
+    min_lat, min_lng, max_lat, max_lng = geo.bounding_box(latitude, longitude, radius)
+    conditions = _conditions(min_lat, min_lng, max_lat, max_lng, active_only, start, end)
+
+    # the coarse filter matches a box, the exact distance trims it down to the circle
+    results = []
+    for incident in archiver.select_incidents(conditions):
+        distance = geo.haversine(
+            latitude, longitude, float(incident.latitude), float(incident.longitude)
+        )
+        if distance > radius:
+            continue
+        results.append((incident, distance))
+        if len(results) >= limit:
+            break
+
+    return results
+
+
+def _conditions(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    active_only: bool,
+    start: Optional[datetime.date],
+    end: Optional[datetime.date],
+) -> Callable[[type[Incident]], list]:
+    """Builds the where clauses selecting the incidents of either tier in the geohash cells covering the bounding box, and then within the box itself"""
+
+    cells = geo.cover(min_lat, min_lng, max_lat, max_lng)
+
+    def conditions(model: type[Incident]) -> list:
+        # each cell is an index range scan, "~" sorts after every geohash character
+        where = [
+            reduce(
+                operator.or_,
+                [(model.geohash >= cell) & (model.geohash < f"{cell}~") for cell in cells],
+            ),
+            model.latitude.between(min_lat, max_lat),
+            model.longitude.between(min_lng, max_lng),
+        ]
+
+        if active_only:
+            where.append(model.resolved_at.is_null())
+        if start:
+            where.append(model.dispatched_at >= start)
+        if end:
+            where.append(model.dispatched_at < end + datetime.timedelta(days=1))
+        return where
+
+    return conditions
+
+
+def backfill_geohashes(batch_size: int = 1000) -> int:
+    """Populates the geohash of incidents stored before it was tracked, with one UPDATE per batch
+
+    Blocks until every incident is updated, the app runs it in a worker thread at startup.
+
+    Returns:
+        int: The number of incidents updated
+    """
+
+    updated = 0
+    while True:
+        batch = list(
+            Incident.select(Incident.id, Incident.latitude, Incident.longitude)
+            .where(
+                Incident.geohash.is_null(),
+                Incident.latitude.is_null(False),
+                Incident.longitude.is_null(False),
+            )
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+
+        # one statement per batch, the ids are converted as the primary key stores them
+        Incident.update(
+            geohash=Case(
+                Incident.id,
+                [
+                    (
+                        Incident.id.db_value(incident.id),
+                        geo.encode(float(incident.latitude), float(incident.longitude)),
+                    )
+                    for incident in batch
+                ],
+            )
+        ).where(Incident.id.in_([incident.id for incident in batch])).execute()
+
+        updated += len(batch)
+        logger.info(f"Backfilled geohashes of {updated} incident(s)")
+
+    return updated
@@ -1,62 +1,193 @@
+import asyncio
 import datetime
 import logging
+import time
+from dataclasses import asdict, dataclass, field
+
+from peewee import Tuple
+
 from app.database.models.incident import Incident
 from app.database.models.unit import Unit
 
 """ Prunes unresolved incidents after an extended period of time from the database """
 
 
+@dataclass
+class ResolverRun:
+    """Statistics of a single resolver run"""
+
+    started_at: datetime.datetime
+    incidents: int = 0
+    units: int = 0
+    chunks: int = 0
+    duration: float = 0.0
+    # time spent executing the chunked UPDATEs, waiting on row locks included
+    update_time: float = 0.0
+    max_update_time: float = 0.0
+    errors: list[str] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        """Rows resolved per second"""
+        if self.duration <= 0:
+            return 0.0
+        return (self.incidents + self.units) / self.duration
+
+
 class IncidentResolver:
     def __init__(
         self,
         resolution_threshold: datetime.timedelta,
+        chunk_size: int = 500,
     ):
         """Initializes the incident resolver
 
         Args:
             resolution_threshold (datetime.timedelta): The threshold at which to prune incidents
+            chunk_size (int): The maximum number of rows updated per statement
         """
 
         self.resolution_threshold = resolution_threshold
+        self.chunk_size = chunk_size
+        self.last_run: ResolverRun = None
         self.logger = logging.getLogger(__name__)
 
-    def resolve_hanging_incidents(self):
+    async def resolve_hanging_incidents(self) -> ResolverRun:
+        """Resolves incidents and removes units that have not been updated within the threshold
+
+        Rows are updated in primary key order, a bounded chunk per statement, in a
+        worker thread so the event loop keeps serving requests. Each chunk is its own
+        short transaction, so no lock is held against the updater for longer than
+        a single chunk.
+        """
+
         now = datetime.datetime.utcnow()
         threshold = now - self.resolution_threshold
+        run = ResolverRun(started_at=now)
 
         self.logger.info(f"Pruning unresolved incidents older than {threshold}")
 
-        try:
-            incident_prune = Incident.update(
-                {
-                    Incident.resolved_at: datetime.datetime.utcnow(),
-                    Incident.automatically_resolved: True,
-                }
-            ).where(
-                (Incident.resolved_at.is_null(True))
-                & (Incident.updated_at <= threshold)
-            )
+        start = time.perf_counter()
+        for name, chunk in (
+            ("incidents", self.__resolve_incident_chunk),
+            ("units", self.__remove_unit_chunk),
+        ):
+            last_key = None
+            while True:
+                try:
+                    count, last_key, elapsed = await asyncio.to_thread(
+                        chunk, now, threshold, last_key
+                    )
+                except Exception as e:
+                    self.logger.error(f"Failed to resolve unresolved {name}: {e}")
+                    run.errors.append(f"{name}: {e}")
+                    break
+
+                if last_key is None:
+                    break
+
+                setattr(run, name, getattr(run, name) + count)
+                run.chunks += 1
+                run.update_time += elapsed
+                run.max_update_time = max(run.max_update_time, elapsed)
+
+                # yield between chunks
+                await asyncio.sleep(0)
+
+        run.duration = time.perf_counter() - start
+        self.last_run = run
+
+        self.logger.info(
+            f"Pruned {run.incidents} previously unresolved incident(s) and {run.units} unit(s) "
+            f"in {run.chunks} chunk(s), {run.duration:0.2f} seconds ({run.throughput:0.0f} rows/s, "
+            f"{run.update_time:0.3f} seconds in updates, longest {run.max_update_time:0.3f})"
+        )
+
+        return run
+
+    def stats(self) -> dict:
+        if self.last_run is None:
+            return {}
+        return {**asdict(self.last_run), "throughput": self.last_run.throughput}
+
+    def __resolve_incident_chunk(
+        self, now: datetime.datetime, threshold: datetime.datetime, after
+    ) -> tuple:
+        """Resolves the next chunk of stale incidents after the given id
 
-            incident_prune_result = incident_prune.execute()
+        Returns:
+            tuple: The number of incidents resolved, the last id of the chunk (None when done) and the time spent updating
+        """
+
+        stale = (Incident.resolved_at.is_null(True)) & (Incident.updated_at <= threshold)
+
+        query = (
+            Incident.select(Incident.id)
+            .where(stale)
+            .order_by(Incident.id)
+            .limit(self.chunk_size)
+        )
+        if after is not None:
+            query = query.where(Incident.id > after)
 
-            self.logger.info(
-                f"Pruned {incident_prune_result} previously unresolved incident(s)"
+        ids = [row.id for row in query]
+        if not ids:
+            return 0, None, 0.0
+
+        start = time.perf_counter()
+        with Incident._meta.database.atomic():
+            count = (
+                Incident.update(
+                    {
+                        Incident.resolved_at: now,
+                        Incident.automatically_resolved: True,
+                    }
+                )
+                .where(stale, Incident.id.between(ids[0], ids[-1]))
+                .execute()
             )
+        return count, ids[-1], time.perf_counter() - start
+
+    def __remove_unit_chunk(
+        self, now: datetime.datetime, threshold: datetime.datetime, after
+    ) -> tuple:
+        """Removes the next chunk of stale units after the given (incident, short_name) key
 
-            unit_prune_result = (
+        Returns:
+            tuple: The number of units removed, the last key of the chunk (None when done) and the time spent updating
+        """
+
+        stale = (Unit.removed_at.is_null(True)) & (Unit.last_seen <= threshold)
+        key = Tuple(Unit.incident, Unit.short_name)
+
+        def key_value(incident, short_name):
+            # row values are not converted by the fields, so convert the incident id here
+            return Tuple(Unit.incident.db_value(incident), short_name)
+
+        query = (
+            Unit.select(Unit.incident, Unit.short_name)
+            .where(stale)
+            .order_by(Unit.incident, Unit.short_name)
+            .limit(self.chunk_size)
+            .tuples()
+        )
+        if after is not None:
+            query = query.where(key > key_value(*after))
+
+        keys = list(query)
+        if not keys:
+            return 0, None, 0.0
+
+        start = time.perf_counter()
+        with Unit._meta.database.atomic():
+            count = (
                 Unit.update(
                     {
-                        Unit.removed_at: datetime.datetime.utcnow(),
+                        Unit.removed_at: now,
                         Unit.automatically_removed: True,
                     }
                 )
-                .where((Unit.removed_at.is_null(True)) & (Unit.last_seen <= threshold))
+                .where(stale, key >= key_value(*keys[0]), key <= key_value(*keys[-1]))
                 .execute()
             )
-
-            self.logger.info(
-                f"Pruned {unit_prune_result} previously unresolved unit(s)"
-            )
-
-        except Exception as e:
-            self.logger.error(f"Failed to resolve unresolved incidents: {e}")
+        return count, keys[-1], time.perf_counter() - start
@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+import peewee
+from starlette.concurrency import run_in_threadpool
+
+""" Rejects requests early while the database is struggling, so the ingest transaction is not starved by readers """
+
+
+class LoadShedder:
+    """Decides which requests to turn away from the number of requests in flight and the latency of the database
+
+    The database latency is a smoothed average of a trivial probe query, run in
+    Starlette's threadpool like sync routes and dependencies, so it rises when
+    either the database or that pool is saturated. Expensive route classes are shed at half the thresholds, and
+    while an ingest cycle runs every threshold is halved again, so readers make
+    way for the updater's transaction. Exempt route classes (which never touch the
+    database) are never shed.
+    """
+
+    SMOOTHING = 0.3
+    """ Weight of the newest probe in the smoothed latency """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_db_latency: float,
+        retry_after: int,
+        expensive: tuple[str, ...] = (),
+        exempt: tuple[str, ...] = (),
+    ):
+        """
+        Args:
+            max_in_flight (int): The number of concurrent requests beyond which requests are shed
+            max_db_latency (float): The smoothed probe latency in seconds beyond which requests are shed
+            retry_after (int): The number of seconds shed clients are asked to wait
+            expensive (tuple[str, ...]): Route classes shed first
+            exempt (tuple[str, ...]): Route classes never shed
+        """
+
+        self.max_in_flight = max_in_flight
+        self.max_db_latency = max_db_latency
+        self.retry_after = retry_after
+        self.expensive = expensive
+        self.exempt = exempt
+        self.logger = logging.getLogger(__name__)
+
+        self.in_flight = 0
+        self.db_latency = 0.0
+        self.ingesting = 0
+        self.shed = 0
+        self.last_shed_at = None
+        self._probe: asyncio.Future = None
+        self._probe_started = 0.0
+
+    def should_shed(self, route_class: str) -> bool:
+        if route_class in self.exempt:
+            return False
+
+        factor = 1.0
+        if route_class in self.expensive:
+            factor /= 2
+        if self.ingesting:
+            factor /= 2
+
+        if (
+            self.in_flight >= self.max_in_flight * factor
+            or self.db_latency >= self.max_db_latency * factor
+        ):
+            self.shed += 1
+            self.last_shed_at = time.time()
+            return True
+        return False
+
+    @contextlib.contextmanager
+    def track(self):
+        """Counts a request as in flight for the duration of the block"""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    @contextlib.asynccontextmanager
+    async def prioritize(self):
+        """Lowers the thresholds while the block, an ingest cycle, runs"""
+        self.ingesting += 1
+        try:
+            yield
+        finally:
+            self.ingesting -= 1
+
+    async def probe(self, database: peewee.Database) -> float:
+        """Measures the latency of a trivial query and folds it into the smoothed latency
+
+        A probe still stuck from an earlier call is not repeated, its running time
+        counts as the latency instead.
+        """
+
+        def query() -> None:
+            database.execute_sql("SELECT 1").fetchone()
+
+        if self._probe is None or self._probe.done():
+            self._probe_started = time.perf_counter()
+            # the threadpool of sync routes, not the loop's default executor, so a saturated pool shows
+            self._probe = asyncio.ensure_future(run_in_threadpool(query))
+
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(self._probe), timeout=self.max_db_latency * 4
+            )
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error probing the database: {e}")
+        latency = time.perf_counter() - self._probe_started
+
+        self.db_latency += self.SMOOTHING * (latency - self.db_latency)
+        return latency
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "db_latency": self.db_latency,
+            "ingesting": bool(self.ingesting),
+            "shed": self.shed,
+            "last_shed_at": self.last_shed_at,
+        }
@@ -0,0 +1,179 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+""" Per-client token bucket rate limiting, shared across workers through Redis """
+
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+-- numbers would be truncated to integers on the way out
+return {allowed, tostring(tokens)}
+"""
+""" Refills and takes a token from the bucket atomically, on the Redis clock so workers agree on the time """
+
+
+@dataclass(frozen=True)
+class Limit:
+    """Allows rate requests per second on average, and bursts of up to burst requests"""
+
+    rate: float
+    burst: int
+
+    @staticmethod
+    def parse(value: str) -> "Limit":
+        """Parses a limit given as "rate,burst", e.g. "5,20" """
+        rate, burst = value.split(",")
+        return Limit(float(rate), int(burst))
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    limit: Limit
+    remaining: float
+
+    @property
+    def retry_after(self) -> int:
+        """The number of seconds until the next token is available"""
+        return max(1, math.ceil((1 - self.remaining) / self.limit.rate))
+
+
+class LocalBuckets:
+    """In-process token buckets, used while Redis is unavailable"""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self):
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    def take(self, key: str, limit: Limit) -> tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self._buckets[key] = (tokens, now)
+        # the least recently seen clients have long refilled their buckets anyway
+        while len(self._buckets) > self.MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+
+        return allowed, tokens
+
+
+class RateLimiter:
+    """Limits the requests of each client per route class, e.g. the expensive searches separately from the rest
+
+    Buckets live in Redis so every worker enforces the same limit. When Redis
+    cannot be reached, each worker falls back to its own in-memory buckets until
+    Redis is back.
+    """
+
+    RETRY_REDIS_AFTER = 5.0
+    """ Seconds to use the in-memory buckets for after a Redis error """
+
+    def __init__(self, limits: dict[str, Limit], routes: dict[str, str]):
+        """
+        Args:
+            limits (dict[str, Limit]): The limit of each route class, "default" applies to unlisted routes
+            routes (dict[str, str]): The route class of each path prefix
+        """
+
+        self.limits = limits
+        self.routes = routes
+        self.redis = None
+        self.prefix = ""
+        self.script = None
+        self.local = LocalBuckets()
+        self.redis_failed_at: Optional[float] = None
+        self.logger = logging.getLogger(__name__)
+
+        self.allowed = 0
+        self.limited = 0
+        self.fallbacks = 0
+
+    def init(self, redis, prefix: str) -> None:
+        """Shares the buckets through the given async Redis client"""
+        self.redis = redis
+        self.prefix = prefix
+        self.script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def classify(self, path: str) -> str:
+        for prefix, route_class in self.routes.items():
+            if path.startswith(prefix):
+                return route_class
+        return "default"
+
+    async def acquire(self, client: str, route_class: str) -> Optional[Decision]:
+        """Takes a token from the client's bucket of the route class
+
+        Returns:
+            Decision: Whether the request is allowed, None when the route class is not limited
+        """
+
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return None
+
+        key = f"{self.prefix}:ratelimit:{route_class}:{client}"
+        allowed, remaining = None, 0.0
+
+        if self.redis is not None and (
+            self.redis_failed_at is None
+            or time.monotonic() - self.redis_failed_at > self.RETRY_REDIS_AFTER
+        ):
+            try:
+                allowed, remaining = await self.script(
+                    keys=[key], args=[limit.rate, limit.burst]
+                )
+                allowed, remaining = bool(allowed), float(remaining)
+                if self.redis_failed_at is not None:
+                    self.logger.info("Rate limiting through Redis again")
+                    self.redis_failed_at = None
+            except Exception as e:
+                if self.redis_failed_at is None:
+                    self.logger.warning(
+                        f"Rate limiting in memory, Redis is unavailable: {e}"
+                    )
+                self.redis_failed_at = time.monotonic()
+                allowed = None
+
+        if allowed is None:
+            self.fallbacks += 1
+            allowed, remaining = self.local.take(key, limit)
+
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return Decision(allowed, limit, remaining)
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "fallbacks": self.fallbacks,
+            "redis": self.redis is not None and self.redis_failed_at is None,
+        }
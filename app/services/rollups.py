@@ -0,0 +1,322 @@
+import abc
+import datetime
+import logging
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from peewee import fn
+
+from app.database.models.archive import ArchivedIncident
+from app.database.models.incident import Incident
+from app.database.models.rollups import HeatmapCell, IncidentCount
+from app.utils import geo
+
+""" Pre-aggregated incident counts, maintained incrementally by the updater as incidents arrive """
+
+
+class IncidentFacts(NamedTuple):
+    """The attributes of an incident that rollups count by"""
+
+    category: str
+    dispatched_at: datetime.datetime
+    municipality: Optional[str]
+    agency: Optional[str]
+    geohash: Optional[str]
+
+    @staticmethod
+    def from_db_model(incident: Incident) -> "IncidentFacts":
+        return IncidentFacts(
+            category=str(incident.category),
+            dispatched_at=to_naive_utc(incident.dispatched_at),
+            municipality=incident.municipality,
+            agency=incident.agency,
+            geohash=incident.geohash,
+        )
+
+
+FACT_FIELDS = (
+    Incident.number,
+    Incident.category,
+    Incident.dispatched_at,
+    Incident.municipality,
+    Incident.agency,
+    Incident.geohash,
+)
+""" The columns to select to build IncidentFacts from """
+
+
+def to_naive_utc(value) -> datetime.datetime:
+    """Normalizes a stored or parsed timestamp to a naive UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def next_month(day: datetime.date) -> datetime.date:
+    if day.month == 12:
+        return datetime.date(day.year + 1, 1, 1)
+    return datetime.date(day.year, day.month + 1, 1)
+
+
+class Rollup(abc.ABC):
+    """Counts incidents along a fixed set of dimensions
+
+    Subclasses map the facts of an incident to the keys (rows) it is counted in,
+    and the counts are kept up to date by applying the change in keys of every
+    inserted or modified incident.
+    """
+
+    model = None
+    key_fields: tuple[str, ...] = ()
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    @abc.abstractmethod
+    def keys(self, facts: IncidentFacts) -> list[tuple]:
+        """Returns the keys, as tuples of the key fields, the incident is counted in"""
+
+    def apply(
+        self, changes: list[tuple[Optional[IncidentFacts], Optional[IncidentFacts]]]
+    ) -> int:
+        """Applies the changes of incidents, given as their facts before and after, to the stored counts
+
+        Must be called within the transaction that stores the incidents themselves.
+
+        Returns:
+            int: The number of rows updated
+        """
+
+        deltas = Counter()
+        for before, after in changes:
+            if before is not None:
+                for key in self.keys(before):
+                    deltas[key] -= 1
+            if after is not None:
+                for key in self.keys(after):
+                    deltas[key] += 1
+
+        updated = 0
+        for key, delta in deltas.items():
+            if delta == 0:
+                continue
+
+            fields = dict(zip(self.key_fields, key))
+            self.model.insert(**fields, count=delta).on_conflict(
+                conflict_target=[getattr(self.model, name) for name in self.key_fields],
+                update={self.model.count: self.model.count + delta},
+            ).execute()
+            updated += 1
+
+        return updated
+
+    def rebuild(self, batch_size: int = 5000) -> int:
+        """Recomputes every count from the stored incidents
+
+        Returns:
+            int: The number of incidents counted
+        """
+
+        database = self.model._meta.database
+        counted = 0
+
+        with database.atomic():
+            self.model.delete().execute()
+
+            counts = Counter()
+            # archived incidents are counted too, they only move between tables
+            for model in (Incident, ArchivedIncident):
+                last_id = None
+                while True:
+                    query = (
+                        model.select(
+                            model.id, *[model._meta.fields[f.name] for f in FACT_FIELDS]
+                        )
+                        .order_by(model.id)
+                        .limit(batch_size)
+                    )
+                    if last_id is not None:
+                        query = query.where(model.id > last_id)
+
+                    batch = list(query)
+                    if not batch:
+                        break
+
+                    for incident in batch:
+                        counts.update(self.keys(IncidentFacts.from_db_model(incident)))
+
+                    counted += len(batch)
+                    last_id = batch[-1].id
+                    self.logger.info(
+                        f"Counted {counted} incident(s) into {self.model._meta.table_name}"
+                    )
+
+            rows = [
+                {**dict(zip(self.key_fields, key)), "count": count}
+                for key, count in counts.items()
+            ]
+            for start in range(0, len(rows), batch_size):
+                self.model.insert_many(rows[start : start + batch_size]).execute()
+
+        return counted
+
+
+class HeatmapRollup(Rollup):
+    """Incident counts per geohash cell, category and day or month, for every precision a map zoom level can ask for"""
+
+    model = HeatmapCell
+    key_fields = ("precision", "period", "bucket", "category", "cell")
+
+    PRECISIONS = range(3, 8)
+
+    def keys(self, facts: IncidentFacts) -> list[tuple]:
+        if not facts.geohash:
+            return []
+
+        day = facts.dispatched_at.date()
+        keys = []
+        for precision in self.PRECISIONS:
+            cell = facts.geohash[:precision]
+            keys.append((precision, "day", day, facts.category, cell))
+            keys.append((precision, "month", month_start(day), facts.category, cell))
+        return keys
+
+    @classmethod
+    def precision_for_zoom(cls, zoom: int) -> int:
+        """Picks a cell size that is a few pixels wide at the given web map zoom level"""
+        precision = zoom // 2
+        return min(max(precision, cls.PRECISIONS[0]), cls.PRECISIONS[-1])
+
+    def query(
+        self,
+        precision: int,
+        start: datetime.date,
+        end: datetime.date,
+        category: Optional[str] = None,
+    ) -> list[tuple[str, int]]:
+        """Returns the number of incidents per cell dispatched between the start and end dates, inclusive
+
+        Whole months are read from the monthly counts and only the partial months
+        at either end from the daily ones.
+        """
+
+        first_month = month_start(start) if start.day == 1 else next_month(start)
+        last_month = month_start(end + datetime.timedelta(days=1))
+
+        if first_month < last_month:
+            buckets = (
+                (HeatmapCell.period == "month")
+                & (HeatmapCell.bucket >= first_month)
+                & (HeatmapCell.bucket < last_month)
+            ) | (
+                (HeatmapCell.period == "day")
+                & (
+                    ((HeatmapCell.bucket >= start) & (HeatmapCell.bucket < first_month))
+                    | ((HeatmapCell.bucket >= last_month) & (HeatmapCell.bucket <= end))
+                )
+            )
+        else:
+            buckets = (HeatmapCell.period == "day") & HeatmapCell.bucket.between(
+                start, end
+            )
+
+        total = fn.SUM(HeatmapCell.count)
+        query = (
+            HeatmapCell.select(HeatmapCell.cell, total.alias("total"))
+            .where(HeatmapCell.precision == precision, buckets)
+            .group_by(HeatmapCell.cell)
+            .having(total > 0)
+        )
+
+        if category:
+            query = query.where(HeatmapCell.category == category)
+
+        return [(row.cell, int(row.total)) for row in query]
+
+
+class TimeseriesRollup(Rollup):
+    """Incident counts per hour and day, grouped by category, municipality or agency
+
+    Weekly counts are summed from the daily rows when queried.
+    """
+
+    model = IncidentCount
+    key_fields = ("period", "dimension", "bucket", "value")
+
+    DIMENSIONS = ("category", "municipality", "agency")
+    BUCKETS = ("hour", "day", "week")
+
+    def keys(self, facts: IncidentFacts) -> list[tuple]:
+        hour = facts.dispatched_at.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+
+        keys = []
+        for dimension in self.DIMENSIONS:
+            # the composite key cannot hold nulls, missing values are counted under ""
+            value = getattr(facts, dimension) or ""
+            keys.append(("hour", dimension, hour, value))
+            keys.append(("day", dimension, day, value))
+        return keys
+
+    @staticmethod
+    def week_start(value: datetime.datetime) -> datetime.datetime:
+        """Returns the start of the (Monday to Sunday) week of the given time"""
+        day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+        return day - datetime.timedelta(days=day.weekday())
+
+    def query(
+        self,
+        bucket: str,
+        dimension: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        value: Optional[str] = None,
+    ) -> dict[str, dict[datetime.datetime, int]]:
+        """Returns the number of incidents per value of the dimension and bucket, dispatched between start (inclusive) and end (exclusive)
+
+        Hourly and daily counts are read as stored, and weekly counts are summed from
+        the daily ones, so start and end should fall on a boundary of the bucket size.
+        """
+
+        if bucket not in self.BUCKETS:
+            raise ValueError(f"Unsupported bucket: {bucket}")
+        if dimension not in self.DIMENSIONS:
+            raise ValueError(f"Unsupported dimension: {dimension}")
+
+        period = "hour" if bucket == "hour" else "day"
+        query = IncidentCount.select(
+            IncidentCount.bucket, IncidentCount.value, IncidentCount.count
+        ).where(
+            IncidentCount.period == period,
+            IncidentCount.dimension == dimension,
+            IncidentCount.bucket >= start,
+            IncidentCount.bucket < end,
+            IncidentCount.count > 0,
+        )
+        if value is not None:
+            query = query.where(IncidentCount.value == value)
+
+        series = {}
+        for row in query.tuples().iterator():
+            row_bucket, row_value, count = row
+            row_bucket = to_naive_utc(row_bucket)
+            if bucket == "week":
+                row_bucket = self.week_start(row_bucket)
+
+            points = series.setdefault(row_value, {})
+            points[row_bucket] = points.get(row_bucket, 0) + count
+
+        return series
+
+
+heatmap_rollup = HeatmapRollup()
+timeseries_rollup = TimeseriesRollup()
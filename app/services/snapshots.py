@@ -0,0 +1,332 @@
+import asyncio
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from peewee import fn
+
+from app.database.models.incident import Incident
+from app.services import export
+from app.services.rollups import to_naive_utc
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, NDJSON snapshots are always available
+    pyarrow = None
+
+""" Immutable per-day snapshot files of the incident history, for bulk consumers that should never touch the database """
+
+MANIFEST_FILENAME = "manifest.json"
+
+EXTENSIONS = {
+    "ndjson": "ndjson.gz",
+    "parquet": "parquet",
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/gzip",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def available_formats() -> tuple[str, ...]:
+    if pyarrow is not None:
+        return ("ndjson", "parquet")
+    return ("ndjson",)
+
+
+def parquet_schema():
+    unit = pyarrow.struct(
+        [
+            ("short_name", pyarrow.string()),
+            ("name", pyarrow.string()),
+            ("added_at", pyarrow.timestamp("s")),
+            ("removed_at", pyarrow.timestamp("s")),
+            ("last_seen", pyarrow.timestamp("s")),
+            ("automatically_removed", pyarrow.bool_()),
+        ]
+    )
+    return pyarrow.schema(
+        [
+            ("id", pyarrow.string()),
+            ("number", pyarrow.int64()),
+            ("category", pyarrow.string()),
+            ("description", pyarrow.string()),
+            ("intersection", pyarrow.string()),
+            ("municipality", pyarrow.string()),
+            ("agency", pyarrow.string()),
+            ("priority", pyarrow.int64()),
+            ("dispatched_at", pyarrow.timestamp("s")),
+            ("latitude", pyarrow.float64()),
+            ("longitude", pyarrow.float64()),
+            ("added_at", pyarrow.timestamp("s")),
+            ("updated_at", pyarrow.timestamp("s")),
+            ("resolved_at", pyarrow.timestamp("s")),
+            ("client", pyarrow.string()),
+            ("automatically_resolved", pyarrow.bool_()),
+            ("units", pyarrow.list_(unit)),
+        ]
+    )
+
+
+def to_timestamp(value) -> Optional[datetime.datetime]:
+    return to_naive_utc(value) if value is not None else None
+
+
+def to_parquet_row(incident: Incident) -> dict:
+    return {
+        "id": str(incident.id),
+        "number": incident.number,
+        "category": str(incident.category),
+        "description": incident.description,
+        "intersection": incident.intersection,
+        "municipality": incident.municipality,
+        "agency": incident.agency,
+        "priority": incident.priority,
+        "dispatched_at": to_timestamp(incident.dispatched_at),
+        "latitude": float(incident.latitude) if incident.latitude is not None else None,
+        "longitude": float(incident.longitude) if incident.longitude is not None else None,
+        "added_at": to_timestamp(incident.added_at),
+        "updated_at": to_timestamp(incident.updated_at),
+        "resolved_at": to_timestamp(incident.resolved_at),
+        "client": incident.client,
+        "automatically_resolved": incident.automatically_resolved,
+        "units": [
+            {
+                "short_name": unit.short_name,
+                "name": unit.name,
+                "added_at": to_timestamp(unit.added_at),
+                "removed_at": to_timestamp(unit.removed_at),
+                "last_seen": to_timestamp(unit.last_seen),
+                "automatically_removed": unit.automatically_removed,
+            }
+            for unit in incident.units
+        ],
+    }
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    """Writes a snapshot file per closed day and format, and lists them in a manifest
+
+    A day is closed once it ended more than the delay ago, by which time its
+    incidents have been resolved by the feed or the resolver. Snapshots are never
+    rewritten, so they can be cached forever by clients and proxies.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.formats: tuple[str, ...] = ()
+        self.delay = datetime.timedelta(hours=24)
+        self.chunk_size = 1000
+        self.logger = logging.getLogger(__name__)
+
+        self._manifest: tuple[float, list[dict]] = (None, [])
+
+    def init(
+        self,
+        directory: str,
+        formats: tuple[str, ...] = ("ndjson",),
+        delay: datetime.timedelta = datetime.timedelta(hours=24),
+        chunk_size: int = 1000,
+    ) -> None:
+        """
+        Args:
+            directory (str): Where the snapshots and their manifest are stored
+            formats (tuple[str, ...]): The formats to write, parquet requires pyarrow
+            delay (datetime.timedelta): How long after its end a day is snapshotted
+            chunk_size (int): The number of incidents read from the database at a time
+        """
+
+        unsupported = set(formats) - set(available_formats())
+        if unsupported:
+            self.logger.warning(
+                f"Snapshot format(s) {', '.join(sorted(unsupported))} unavailable, install pyarrow for parquet"
+            )
+
+        self.directory = directory
+        self.formats = tuple(f for f in formats if f in available_formats())
+        self.delay = delay
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILENAME)
+
+    def manifest(self) -> list[dict]:
+        """Returns the written snapshots, oldest first, re-reading the manifest only when it changed"""
+        if self.directory is None:
+            return []
+
+        try:
+            modified = os.stat(self.manifest_path).st_mtime
+        except FileNotFoundError:
+            return []
+
+        loaded_at, files = self._manifest
+        if loaded_at != modified:
+            with open(self.manifest_path, encoding="utf-8") as file:
+                files = json.load(file)["files"]
+            self._manifest = (modified, files)
+        return files
+
+    def get(self, filename: str) -> Optional[dict]:
+        """Returns the manifest entry of the given snapshot file, if it exists"""
+        for entry in self.manifest():
+            if entry["filename"] == filename:
+                return entry
+        return None
+
+    def path(self, entry: dict) -> str:
+        return os.path.join(self.directory, entry["filename"])
+
+    def closed_days(self) -> list[datetime.date]:
+        """Returns the closed days that are missing a snapshot in one of the formats"""
+        first = min(
+            (
+                to_naive_utc(value)
+                for value in (
+                    model.select(fn.MIN(model.dispatched_at)).scalar()
+                    for model in export.UNIT_MODELS
+                )
+                if value is not None
+            ),
+            default=None,
+        )
+        if first is None:
+            return []
+
+        last = (datetime.datetime.utcnow() - self.delay).date() - datetime.timedelta(days=1)
+        written = {(entry["date"], entry["format"]) for entry in self.manifest()}
+
+        days = []
+        day = first.date()
+        while day <= last:
+            if any((day.isoformat(), f) not in written for f in self.formats):
+                days.append(day)
+            day += datetime.timedelta(days=1)
+        return days
+
+    async def write_closed_days(self) -> int:
+        """Writes the snapshots of every closed day that is missing one, a day at a time in a worker thread
+
+        Returns:
+            int: The number of snapshot files written
+        """
+
+        if self.directory is None or not self.formats:
+            return 0
+
+        days = await asyncio.to_thread(self.closed_days)
+        written = 0
+        for day in days:
+            try:
+                entries = await asyncio.to_thread(self.__write_day, day)
+            except Exception as e:
+                self.logger.error(f"Error writing snapshot of {day}: {e}")
+                break
+            written += len(entries)
+
+        if written:
+            self.logger.info(f"Wrote {written} snapshot file(s) for {len(days)} day(s)")
+        return written
+
+    def __write_day(self, day: datetime.date) -> list[dict]:
+        existing = {entry["format"] for entry in self.manifest() if entry["date"] == day.isoformat()}
+
+        entries = []
+        for format in self.formats:
+            if format in existing:
+                continue
+
+            filename = f"incidents-{day.isoformat()}.{EXTENSIONS[format]}"
+            path = os.path.join(self.directory, filename)
+            # written next to the final path and renamed, so a file is either complete or absent
+            descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(descriptor)
+            try:
+                count = (
+                    self.__write_parquet(day, temporary)
+                    if format == "parquet"
+                    else self.__write_ndjson(day, temporary)
+                )
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+
+            entries.append(
+                {
+                    "date": day.isoformat(),
+                    "format": format,
+                    "filename": filename,
+                    "size": os.path.getsize(path),
+                    "sha256": sha256_file(path),
+                    "incidents": count,
+                    "created_at": datetime.datetime.utcnow().isoformat(),
+                }
+            )
+
+        if entries:
+            self.__save_manifest(self.manifest() + entries)
+        return entries
+
+    def __incidents(self, day: datetime.date):
+        conditions = export.search_conditions(start=day, end=day)
+        return export.select_history(conditions, self.chunk_size)
+
+    def __chunks(self, day: datetime.date):
+        incidents = self.__incidents(day)
+        while True:
+            chunk = list(itertools.islice(incidents, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def __write_ndjson(self, day: datetime.date, path: str) -> int:
+        count = 0
+        with open(path, "wb") as raw:
+            # a fixed mtime keeps the file identical if it is ever regenerated
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as file:
+                for chunk in self.__chunks(day):
+                    file.write(export.to_ndjson(chunk))
+                    count += len(chunk)
+        return count
+
+    def __write_parquet(self, day: datetime.date, path: str) -> int:
+        schema = parquet_schema()
+        count = 0
+        with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+            for chunk in self.__chunks(day):
+                writer.write_table(
+                    pyarrow.Table.from_pylist(
+                        [to_parquet_row(incident) for incident in chunk], schema=schema
+                    )
+                )
+                count += len(chunk)
+        return count
+
+    def __save_manifest(self, files: list[dict]) -> None:
+        files = sorted(files, key=lambda entry: (entry["date"], entry["format"]))
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump({"files": files}, file, indent=1)
+        os.replace(temporary, self.manifest_path)
+
+
+snapshot_store = SnapshotStore()
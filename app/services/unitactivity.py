@@ -0,0 +1,96 @@
+import datetime
+import heapq
+import itertools
+import logging
+from typing import NamedTuple, Optional
+
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+
+""" Which incident each unit is currently assigned to, kept in memory by the updater """
+
+
+class UnitAssignment(NamedTuple):
+    incident_id: object
+    incident_number: int
+
+
+class UnitActivityIndex:
+    """Maps the short name of every assigned unit to the incidents it is on
+
+    The updater replaces the whole map after each feed snapshot, readers only ever
+    see a complete snapshot since the map is swapped rather than modified.
+    """
+
+    def __init__(self):
+        self.assignments: dict[str, tuple[UnitAssignment, ...]] = {}
+        self.updated_at: Optional[datetime.datetime] = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the index has been built from a feed snapshot yet"""
+        return self.updated_at is not None
+
+    def replace(self, units: dict[tuple, object], incidents: dict[int, object]):
+        """Rebuilds the index from a feed snapshot
+
+        Args:
+            units (dict[tuple, object]): The units in the snapshot, keyed by (incident id, short name)
+            incidents (dict[int, object]): The number and id of every incident in the snapshot
+        """
+
+        numbers = {incident_id: number for number, incident_id in incidents.items()}
+
+        assignments = {}
+        for incident_id, short_name in units:
+            assignment = UnitAssignment(incident_id, numbers.get(incident_id))
+            assignments.setdefault(short_name, []).append(assignment)
+
+        self.assignments = {name: tuple(items) for name, items in assignments.items()}
+        self.updated_at = datetime.datetime.utcnow()
+
+    def current(self, short_name: str) -> tuple[UnitAssignment, ...]:
+        """Returns the incidents the unit is currently assigned to"""
+
+        if self.ready:
+            return self.assignments.get(short_name, ())
+
+        # until the first snapshot, answer from the database
+        query = (
+            Unit.select(Unit.incident, Incident.number)
+            .join(Incident)
+            .where(
+                Unit.short_name == short_name,
+                Unit.removed_at.is_null(),
+                Incident.resolved_at.is_null(),
+            )
+            .tuples()
+        )
+        return tuple(UnitAssignment(*row) for row in query)
+
+
+def unit_history(short_name: str, offset: int = 0, limit: int = 50) -> list[Unit]:
+    """Returns the assignments of the unit across both tiers, most recent first
+
+    Each row is a unit with its incident joined in, read through the
+    (short_name, added_at) index.
+    """
+
+    tiers = []
+    for unit_model, incident_model in ((Unit, Incident), (ArchivedUnit, ArchivedIncident)):
+        query = (
+            unit_model.select(unit_model, incident_model)
+            .join(incident_model)
+            .where(unit_model.short_name == short_name)
+            .order_by(unit_model.added_at.desc())
+            .limit(offset + limit)
+        )
+        tiers.append(iter(query))
+
+    merged = heapq.merge(*tiers, key=lambda unit: unit.added_at, reverse=True)
+    return list(itertools.islice(merged, offset, offset + limit))
+
+
+unit_activity = UnitActivityIndex()
@@ -0,0 +1,71 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from lcwc.category import IncidentCategory
+from lcwc.unit import Unit
+from lcwc.utils.unitparser import UnitParser
+
+""" Memoized unit name parsing, shared by the API and the updater """
+
+
+class UnitNameCache:
+    """Bounded LRU cache of parsed unit names
+
+    The vocabulary of unit names is small and heavily repeated, so nearly every
+    lookup is a hit. Names that fail to parse are cached too, as None.
+    Cached units are shared and must not be modified.
+    """
+
+    def __init__(self, max_size: int = 8192):
+        self.max_size = max_size
+        self.units: OrderedDict[tuple[str, str], Optional[Unit]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # every caller parses on the event loop today, the lock keeps the cache safe for worker threads
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def parse(self, name: str, category: IncidentCategory) -> Optional[Unit]:
+        """Returns the parsed unit, or None when the name cannot be parsed"""
+
+        key = (name, str(category))
+        with self.lock:
+            if key in self.units:
+                self.units.move_to_end(key)
+                self.hits += 1
+                return self.units[key]
+            self.misses += 1
+
+        try:
+            unit = UnitParser.parse_unit(name, category)
+        except Exception as e:
+            self.logger.debug(f"Unable to parse unit {name}: {e}")
+            unit = None
+
+        with self.lock:
+            self.units[key] = unit
+            self.units.move_to_end(key)
+            while len(self.units) > self.max_size:
+                self.units.popitem(last=False)
+
+        return unit
+
+    def name(self, name: str, category: IncidentCategory) -> Optional[str]:
+        """Returns the parsed name (ex: ENG for ENG531) of the unit"""
+        unit = self.parse(name, category)
+        return unit.name if unit is not None else None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.units),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+unit_names = UnitNameCache()
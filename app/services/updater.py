@@ -1,12 +1,21 @@
+import asyncio
 import logging
-import os
 import aiohttp
 import time
 import datetime
 import peewee
+from typing import Callable
 from app.database.models.feed_request import FeedRequest
+from app.database.models.pending_resolution import PendingResolution
 from app.database.models.unit import Unit as UnitModel
-from lcwc.arcgis import ArcGISClient as Client, ArcGISIncident as Incident
+from lcwc.arcgis import ArcGISIncident as Incident
+from app.services.circuitbreaker import CircuitBreaker, CircuitOpenError
+from app.services.feedcapture import FeedRecorder
+from app.services.feedsources import HedgedFeed
+from app.services.unitactivity import UnitActivityIndex
+from app.services.unitnames import UnitNameCache, unit_names as shared_unit_names
+from app.services.rollups import FACT_FIELDS, IncidentFacts, Rollup, to_naive_utc
+from app.utils import geo, upstream
 from app.utils.info import get_lcwc_dist
 from app.database.models.incident import Incident as IncidentModel
 
@@ -14,19 +23,66 @@ from app.database.models.incident import Incident as IncidentModel
 
 
 class IncidentUpdater:
-    def __init__(self, db: peewee.Database):
+    def __init__(
+        self,
+        db: peewee.Database,
+        rollups: list[Rollup] = None,
+        resolution_grace: datetime.timedelta = datetime.timedelta(minutes=2),
+        heartbeat_interval: datetime.timedelta = datetime.timedelta(minutes=5),
+        unit_activity: UnitActivityIndex = None,
+        unit_names: UnitNameCache = shared_unit_names,
+        recorder: FeedRecorder = None,
+        feed: HedgedFeed = None,
+        breaker: CircuitBreaker = None,
+        deadline: float = None,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.utcnow,
+    ):
         """Initializes the incident updater
 
         Args:
             db (peewee.Database): The database connection
+            rollups (list[Rollup]): The pre-aggregated counts to keep up to date as incidents arrive
+            resolution_grace (datetime.timedelta): How long an incident must be missing from the feed before it is resolved
+            heartbeat_interval (datetime.timedelta): How often the last_seen of assigned units is persisted
+            unit_activity (UnitActivityIndex): The in-memory index of unit assignments to keep up to date
+            unit_names (UnitNameCache): The memoized unit name parser used to fill in unit names
+            recorder (FeedRecorder): Records every fetched feed snapshot for replay, if set
+            feed (HedgedFeed): The sources the incidents are fetched from, the ArcGIS feed by default
+            breaker (CircuitBreaker): Stops fetching the feed after repeated failures, if set
+            deadline (float): The number of seconds a fetch of the feed may take, hedges included
+            clock (Callable): Returns the current naive UTC time, replays substitute the capture time
         """
 
         self.db = db
-        self.incident_client = Client()
+        self.rollups = rollups or []
+        self.resolution_grace = resolution_grace
+        self.clock = clock
+
+        # incident number -> id of the unresolved incidents seen in the last snapshot,
+        # loaded from the database on the first cycle
+        self.active_incidents: dict[int, object] = None
+        # incident id -> (number, time it went missing), mirrored in PendingResolution
+        self.pending_resolutions: dict[object, tuple[int, datetime.datetime]] = None
+
+        # (incident id, short name) of the units assigned in the last snapshot, only
+        # assignments and clears are written immediately, last_seen is flushed periodically
+        self.heartbeat_interval = heartbeat_interval
+        self.present_units: set[tuple] = None
+        self.last_heartbeat: datetime.datetime = None
+        self.unit_activity = unit_activity
+        self.unit_names = unit_names
+        self.recorder = recorder
+        self.feed = feed or HedgedFeed.from_names(["arcgis"])
+        self.breaker = breaker or CircuitBreaker("feed")
+        self.deadline = deadline
         self.cached_incidents = {}
         self.logger = logging.getLogger(__name__)
 
-        self.parser_name = f"{self.incident_client.name} v{get_lcwc_dist().version}"
+        # the client of the source that won the last fetch, stored with the incidents it
+        # returned, without the replica suffix so a record does not flip between replicas
+        self.parser_name = (
+            f"{self.feed.sources[0].client.name} v{get_lcwc_dist().version}"
+        )
 
     def __log_incident(self, incident: Incident, tag: str = None):
         """Logs an incident to the logger/console"""
@@ -43,8 +99,24 @@ class IncidentUpdater:
         """Processes live incidents and compares them against the database, updating when needed"""
         with self.db.atomic():
             # TODO get modified incidents and log out the changes
-            
+
+            previous_facts = {}
+            if self.rollups:
+                previous_facts = {
+                    row.number: IncidentFacts.from_db_model(row)
+                    for row in IncidentModel.select(*FACT_FIELDS).where(
+                        IncidentModel.number.in_([i.number for i in incidents])
+                    )
+                }
+            rollup_changes = []
+            live_incidents = {}
+            live_units = {}
+
             for incident in incidents:
+                geohash = geo.encode_or_none(
+                    incident.coordinates.latitude, incident.coordinates.longitude
+                )
+
                 try:
                     incident_query = IncidentModel.insert(
                         {
@@ -56,10 +128,11 @@ class IncidentUpdater:
                             IncidentModel.number: incident.number,
                             IncidentModel.priority: incident.priority,
                             IncidentModel.agency: incident.agency,
-                            IncidentModel.added_at: datetime.datetime.utcnow(),
+                            IncidentModel.added_at: self.clock(),
                             IncidentModel.client: self.parser_name,
                             IncidentModel.latitude: incident.coordinates.latitude,
                             IncidentModel.longitude: incident.coordinates.longitude,
+                            IncidentModel.geohash: geohash,
                         }
                     ).on_conflict(
                         conflict_target=[IncidentModel.number],
@@ -69,7 +142,12 @@ class IncidentUpdater:
                             IncidentModel.intersection: incident.intersection,
                             IncidentModel.municipality: incident.municipality,
                             IncidentModel.priority: incident.priority,
-                            IncidentModel.updated_at: datetime.datetime.utcnow(),
+                            IncidentModel.latitude: incident.coordinates.latitude,
+                            IncidentModel.longitude: incident.coordinates.longitude,
+                            IncidentModel.geohash: geohash,
+                            IncidentModel.updated_at: self.clock(),
+                            # the source whose response the stored fields came from
+                            IncidentModel.client: self.parser_name,
                             # TODO allow incidents to be re-activated until upstream issue is resolved
                             # involving gaps in incident resolution
                             IncidentModel.resolved_at: None,
@@ -78,109 +156,300 @@ class IncidentUpdater:
                     )
 
                     res = incident_query.execute()
+
+                    if self.rollups:
+                        before = previous_facts.get(incident.number)
+                        after = self.__incident_facts(incident, geohash, before)
+                        if before != after:
+                            rollup_changes.append((before, after))
                 except Exception as e:
                     self.logger.error(f"Error adding incident to db: {e}")
 
                 db_incident = IncidentModel.get(IncidentModel.number == incident.number)
+                live_incidents[db_incident.number] = db_incident.id
 
-                try:
-                    for unit in incident.units:
-                        r = (
-                            UnitModel.insert(
-                                incident=db_incident,
-                                short_name=unit.full_name,
-                                added_at=datetime.datetime.utcnow(),
-                                last_seen=datetime.datetime.utcnow(),
-                            )
-                            .on_conflict(
-                                conflict_target=[
-                                    UnitModel.incident,
-                                    UnitModel.short_name,
-                                ],
-                                update={
-                                    UnitModel.last_seen: datetime.datetime.utcnow(),
-                                },
-                            )
-                            .execute()
-                        )
+                for unit in incident.units:
+                    live_units[(db_incident.id, unit.full_name)] = incident.category
 
+            try:
+                # savepoints, so a failure does not commit half of the changes
+                with self.db.atomic():
+                    self.__persist_unit_presence(live_units, live_incidents)
+            except Exception as e:
+                self.logger.error(f"Error adding unit to db: {e}")
+                # reload the presence from the database rather than trust a partially applied one
+                self.present_units = None
+
+            if self.unit_activity is not None:
+                self.unit_activity.replace(live_units, live_incidents)
+
+            for rollup in self.rollups:
+                try:
+                    # as is each rollup
+                    with self.db.atomic():
+                        rollup.apply(rollup_changes)
                 except Exception as e:
-                    self.logger.error(f"Error adding unit to db: {e}")
+                    self.logger.error(
+                        f"Error updating {rollup.__class__.__name__} counts: {e}"
+                    )
 
             try:
-                # select all recently unresolved incidents
-                active_numbers = (
-                    IncidentModel.select(IncidentModel.number)
-                    .where(
-                        IncidentModel.resolved_at.is_null(),
-                        IncidentModel.updated_at
-                        < datetime.datetime.utcnow()
-                        - datetime.timedelta(
-                            minutes=int(os.getenv("ACTIVE_INCIDENT_RESOLVER_MIN"))
-                        ),
-                        IncidentModel.updated_at
-                        > datetime.datetime.utcnow()
-                        - datetime.timedelta(
-                            minutes=int(os.getenv("ACTIVE_INCIDENT_RESOLVER_MAX"))
-                        ),
-                    )
-                    .dicts()
-                )
+                with self.db.atomic():
+                    self.__resolve_missing_incidents(live_incidents)
+            except Exception as e:
+                self.logger.error(f"Error resolving incidents: {e}")
+                # reload the snapshot from the database rather than trust a partially applied one
+                self.active_incidents = None
 
-                self.logger.info(
-                    f"Found {len(active_numbers)} incidents to resolve that are older than {os.getenv('ACTIVE_INCIDENT_RESOLVER_MIN')} minutes but not older than {os.getenv('ACTIVE_INCIDENT_RESOLVER_MAX')} minutes"
+    def __persist_unit_presence(
+        self, live_units: dict[tuple, object], live_incidents: dict[int, object]
+    ):
+        """Writes the units that were assigned or cleared since the last snapshot, and periodically the last_seen of every assigned unit
+
+        Args:
+            live_units (dict[tuple, IncidentCategory]): The category of the incident of each unit in the current snapshot, by (incident id, short name)
+            live_incidents (dict[int, object]): The number and id of every incident in the current snapshot
+        """
+
+        now = self.clock()
+        incident_ids = list(live_incidents.values())
+
+        if self.present_units is None:
+            self.present_units = set(
+                UnitModel.select(UnitModel.incident, UnitModel.short_name)
+                .where(
+                    UnitModel.incident.in_(incident_ids),
+                    UnitModel.removed_at.is_null(),
                 )
+                .tuples()
+            )
+
+        assigned = [key for key in live_units if key not in self.present_units]
+        cleared = [key for key in self.present_units if key not in live_units]
+
+        if assigned:
+            UnitModel.insert_many(
+                [
+                    {
+                        "incident": incident_id,
+                        "short_name": short_name,
+                        "name": self.unit_names.name(
+                            short_name, live_units[(incident_id, short_name)]
+                        ),
+                        "added_at": now,
+                        "last_seen": now,
+                    }
+                    for incident_id, short_name in assigned
+                ]
+            ).on_conflict(
+                conflict_target=[UnitModel.incident, UnitModel.short_name],
+                update={
+                    # a unit assigned to the same incident again
+                    UnitModel.last_seen: now,
+                    UnitModel.removed_at: None,
+                    UnitModel.automatically_removed: False,
+                },
+            ).execute()
+
+        if cleared:
+            by_incident = {}
+            for incident_id, short_name in cleared:
+                by_incident.setdefault(incident_id, []).append(short_name)
+
+            for incident_id, short_names in by_incident.items():
+                UnitModel.update(removed_at=now, last_seen=now).where(
+                    UnitModel.incident == incident_id,
+                    UnitModel.short_name.in_(short_names),
+                    UnitModel.removed_at.is_null(),
+                ).execute()
 
-                # mark them as resolved
-                resolved = (
-                    IncidentModel.update(
-                        resolved_at=datetime.datetime.utcnow(),
-                        automatically_resolved=True,
+        self.present_units = set(live_units)
+
+        if (
+            self.last_heartbeat is None
+            or now - self.last_heartbeat >= self.heartbeat_interval
+        ):
+            # every unit that is not removed on a live incident is one of the present units
+            heartbeats = 0
+            if incident_ids:
+                heartbeats = (
+                    UnitModel.update(last_seen=now)
+                    .where(
+                        UnitModel.incident.in_(incident_ids),
+                        UnitModel.removed_at.is_null(),
                     )
-                    .where(IncidentModel.number.in_(active_numbers))
                     .execute()
                 )
+            self.last_heartbeat = now
+            self.logger.debug(f"Flushed the heartbeat of {heartbeats} unit(s)")
 
-                self.logger.info(f"Resolved {resolved} incidents")
+        if assigned or cleared:
+            self.logger.info(
+                f"{len(assigned)} unit(s) assigned, {len(cleared)} unit(s) cleared"
+            )
 
-            except Exception as e:
-                self.logger.error(f"Error resolving incidents: {e}")
+    def __load_resolution_state(self):
+        """Restores the previous snapshot and the pending resolutions after a restart"""
+
+        self.active_incidents = {
+            row.number: row.id
+            for row in IncidentModel.select(IncidentModel.id, IncidentModel.number).where(
+                IncidentModel.resolved_at.is_null()
+            )
+        }
+        self.pending_resolutions = {
+            row.incident: (row.number, row.missing_since)
+            for row in PendingResolution.select()
+        }
+
+        self.logger.info(
+            f"Loaded {len(self.active_incidents)} active and {len(self.pending_resolutions)} pending incident(s)"
+        )
+
+    def __resolve_missing_incidents(self, live_incidents: dict[int, object]):
+        """Resolves the incidents that have been missing from the feed for longer than the grace period
+
+        Args:
+            live_incidents (dict[int, object]): The number and id of every incident in the current snapshot
+        """
+
+        if self.active_incidents is None:
+            self.__load_resolution_state()
+
+        now = self.clock()
+        live_ids = set(live_incidents.values())
+
+        reappeared = [
+            incident_id
+            for incident_id in self.pending_resolutions
+            if incident_id in live_ids
+        ]
+        missing = [
+            (number, incident_id)
+            for number, incident_id in self.active_incidents.items()
+            if number not in live_incidents and incident_id not in self.pending_resolutions
+        ]
+
+        if reappeared:
+            PendingResolution.delete().where(
+                PendingResolution.incident.in_(reappeared)
+            ).execute()
+            for incident_id in reappeared:
+                del self.pending_resolutions[incident_id]
+
+        if missing:
+            PendingResolution.insert_many(
+                [
+                    {"incident": incident_id, "number": number, "missing_since": now}
+                    for number, incident_id in missing
+                ]
+            ).on_conflict_ignore().execute()
+            for number, incident_id in missing:
+                self.pending_resolutions[incident_id] = (number, now)
+
+        threshold = now - self.resolution_grace
+        due = [
+            incident_id
+            for incident_id, (number, missing_since) in self.pending_resolutions.items()
+            if missing_since <= threshold
+        ]
+
+        resolved = 0
+        if due:
+            # incidents resolved in the meantime (e.g. by the resolver) keep their resolution
+            resolved = (
+                IncidentModel.update(
+                    resolved_at=now,
+                    automatically_resolved=True,
+                )
+                .where(IncidentModel.id.in_(due), IncidentModel.resolved_at.is_null())
+                .execute()
+            )
+            PendingResolution.delete().where(
+                PendingResolution.incident.in_(due)
+            ).execute()
+            for incident_id in due:
+                del self.pending_resolutions[incident_id]
+
+        self.active_incidents = dict(live_incidents)
+
+        if missing or reappeared or due:
+            self.logger.info(
+                f"{len(missing)} incident(s) left the feed, {len(reappeared)} reappeared, resolved {resolved}"
+            )
+
+    def __incident_facts(
+        self, incident: Incident, geohash: str, before: IncidentFacts = None
+    ) -> IncidentFacts:
+        """Returns the rolled-up attributes of the incident as stored by the upsert"""
+
+        # the dispatch time and agency are only written when the incident is first inserted
+        return IncidentFacts(
+            category=getattr(incident.category, "value", incident.category),
+            dispatched_at=before.dispatched_at
+            if before
+            else to_naive_utc(incident.date),
+            municipality=incident.municipality,
+            agency=before.agency if before else incident.agency,
+            geohash=geohash,
+        )
 
     async def get_incidents(self) -> list[Incident]:
         """Fetches the incidents from the LCWC feed"""
         live_incidents = []
         success = False
 
-        async with aiohttp.ClientSession() as session:
+        async with upstream.create_session() as session:
             fetch_start = time.perf_counter()
             try:
-                live_incidents = await self.incident_client.get_incidents(
-                    session, throw_on_error=True
+                source, live_incidents, _ = await self.breaker.call(
+                    self.feed.get_incidents, session, timeout=self.deadline
                 )
                 fetch_end = time.perf_counter()
+                self.parser_name = f"{source.client.name} v{get_lcwc_dist().version}"
                 self.logger.info(
-                    f"Found {len(live_incidents)} live incidents in {fetch_end - fetch_start:0.2f} seconds via {self.parser_name}"
+                    f"Found {len(live_incidents)} live incidents in {fetch_end - fetch_start:0.2f} seconds via {source.name} ({self.parser_name})"
                 )
                 success = True
+            except CircuitOpenError as e:
+                self.logger.warning(f"Not fetching incidents: {e}")
+                return
+            except asyncio.TimeoutError:
+                self.logger.error(
+                    f"Error fetching incidents: no response within the {self.deadline} second deadline"
+                )
+                return
             except Exception as e:
                 self.logger.error(f"Error fetching incidents: {e}")
                 return
 
         self.log_request(success, fetch_end - fetch_start, len(live_incidents))
 
+        if self.recorder is not None:
+            try:
+                # compressing and appending to the capture would block the event loop
+                await asyncio.to_thread(
+                    self.recorder.record,
+                    live_incidents,
+                    fetched_at=self.clock(),
+                    fetch_time=fetch_end - fetch_start,
+                )
+            except Exception as e:
+                self.logger.error(f"Error recording feed snapshot: {e}")
+
         return live_incidents
 
-    async def update_incidents(self) -> None:
+    async def update_incidents(self) -> bool:
+        """Fetches and processes the live incidents, returning whether the database was updated"""
         self.logger.info("Updating incidents...")
 
         live_incidents = await self.get_incidents()
         if live_incidents is None:
-            self.logger.error(
-                "All sequential attempts to get incidents failed, skipping..."
-            )
-            return
+            self.logger.error("No incidents fetched, skipping...")
+            return False
 
         self.process_live_incidents(live_incidents)
+        return True
 
     def log_request(
         self, success: bool, execution_time: float, incidents: int, msg: str = None
@@ -0,0 +1,173 @@
+import math
+from typing import Optional
+
+""" Geohash encoding and distance helpers used by the spatial incident queries """
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+EARTH_RADIUS = 6371008.8
+""" Mean radius of the earth in meters """
+
+GEOHASH_PRECISION = 9
+""" Precision of the geohashes stored with each incident (cells of roughly 5m x 5m) """
+
+
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encodes the given coordinates as a geohash
+
+    Args:
+        latitude (float): The latitude in degrees
+        longitude (float): The longitude in degrees
+        precision (int): The number of characters of the geohash
+
+    Returns:
+        str: The geohash
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lng_range[0] = mid
+            else:
+                bits <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+
+def encode_or_none(latitude: Optional[float], longitude: Optional[float]) -> Optional[str]:
+    """Encodes the given coordinates as a geohash, or returns None when they are missing"""
+    if latitude is None or longitude is None:
+        return None
+    return encode(float(latitude), float(longitude))
+
+
+def decode_bounds(geohash: str) -> tuple[float, float, float, float]:
+    """Returns the bounds of the given geohash cell
+
+    Returns:
+        tuple[float, float, float, float]: The minimum latitude, minimum longitude, maximum latitude and maximum longitude
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lng_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def cell_size(precision: int) -> tuple[float, float]:
+    """Returns the height and width in degrees of geohash cells of the given precision"""
+    bits = precision * 5
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cover(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    max_cells: int = 16,
+    max_precision: int = 7,
+) -> list[str]:
+    """Returns the geohash cells that cover the given bounding box
+
+    The finest precision whose cover needs no more than max_cells cells is used,
+    which keeps the number of ranges in the resulting query small.
+
+    Returns:
+        list[str]: The geohash prefixes of the covering cells
+    """
+    for precision in range(max_precision, 0, -1):
+        height, width = cell_size(precision)
+
+        first_row = math.floor((min_lat + 90.0) / height)
+        last_row = math.floor((min(max_lat, 89.999999) + 90.0) / height)
+        first_col = math.floor((min_lng + 180.0) / width)
+        last_col = math.floor((min(max_lng, 179.999999) + 180.0) / width)
+
+        rows = last_row - first_row + 1
+        cols = last_col - first_col + 1
+        if rows * cols > max_cells and precision > 1:
+            continue
+
+        cells = []
+        for row in range(first_row, last_row + 1):
+            latitude = -90.0 + (row + 0.5) * height
+            for col in range(first_col, last_col + 1):
+                longitude = -180.0 + (col + 0.5) * width
+                cells.append(encode(latitude, longitude, precision))
+        return cells
+
+    return []
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Returns the great-circle distance between two points in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(
+    latitude: float, longitude: float, radius: float
+) -> tuple[float, float, float, float]:
+    """Returns the bounding box of the circle with the given center and radius in meters
+
+    Returns:
+        tuple[float, float, float, float]: The minimum latitude, minimum longitude, maximum latitude and maximum longitude
+    """
+    d_lat = math.degrees(radius / EARTH_RADIUS)
+    cos_lat = math.cos(math.radians(latitude))
+    d_lng = 180.0 if cos_lat < 1e-9 else min(180.0, d_lat / cos_lat)
+
+    return (
+        max(-90.0, latitude - d_lat),
+        max(-180.0, longitude - d_lng),
+        min(90.0, latitude + d_lat),
+        min(180.0, longitude + d_lng),
+    )
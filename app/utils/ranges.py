@@ -0,0 +1,93 @@
+import os
+import re
+from typing import Optional
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+""" Single byte range requests (RFC 9110) on top of starlette's FileResponse, which only serves whole files """
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parses a Range header into the first and last byte offsets, inclusive
+
+    Multiple ranges and malformed headers are ignored, so the whole file is served.
+
+    Returns:
+        tuple[int, int]: The byte offsets, or None to serve the whole file
+
+    Raises:
+        RangeNotSatisfiable: When the range lies outside the file
+    """
+
+    if not header:
+        return None
+
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # a suffix range, the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable()
+    return first, last
+
+
+class FileRangeResponse(FileResponse):
+    """Serves a byte range of a file with 206 Partial Content"""
+
+    def __init__(self, path: str, first: int, last: int, size: int, **kwargs):
+        super().__init__(path, status_code=206, **kwargs)
+        self.first = first
+        self.last = last
+        self.headers["content-range"] = f"bytes {first}-{last}/{size}"
+        self.headers["content-length"] = str(last - first + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        remaining = self.last - self.first + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.first, os.SEEK_SET)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    }
+                )
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,60 @@
+import os
+from typing import Optional
+
+import aiohttp
+from yarl import URL
+
+""" HTTP sessions for the upstream LCWC services, which can be redirected to a local stand-in for benchmarking """
+
+
+class UpstreamOverrideSession:
+    """Wraps a client session, sending every request to the override server instead of its upstream host
+
+    The upstream host is kept as the first path segment, so a single stand-in
+    can serve both the ArcGIS feed and the LCWC website:
+
+        https://utility.arcgis.com/usrsvcs/... -> http://127.0.0.1:8765/utility.arcgis.com/usrsvcs/...
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, override: str):
+        self.session = session
+        self.override = URL(override)
+
+    def rewrite(self, url) -> URL:
+        url = URL(str(url))
+        path = f"{self.override.path.rstrip('/')}/{url.host}{url.path}"
+        return self.override.with_path(path).with_query(url.query)
+
+    def request(self, method: str, url, **kwargs):
+        return self.session.request(method, self.rewrite(url), **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(self.rewrite(url), **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(self.rewrite(url), **kwargs)
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.__aexit__(*args)
+
+
+def upstream_override() -> Optional[str]:
+    """Returns the base URL of the local stand-in for the upstream services, if configured"""
+    return os.getenv("LCWC_UPSTREAM_OVERRIDE") or None
+
+
+def create_session(**kwargs):
+    """Creates the client session used to reach the upstream services, honoring LCWC_UPSTREAM_OVERRIDE"""
+    session = aiohttp.ClientSession(**kwargs)
+
+    override = upstream_override()
+    if override:
+        return UpstreamOverrideSession(session, override)
+    return session
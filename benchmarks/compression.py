@@ -0,0 +1,164 @@
+import argparse
+import datetime
+import gzip
+import json
+import random
+import time
+import uuid
+
+from app.cache.compression import available_encodings, compress
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+""" Reports the bytes saved and the CPU cost of compressing representative response bodies
+
+Usage:
+    python -m benchmarks.compression [--sizes 1 50 500 5000] [--json]
+"""
+
+CATEGORIES = ["Fire", "Medical", "Traffic"]
+MUNICIPALITIES = [
+    "LANCASTER CITY",
+    "MANHEIM TOWNSHIP",
+    "EAST HEMPFIELD TOWNSHIP",
+    "LANCASTER TOWNSHIP",
+    "WEST LAMPETER TOWNSHIP",
+    "EPHRATA BOROUGH",
+    "ELIZABETHTOWN BOROUGH",
+]
+DESCRIPTIONS = [
+    "MEDICAL EMERGENCY",
+    "VEHICLE ACCIDENT-NO INJURIES",
+    "VEHICLE ACCIDENT-INJURIES",
+    "FIRE ALARM",
+    "BUILDING FIRE",
+    "ROUTINE TRANSFER",
+]
+
+
+def incident(rng: random.Random, now: datetime.datetime) -> dict:
+    dispatched_at = now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "category": rng.choice(CATEGORIES),
+        "description": rng.choice(DESCRIPTIONS),
+        "intersection": f"{rng.choice(['N', 'S', 'E', 'W'])} {rng.randint(1, 999)} ST / OAK ST",
+        "municipality": rng.choice(MUNICIPALITIES),
+        "dispatched_at": dispatched_at.isoformat(),
+        "number": rng.randint(10000000, 99999999),
+        "priority": rng.randint(1, 3),
+        "agency": f"STATION {rng.randint(1, 99)}",
+        "coordinates": {
+            "latitude": round(rng.uniform(39.72, 40.32), 6),
+            "longitude": round(rng.uniform(-76.72, -75.87), 6),
+        },
+        "meta": {
+            "added_at": dispatched_at.isoformat(),
+            "updated_at": now.isoformat(),
+            "resolved_at": None,
+            "client": "ArcGISClient v0.10",
+            "automatically_resolved": False,
+        },
+        "units": [
+            {
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "name": None,
+                "short_name": f"{rng.choice(['MED', 'ENG', 'AMB', 'TRK'])}{rng.randint(10, 999)}",
+                "added_at": dispatched_at.isoformat(),
+                "removed_at": None,
+                "last_seen": now.isoformat(),
+                "automatically_removed": False,
+            }
+            for _ in range(rng.randint(0, 4))
+        ],
+    }
+
+
+def payload(count: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 1, 1)
+    incidents = [incident(rng, now) for _ in range(count)]
+    return json.dumps({"count": count, "data": incidents}).encode("utf-8")
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return brotli.decompress(body)
+
+
+def measure(body: bytes, encoding: str, level: int, iterations: int) -> dict:
+    kwargs = {"gzip_level": level} if encoding == "gzip" else {"brotli_quality": level}
+
+    start = time.process_time()
+    for _ in range(iterations):
+        compressed = compress(body, encoding, **kwargs)
+    compress_cpu = (time.process_time() - start) / iterations
+
+    start = time.process_time()
+    for _ in range(iterations):
+        decompress(compressed, encoding)
+    decompress_cpu = (time.process_time() - start) / iterations
+
+    return {
+        "encoding": encoding,
+        "level": level,
+        "raw_bytes": len(body),
+        "compressed_bytes": len(compressed),
+        "bytes_saved": len(body) - len(compressed),
+        "ratio": len(compressed) / len(body),
+        "compress_cpu_ms": compress_cpu * 1000,
+        "decompress_cpu_ms": decompress_cpu * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compression benchmark for response bodies"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1, 50, 500, 5000],
+        help="number of incidents per body",
+    )
+    parser.add_argument("--gzip-levels", type=int, nargs="+", default=[1, 6, 9])
+    parser.add_argument("--brotli-qualities", type=int, nargs="+", default=[1, 5, 11])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    levels = {"gzip": args.gzip_levels, "br": args.brotli_qualities}
+
+    results = []
+    for size in args.sizes:
+        body = payload(size, args.seed)
+        for encoding in available_encodings():
+            for level in levels[encoding]:
+                result = measure(body, encoding, level, args.iterations)
+                result["incidents"] = size
+                results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        f"{'incidents':>9} {'encoding':>8} {'level':>5} {'raw':>10} {'compressed':>10} "
+        f"{'saved':>10} {'ratio':>6} {'cpu ms':>8} {'decomp ms':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['incidents']:>9} {r['encoding']:>8} {r['level']:>5} {r['raw_bytes']:>10} "
+            f"{r['compressed_bytes']:>10} {r['bytes_saved']:>10} {r['ratio']:>6.3f} "
+            f"{r['compress_cpu_ms']:>8.2f} {r['decompress_cpu_ms']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
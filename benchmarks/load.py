@@ -0,0 +1,378 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+from dotenv import dotenv_values
+
+from benchmarks.stub import create_app as create_stub
+
+""" Load tests the API end to end against a local database and a local stand-in for the LCWC upstream services
+
+Usage:
+    python -m benchmarks.load [--duration 30] [--concurrency 16] [--mix incidents_active=5,agency_search=1]
+    python -m benchmarks.load --output results.json --baseline benchmarks/baseline.json
+
+The app is started as a subprocess with the settings of .env.default, a fresh
+SQLite database (or the MySQL database from the environment with --mysql) and
+LCWC_UPSTREAM_OVERRIDE pointing at the stub, so it ingests a synthetic feed
+while the request mix runs. Redis must be reachable at REDIS_HOST/REDIS_PORT.
+"""
+
+ROUTES = {
+    "incidents_active": "/api/v1/incidents/active",
+    "incidents_stats": "/api/v1/incidents/stats",
+    "incidents_search": "/api/v1/incidents/search?municipality=LANCASTER",
+    "incidents_search_category": "/api/v1/incidents/search?category=Medical",
+    "incidents_by_date_range": "/api/v1/incidents/by-date-range/{week_ago}/{today}",
+    "incidents_near": "/api/v1/incidents/near?lat=40.04&lng=-76.31&radius=5000",
+    "incidents_within": "/api/v1/incidents/within?bbox=-76.5,39.9,-76.1,40.2",
+    "incidents_heatmap": "/api/v1/incidents/heatmap?zoom=12",
+    "incidents_timeseries": "/api/v1/incidents/timeseries?bucket=day&group_by=municipality",
+    "incidents_related": "/api/v1/incidents/related/{incident_number}",
+    "incidents_export": "/api/v1/incidents/export?start={week_ago}&end={today}",
+    "incidents_export_csv": "/api/v1/incidents/export?format=csv&start={week_ago}&end={today}",
+    "incident_number": "/api/v1/incident/number/{incident_number}",
+    "incident_id": "/api/v1/incident/{incident_id}",
+    "unit_info": "/api/v1/units/info/{unit}",
+    "unit_info_batch": "/api/v1/units/info/batch",
+    "unit_current": "/api/v1/units/{unit}/current",
+    "unit_history": "/api/v1/units/{unit}/history",
+    "agencies_category": "/api/v1/agencies/Fire",
+    "agency_search": "/api/v1/agencies/search?category=Fire&city=Lancaster",
+    "agency_stats": "/api/v1/agencies/stats",
+    "agency": "/api/v1/agencies/Fire/01",
+    "snapshots": "/api/v1/snapshots",
+    "meta_stats": "/api/v1/meta/stats",
+}
+""" Every route of the API, except the snapshot files: a fresh database has no past day to snapshot """
+
+BODIES = {
+    "unit_info_batch": lambda units: {"names": units},
+}
+""" The routes requested with POST, and their JSON body given the units the app has ingested """
+
+DEFAULT_WEIGHTS = {"incidents_active": 5, "incident_number": 2}
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile of the given values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    if not mix:
+        return {name: DEFAULT_WEIGHTS.get(name, 1) for name in ROUTES}
+
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route {name}, expected one of {', '.join(ROUTES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class AppProcess:
+    """Runs the API as a subprocess configured for the benchmark"""
+
+    def __init__(self, port: int, upstream: str, mysql: bool, log_path: str):
+        self.port = port
+        self.upstream = upstream
+        self.mysql = mysql
+        self.log_path = log_path
+        self.process = None
+        self.directory = tempfile.mkdtemp(prefix="lcwc-load-")
+
+    def environment(self) -> dict:
+        env = {**os.environ}
+        defaults = dotenv_values(".env.default")
+        for key, value in defaults.items():
+            env.setdefault(key, value if value is not None else "")
+
+        env.update(
+            HOSTNAME="127.0.0.1",
+            PORT=str(self.port),
+            LCWC_UPSTREAM_OVERRIDE=self.upstream,
+            GEOCODING_ENABLED="False",
+            # every run starts from a separate, empty cache
+            CACHE_REDIS_KEY=f"lcwc-load-{os.getpid()}",
+            # all traffic comes from one client, per-client limits would only measure the limiter
+            RATE_LIMIT_ENABLED="False",
+            SNAPSHOT_DIRECTORY=os.path.join(self.directory, "snapshots"),
+        )
+        if not self.mysql:
+            env["SQLITE_DB"] = os.path.join(self.directory, "lcwc.db")
+        return env
+
+    def start(self):
+        log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "app.main"],
+            env=self.environment(),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, base: str, timeout: float) -> dict:
+    """Waits for the app to serve requests and ingest the first feed snapshot, returning the active incidents"""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base}/api/v1/incidents/active") as resp:
+                if resp.status == 200:
+                    body = await resp.json()
+                    if body.get("count"):
+                        return body
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.5)
+
+    raise SystemExit(f"The app did not ingest any incidents within {timeout} seconds")
+
+
+def resolve_targets(
+    weights: dict[str, float], active: dict
+) -> dict[str, list[tuple[str, Optional[dict]]]]:
+    """Fills in the route templates with incidents and units the app has ingested, paired with the body to POST"""
+
+    incidents = active["data"]
+    units = sorted({unit["short_name"] for incident in incidents for unit in incident["units"]})
+    today = datetime.date.today()
+
+    targets = {}
+    for name in weights:
+        paths = set()
+        for incident in incidents[:20]:
+            paths.add(
+                ROUTES[name].format(
+                    today=today.isoformat(),
+                    week_ago=(today - datetime.timedelta(days=7)).isoformat(),
+                    incident_number=incident["number"],
+                    incident_id=incident["id"],
+                    unit=units[len(paths) % len(units)] if units else "MED8611",
+                )
+            )
+        body = BODIES[name](units) if name in BODIES else None
+        targets[name] = [(path, body) for path in sorted(paths)]
+    return targets
+
+
+async def drive(
+    session: aiohttp.ClientSession,
+    base: str,
+    targets: dict[str, list[tuple[str, Optional[dict]]]],
+    weights: dict[str, float],
+    concurrency: int,
+    duration: float,
+    seed: int,
+    headers: dict,
+) -> dict[str, dict]:
+    samples = {name: {"latencies": [], "errors": 0} for name in targets}
+    names = list(targets)
+    name_weights = [weights[name] for name in names]
+    deadline = time.monotonic() + duration
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 7919 + worker_id)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, name_weights)[0]
+            path, body = rng.choice(targets[name])
+            start = time.perf_counter()
+            try:
+                async with session.request(
+                    "GET" if body is None else "POST",
+                    f"{base}{path}",
+                    json=body,
+                    headers=headers,
+                ) as resp:
+                    await resp.read()
+                    ok = resp.status < 400
+            except aiohttp.ClientError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if ok:
+                samples[name]["latencies"].append(elapsed)
+            else:
+                samples[name]["errors"] += 1
+
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return samples
+
+
+def summarize(samples: dict[str, dict], duration: float) -> dict:
+    routes = {}
+    all_latencies = []
+    errors = 0
+    for name, sample in samples.items():
+        latencies = sample["latencies"]
+        all_latencies.extend(latencies)
+        errors += sample["errors"]
+        routes[name] = {
+            "requests": len(latencies),
+            "errors": sample["errors"],
+            "throughput": len(latencies) / duration,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+
+    return {
+        "total": {
+            "requests": len(all_latencies),
+            "errors": errors,
+            "throughput": len(all_latencies) / duration,
+            "p50_ms": percentile(all_latencies, 50),
+            "p95_ms": percentile(all_latencies, 95),
+            "p99_ms": percentile(all_latencies, 99),
+        },
+        "routes": routes,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """Returns the routes whose p95 latency regressed beyond the tolerance"""
+
+    regressions = []
+    for name, base in baseline.get("routes", {}).items():
+        current = results["routes"].get(name)
+        if current is None or not current["requests"]:
+            continue
+        limit = base["p95_ms"] * (1 + tolerance)
+        if current["p95_ms"] > limit and current["p95_ms"] - base["p95_ms"] > min_delta:
+            regressions.append(
+                f"{name}: p95 {current['p95_ms']:.1f} ms vs {base['p95_ms']:.1f} ms baseline"
+            )
+    return regressions
+
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+
+    stub_runner = web.AppRunner(create_stub(incidents=args.incidents, seed=args.seed))
+    await stub_runner.setup()
+    await web.TCPSite(stub_runner, "127.0.0.1", args.stub_port).start()
+
+    app = AppProcess(
+        args.port,
+        f"http://127.0.0.1:{args.stub_port}",
+        args.mysql,
+        args.app_log,
+    )
+    app.start()
+
+    base = f"http://127.0.0.1:{args.port}"
+    # bypassing the response cache measures the routes themselves rather than redis
+    headers = {"Cache-Control": "no-cache"} if args.bypass_cache else {}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            active = await wait_until_ready(session, base, args.startup_timeout)
+            targets = resolve_targets(weights, active)
+
+            if args.warmup:
+                await drive(session, base, targets, weights, args.concurrency, args.warmup, args.seed, headers)
+
+            samples = await drive(
+                session, base, targets, weights, args.concurrency, args.duration, args.seed, headers
+            )
+    finally:
+        app.stop()
+        await stub_runner.cleanup()
+
+    results = summarize(samples, args.duration)
+    results["config"] = {
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "mix": weights,
+        "bypass_cache": args.bypass_cache,
+        "database": "mysql" if args.mysql else "sqlite",
+        "incidents": args.incidents,
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end API load test against a local database and feed stand-in"
+    )
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of unmeasured load first")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default="", help="route=weight pairs, every route when omitted")
+    parser.add_argument("--incidents", type=int, default=60, help="live incidents in the stub feed")
+    parser.add_argument("--bypass-cache", action="store_true", help="send Cache-Control: no-cache")
+    parser.add_argument("--mysql", action="store_true", help="use the MySQL database from the environment")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--app-log", default=os.path.join(tempfile.gettempdir(), "lcwc-load-app.log"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against the results stored in this file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative p95 increase")
+    parser.add_argument("--min-delta", type=float, default=2.0, help="ignore p95 increases below this many ms")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    total = results["total"]
+    print(
+        f"{total['requests']} requests, {total['errors']} errors, {total['throughput']:.0f} req/s, "
+        f"p50 {total['p50_ms']:.1f} ms, p95 {total['p95_ms']:.1f} ms, p99 {total['p99_ms']:.1f} ms"
+    )
+    print(f"{'route':>26} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for name, r in results["routes"].items():
+        print(
+            f"{name:>26} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>7.1f} "
+            f"{r['p50_ms']:>7.1f} {r['p95_ms']:>7.1f} {r['p99_ms']:>7.1f}"
+        )
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("Regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import argparse
+import datetime
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from peewee import SqliteDatabase
+
+from app.database.connection import create_database
+from app.database.migrations import migrate_schema
+from app.database.models import database_proxy
+from app.database.models.agency import Agency
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.feed_request import FeedRequest
+from app.database.models.incident import Incident
+from app.database.models.pending_resolution import PendingResolution
+from app.database.models.rollups import HeatmapCell, IncidentCount
+from app.database.models.unit import Unit
+from app.services.feedcapture import read_capture
+from app.services.rollups import heatmap_rollup, timeseries_rollup
+from app.services.unitactivity import UnitActivityIndex
+from app.services.updater import IncidentUpdater
+
+""" Replays a feed capture through IncidentUpdater.process_live_incidents and reports the cost of every cycle
+
+Usage:
+    python -m benchmarks.replay capture.jsonl.gz [--speed 10] [--json]
+
+Captures are recorded by the updater when FEED_CAPTURE_PATH is set. By default the
+replay runs against a fresh SQLite database; --database-from-env uses the database
+configured in the environment instead.
+"""
+
+MODELS = [
+    Incident,
+    Unit,
+    Agency,
+    FeedRequest,
+    PendingResolution,
+    HeatmapCell,
+    IncidentCount,
+    ArchivedIncident,
+    ArchivedUnit,
+]
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class StatementCounter:
+    """Counts the statements executed through the database and the rows they write"""
+
+    def __init__(self, database):
+        self.database = database
+        self.execute_sql = database.execute_sql
+        self.statements = Counter()
+        self.rows_written = 0
+        database.execute_sql = self.__execute_sql
+
+    def __execute_sql(self, sql, *args, **kwargs):
+        cursor = self.execute_sql(sql, *args, **kwargs)
+        verb = sql.lstrip().split(None, 1)[0].upper()
+        self.statements[verb] += 1
+        if verb in WRITE_STATEMENTS and cursor.rowcount and cursor.rowcount > 0:
+            self.rows_written += cursor.rowcount
+        return cursor
+
+    def reset(self) -> tuple[Counter, int]:
+        statements, rows_written = self.statements, self.rows_written
+        self.statements = Counter()
+        self.rows_written = 0
+        return statements, rows_written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replays a feed capture through the incident updater"
+    )
+    parser.add_argument("capture", help="capture file recorded with FEED_CAPTURE_PATH")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay at this multiple of the recorded pace, as fast as possible when 0",
+    )
+    parser.add_argument("--limit", type=int, help="replay at most this many snapshots")
+    parser.add_argument(
+        "--database-from-env",
+        action="store_true",
+        help="replay against the database configured in the environment",
+    )
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    if args.database_from_env:
+        database = create_database()
+    else:
+        database = SqliteDatabase(os.path.join(tempfile.mkdtemp(), "replay.db"))
+        database_proxy.initialize(database)
+    database.connect()
+    database.create_tables(MODELS)
+    migrate_schema(database, MODELS)
+
+    # the updater's clock follows the capture rather than the wall clock, so grace
+    # periods and heartbeats fall on the same cycles whatever the replay speed
+    now: datetime.datetime = None
+    updater = IncidentUpdater(
+        database,
+        rollups=[heatmap_rollup, timeseries_rollup],
+        resolution_grace=datetime.timedelta(minutes=2),
+        heartbeat_interval=datetime.timedelta(minutes=5),
+        unit_activity=UnitActivityIndex(),
+        clock=lambda: now,
+    )
+
+    counter = StatementCounter(database)
+
+    cycles = []
+    previous_fetched_at = None
+    for fetched_at, incidents in read_capture(args.capture):
+        if args.limit is not None and len(cycles) >= args.limit:
+            break
+
+        if args.speed > 0 and previous_fetched_at is not None:
+            delay = (fetched_at - previous_fetched_at).total_seconds() / args.speed
+            if delay > 0:
+                time.sleep(delay)
+        previous_fetched_at = fetched_at
+        now = fetched_at
+
+        start = time.perf_counter()
+        updater.process_live_incidents(incidents)
+        latency = (time.perf_counter() - start) * 1000
+
+        statements, rows_written = counter.reset()
+        cycles.append(
+            {
+                "fetched_at": fetched_at.isoformat(),
+                "incidents": len(incidents),
+                "latency_ms": latency,
+                "statements": sum(statements.values()),
+                "statements_by_type": dict(statements),
+                "rows_written": rows_written,
+            }
+        )
+
+    database.close()
+
+    if not cycles:
+        raise SystemExit("The capture has no snapshots")
+
+    latencies = [cycle["latency_ms"] for cycle in cycles]
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    summary = {
+        "cycles": len(cycles),
+        "latency_p50_ms": quantiles[49],
+        "latency_p95_ms": quantiles[94],
+        "latency_max_ms": max(latencies),
+        "statements_per_cycle": statistics.mean(cycle["statements"] for cycle in cycles),
+        "rows_written_per_cycle": statistics.mean(cycle["rows_written"] for cycle in cycles),
+        "statements": sum(cycle["statements"] for cycle in cycles),
+        "rows_written": sum(cycle["rows_written"] for cycle in cycles),
+    }
+
+    if args.json:
+        print(json.dumps({"summary": summary, "cycles": cycles}, indent=2))
+        return
+
+    print(f"{'cycle':>5} {'incidents':>9} {'latency ms':>10} {'statements':>10} {'rows':>6}")
+    for number, cycle in enumerate(cycles):
+        print(
+            f"{number:>5} {cycle['incidents']:>9} {cycle['latency_ms']:>10.2f} "
+            f"{cycle['statements']:>10} {cycle['rows_written']:>6}"
+        )
+    print(
+        f"{summary['cycles']} cycles, p50 {summary['latency_p50_ms']:.2f} ms, "
+        f"p95 {summary['latency_p95_ms']:.2f} ms, {summary['statements_per_cycle']:.1f} statements "
+        f"and {summary['rows_written_per_cycle']:.1f} rows written per cycle"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import argparse
+import html
+import random
+import time
+
+from aiohttp import web
+
+""" Local stand-in for the LCWC ArcGIS feed and agency pages, used with LCWC_UPSTREAM_OVERRIDE
+
+Usage:
+    python -m benchmarks.stub [--port 8765] [--incidents 60] [--turnover 30]
+
+Incidents are generated deterministically from the seed: a sliding window of
+--incidents incidents, one of which is replaced every --turnover seconds, so the
+updater sees a realistic mix of new, ongoing and resolved incidents.
+"""
+
+ARCGIS_PATH = "/utility.arcgis.com/usrsvcs/servers/a1f6aa7faab44b1582029509c46dce86/rest/services/Maps/Public_LiveFeeds/MapServer/{layer}/query"
+AGENCIES_PATH = "/www.lcwc911.us/about/agencies-dispatched"
+
+# layer ids of the ArcGIS feed and agency type ids of the LCWC website
+LAYERS = {0: "Fire", 1: "Medical", 2: "Traffic"}
+AGENCY_TYPES = {1: "Fire", 2: "Medical", 3: "Traffic"}
+
+MUNICIPALITIES = [
+    "LANCASTER CITY",
+    "MANHEIM TOWNSHIP",
+    "EAST HEMPFIELD TOWNSHIP",
+    "LANCASTER TOWNSHIP",
+    "WEST LAMPETER TOWNSHIP",
+    "EPHRATA BOROUGH",
+    "ELIZABETHTOWN BOROUGH",
+    "MOUNT JOY BOROUGH",
+]
+DESCRIPTIONS = {
+    "Fire": ["FIRE ALARM", "BUILDING FIRE", "VEHICLE FIRE", "GAS LEAK"],
+    "Medical": ["MEDICAL EMERGENCY", "FALLS", "BREATHING PROBLEMS", "SICK PERSON"],
+    "Traffic": ["VEHICLE ACCIDENT-NO INJURIES", "VEHICLE ACCIDENT-INJURIES", "DISABLED VEHICLE"],
+}
+UNIT_PREFIXES = {
+    "Fire": ["ENG", "TRK", "SQ", "RES"],
+    "Medical": ["MED", "AMB", "INT"],
+    "Traffic": ["POL", "ENG"],
+}
+
+
+class FeedStub:
+    def __init__(self, incidents: int, turnover: float, agencies: int, seed: int):
+        self.incidents = incidents
+        self.turnover = turnover
+        self.agencies = agencies
+        self.seed = seed
+        self.started = time.time()
+        self.requests = 0
+
+    def incident(self, index: int) -> tuple[int, dict]:
+        """Returns the layer and ArcGIS feature of the incident with the given sequence number"""
+        rng = random.Random(self.seed * 1000003 + index)
+        layer = rng.choice(list(LAYERS))
+        category = LAYERS[layer]
+
+        dispatched_at = self.started + (index - self.incidents) * self.turnover
+        units = [
+            f"{rng.choice(UNIT_PREFIXES[category])}{rng.randint(1, 99)}{rng.randint(1, 9)}"
+            for _ in range(rng.randint(1, 4))
+        ]
+
+        attributes = {
+            "IncidentNumber": 24000000 + index,
+            "IncidentMunicipality": rng.choice(MUNICIPALITIES),
+            "IncidentOrigination": int(dispatched_at * 1000),
+            "PrimaryAgency": f"STATION {rng.randint(1, 99)}",
+            # units are assigned and cleared as the incident goes on
+            "CurrentUnits": ",".join(units[: 1 + (self.requests + index) % len(units)]),
+            "PublicLocation": f"{rng.choice(['N', 'S', 'E', 'W'])} {rng.randint(1, 999)} ST / OAK ST",
+            "PublicType": rng.choice(DESCRIPTIONS[category]),
+            "IsPublic": 1,
+        }
+        if category != "Fire":
+            attributes["Priority"] = rng.randint(1, 3)
+
+        geometry = {
+            "x": round(rng.uniform(-76.72, -75.87), 6),
+            "y": round(rng.uniform(39.72, 40.32), 6),
+        }
+        return layer, {"attributes": attributes, "geometry": geometry}
+
+    def live_incidents(self) -> range:
+        newest = int((time.time() - self.started) / self.turnover) + self.incidents
+        return range(newest - self.incidents, newest)
+
+    async def arcgis_query(self, request: web.Request) -> web.Response:
+        layer = int(request.match_info["layer"])
+        self.requests += 1
+
+        features = []
+        for index in self.live_incidents():
+            incident_layer, feature = self.incident(index)
+            if incident_layer == layer:
+                features.append(feature)
+
+        return web.json_response({"features": features})
+
+    async def agencies_page(self, request: web.Request) -> web.Response:
+        type_id = int(request.query.get("field_agency_type_target_id", 1))
+        category = AGENCY_TYPES.get(type_id, "Fire")
+        rng = random.Random(self.seed * 31 + type_id)
+
+        rows = [
+            "<tr><th>Radio ID</th><th>Title</th><th>Address</th><th>City</th>"
+            "<th>State</th><th>Zip</th><th>Phone</th></tr>"
+        ]
+        for station in range(1, self.agencies + 1):
+            city = rng.choice(MUNICIPALITIES).title()
+            name = html.escape(f"{city} {category} Company {station}")
+            rows.append(
+                "<tr>"
+                f'<td class="views-field-field-radio-id">{station:02d}</td>'
+                f'<td class="views-field-title"><a href="/agency/{type_id}/{station}">{name}</a></td>'
+                f'<td class="views-field-field-address">{rng.randint(1, 999)} Main St</td>'
+                f'<td class="views-field-field-city">{city}</td>'
+                '<td class="views-field-field-state">PA</td>'
+                f'<td class="views-field-field-zip">{rng.randint(17501, 17599)}</td>'
+                f'<td class="views-field-field-phone">717-555-{rng.randint(0, 9999):04d}</td>'
+                "</tr>"
+            )
+
+        body = f'<html><body><table class="views-table">{"".join(rows)}</table></body></html>'
+        return web.Response(text=body, content_type="text/html")
+
+
+def create_app(
+    incidents: int = 60, turnover: float = 30.0, agencies: int = 80, seed: int = 0
+) -> web.Application:
+    stub = FeedStub(incidents, turnover, agencies, seed)
+    app = web.Application()
+    app.router.add_get(ARCGIS_PATH, stub.arcgis_query)
+    app.router.add_get(AGENCIES_PATH, stub.agencies_page)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the LCWC ArcGIS feed and agency pages"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--incidents", type=int, default=60, help="live incidents at any time")
+    parser.add_argument("--turnover", type=float, default=30.0, help="seconds between new incidents")
+    parser.add_argument("--agencies", type=int, default=80, help="agencies per category")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(args.incidents, args.turnover, args.agencies, args.seed),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from peewee import SQL, SqliteDatabase, fn
+
+from app.database.models import database_proxy
+from app.database.models.incident import Incident
+from app.database.models.rollups import IncidentCount
+from app.services.rollups import IncidentFacts, timeseries_rollup
+
+""" Compares serving incident counts from the timeseries rollup against GROUP BY over the incidents table
+
+Usage:
+    python -m benchmarks.timeseries [--incidents 100000] [--days 365] [--json]
+"""
+
+CATEGORIES = ["Fire", "Medical", "Traffic"]
+MUNICIPALITIES = [f"MUNICIPALITY {i}" for i in range(60)]
+AGENCIES = [f"STATION {i}" for i in range(1, 100)]
+
+TRUNCATE = {
+    "hour": "strftime('%Y-%m-%d %H:00:00', dispatched_at)",
+    "day": "date(dispatched_at)",
+    "week": "date(dispatched_at, '-6 days', 'weekday 1')",
+}
+
+
+def populate(count: int, days: int, seed: int, end: datetime.datetime):
+    rng = random.Random(seed)
+    rows = []
+    for number in range(count):
+        dispatched_at = end - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * days))
+        rows.append(
+            {
+                "id": uuid.UUID(int=rng.getrandbits(128)),
+                "category": rng.choice(CATEGORIES),
+                "description": "MEDICAL EMERGENCY",
+                "municipality": rng.choice(MUNICIPALITIES),
+                "dispatched_at": dispatched_at,
+                "number": number,
+                "agency": rng.choice(AGENCIES),
+                "added_at": dispatched_at,
+                "updated_at": dispatched_at,
+            }
+        )
+
+    with Incident._meta.database.atomic():
+        for start in range(0, len(rows), 1000):
+            Incident.insert_many(rows[start : start + 1000]).execute()
+
+
+def timed(func, iterations: int) -> tuple[list[float], object]:
+    durations = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations, result
+
+
+def raw_query(bucket: str, dimension: str, start, end):
+    column = getattr(Incident, dimension)
+    query = (
+        Incident.select(SQL(TRUNCATE[bucket]).alias("bucket"), column, fn.COUNT(Incident.id))
+        .where(Incident.dispatched_at >= start, Incident.dispatched_at < end)
+        .group_by(SQL("1"), column)
+    )
+    return list(query.tuples())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Timeseries rollup benchmark against GROUP BY over the incidents table"
+    )
+    parser.add_argument("--incidents", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=365, help="days of history to spread the incidents over")
+    parser.add_argument("--range-days", type=int, default=90, help="days covered by each query")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database = SqliteDatabase(os.path.join(directory, "timeseries.db"))
+    database_proxy.initialize(database)
+    database.connect()
+    database.create_tables([Incident, IncidentCount])
+
+    end = datetime.datetime(2024, 1, 1)
+    populate(args.incidents, args.days, args.seed, end)
+
+    start = time.perf_counter()
+    timeseries_rollup.rebuild()
+    rebuild_ms = (time.perf_counter() - start) * 1000
+
+    # the per-cycle cost the updater pays: one change per incident in a feed snapshot
+    rng = random.Random(args.seed)
+    changes = [
+        (
+            None,
+            IncidentFacts(
+                category=rng.choice(CATEGORIES),
+                dispatched_at=end - datetime.timedelta(minutes=rng.randint(0, 60)),
+                municipality=rng.choice(MUNICIPALITIES),
+                agency=rng.choice(AGENCIES),
+                geohash=None,
+            ),
+        )
+        for _ in range(50)
+    ]
+    with database.atomic() as transaction:
+        apply_ms, _ = timed(lambda: timeseries_rollup.apply(changes), 1)
+        transaction.rollback()
+
+    range_start = end - datetime.timedelta(days=args.range_days)
+    results = []
+    for bucket in timeseries_rollup.BUCKETS:
+        if bucket == "hour":
+            query_start = end - datetime.timedelta(days=min(args.range_days, 31))
+        else:
+            query_start = range_start
+        for dimension in timeseries_rollup.DIMENSIONS:
+            rollup_times, series = timed(
+                lambda: timeseries_rollup.query(bucket, dimension, query_start, end),
+                args.iterations,
+            )
+            raw_times, rows = timed(
+                lambda: raw_query(bucket, dimension, query_start, end), args.iterations
+            )
+            results.append(
+                {
+                    "bucket": bucket,
+                    "group_by": dimension,
+                    "points": sum(len(points) for points in series.values()),
+                    "raw_groups": len(rows),
+                    "rollup_ms": statistics.median(rollup_times),
+                    "raw_ms": statistics.median(raw_times),
+                    "speedup": statistics.median(raw_times)
+                    / max(statistics.median(rollup_times), 1e-6),
+                }
+            )
+
+    summary = {
+        "incidents": args.incidents,
+        "rollup_rows": IncidentCount.select().count(),
+        "rebuild_ms": rebuild_ms,
+        "apply_50_changes_ms": apply_ms[0],
+        "queries": results,
+    }
+    database.close()
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f"incidents: {args.incidents}, rebuild: {rebuild_ms:.0f} ms, apply 50 changes: {apply_ms[0]:.2f} ms")
+    print(f"{'bucket':>6} {'group_by':>12} {'points':>8} {'rollup ms':>10} {'raw ms':>10} {'speedup':>8}")
+    for r in results:
+        print(
+            f"{r['bucket']:>6} {r['group_by']:>12} {r['points']:>8} "
+            f"{r['rollup_ms']:>10.2f} {r['raw_ms']:>10.2f} {r['speedup']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
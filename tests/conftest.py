@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import json
+import os
+from typing import NamedTuple
+
+import pytest
+from peewee import SqliteDatabase
+
+from app.database.migrations import migrate_schema
+from app.database.models import database_proxy
+from app.database.models.agency import Agency
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.pending_resolution import PendingResolution
+from app.database.models.rollups import HeatmapCell, IncidentCount
+from app.database.models.unit import Unit
+from app.services.feedcapture import deserialize_incident
+
+MODELS = [
+    Agency,
+    Incident,
+    Unit,
+    PendingResolution,
+    HeatmapCell,
+    IncidentCount,
+    ArchivedIncident,
+    ArchivedUnit,
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh SQLite database holding the tables the updater writes to"""
+    database = SqliteDatabase(os.path.join(tmp_path, "test.db"))
+    database_proxy.initialize(database)
+    database.connect()
+    database.create_tables(MODELS)
+    migrate_schema(database, MODELS)
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def make_incident():
+    """Builds incidents as the feed client would return them"""
+
+    def make_incident(number: int, **fields):
+        return deserialize_incident(
+            {
+                "category": "Medical",
+                "date": "2024-03-01T12:30:00+00:00",
+                "description": "FALLS",
+                "municipality": "LANCASTER CITY",
+                "intersection": "N QUEEN ST / E CHESTNUT ST",
+                "units": ["MEDIC 06-1"],
+                "number": number,
+                "priority": 1,
+                "agency": "LEMSA",
+                "public": True,
+                "coordinates": [-76.3055, 40.0379],
+                **fields,
+            }
+        )
+
+    return make_incident
+
+
+@pytest.fixture
+def store_incident(database):
+    """Stores an incident directly, in the hot table or the given tier"""
+
+    numbers = iter(range(1, 1000000))
+
+    def store_incident(model=Incident, **fields):
+        dispatched_at = fields.pop("dispatched_at", datetime.datetime(2024, 3, 1, 12, 30))
+        return model.create(
+            **{
+                "category": "Medical",
+                "description": "FALLS",
+                "intersection": "N QUEEN ST / E CHESTNUT ST",
+                "municipality": "LANCASTER CITY",
+                "dispatched_at": dispatched_at,
+                "number": next(numbers),
+                "priority": 1,
+                "agency": "LEMSA",
+                "latitude": 40.0379,
+                "longitude": -76.3055,
+                "client": "arcgis",
+                "added_at": dispatched_at,
+                **fields,
+            }
+        )
+
+    return store_incident
+
+
+class Clock:
+    """A clock the tests move forward by hand"""
+
+    def __init__(self, now: datetime.datetime):
+        self.now = now
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+    def advance(self, **kwargs) -> None:
+        self.now += datetime.timedelta(**kwargs)
+
+
+@pytest.fixture
+def clock():
+    return Clock(datetime.datetime(2024, 3, 1, 13, 0))
+
+
+class HTTPResponse(NamedTuple):
+    status_code: int
+    headers: dict[str, str]
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+
+@pytest.fixture
+def http():
+    """Sends a request straight to an ASGI app, without a server or test client"""
+
+    def http(
+        app, path: str, method: str = "GET", headers: dict = None, body: bytes = b""
+    ) -> HTTPResponse:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "headers": [(b"host", b"testserver")]
+            + [
+                (key.lower().encode(), value.encode())
+                for key, value in (headers or {}).items()
+            ],
+            "client": ("127.0.0.1", 50000),
+            "server": ("testserver", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # the client stays connected until the response is complete
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(app(scope, receive, send))
+
+        start = next(message for message in sent if message["type"] == "http.response.start")
+        response_headers = {}
+        for key, value in start["headers"]:
+            key, value = key.decode().lower(), value.decode()
+            response_headers[key] = (
+                f"{response_headers[key]}, {value}" if key in response_headers else value
+            )
+        return HTTPResponse(
+            start["status"],
+            response_headers,
+            b"".join(
+                message.get("body", b"")
+                for message in sent
+                if message["type"] == "http.response.body"
+            ),
+        )
+
+    return http
@@ -0,0 +1,87 @@
+from lcwc.category import IncidentCategory
+
+from app.database.models.agency import Agency
+from app.services.agencyindex import AgencySnapshot
+
+
+def agency(category, station_id, name, address, city, zip_code, phone) -> Agency:
+    return Agency(
+        category=category,
+        station_id=station_id,
+        name=name,
+        address=address,
+        city=city,
+        state="PA",
+        zip_code=zip_code,
+        phone=phone,
+    )
+
+
+# fmt: off
+SNAPSHOT = AgencySnapshot(
+    agency(*fields)
+    for fields in [
+        ("Fire", "1", "Lancaster City Fire Station 1", "1 N Queen St", "Lancaster", "17602", "717-555-0101"),
+        ("Fire", "2", "Lancaster Township Fire", "1240 Maple Ave", "Lancaster", "17603", "717-555-0102"),
+        ("Fire", "55", "Lititz Fire Company", "126 N Broad St", "Lititz", "17543", "717-555-0155"),
+        ("Medical", "1", "Lancaster EMS", "100 Queen Rd", "Lancaster", "17602", "717-555-0201"),
+        ("Medical", "9", "Lititz Ambulance", "2 Broad St", "Lititz", "17543", "717-555-0209"),
+        ("Traffic", "1", "Lancaster Traffic", None, "Lancaster", "17602", "717-555-0301"),
+    ]
+)
+# fmt: on
+
+
+def keys(agencies) -> list[tuple[str, str]]:
+    return [(agency.category, agency.station_id) for agency in agencies]
+
+
+def test_category_lookup_accepts_the_enum_and_any_case():
+    assert keys(SNAPSHOT.search(category=IncidentCategory.FIRE)) == [
+        ("Fire", "1"),
+        ("Fire", "2"),
+        ("Fire", "55"),
+    ]
+    assert keys(SNAPSHOT.search(category="medical")) == [
+        ("Medical", "1"),
+        ("Medical", "9"),
+    ]
+    assert SNAPSHOT.search(category=IncidentCategory.UNKNOWN) == []
+    assert SNAPSHOT.count(IncidentCategory.FIRE) == 3
+    assert SNAPSHOT.count() == 6
+
+
+def test_combined_filters_must_all_match():
+    assert keys(SNAPSHOT.search(category="Fire", city="LANCASTER")) == [
+        ("Fire", "1"),
+        ("Fire", "2"),
+    ]
+    assert keys(SNAPSHOT.search(city="Lancaster", zip_code="17602", category="Medical")) == [
+        ("Medical", "1")
+    ]
+    assert keys(SNAPSHOT.search(category="Fire", city="Lititz", zip_code="17602")) == []
+
+
+def test_combined_hashed_tokenized_and_scanned_filters():
+    # every word of the name prefixes a word of the agency's name
+    assert keys(SNAPSHOT.search(name="lanc fire")) == [("Fire", "1"), ("Fire", "2")]
+    assert keys(SNAPSHOT.search(name="lanc fire", address="queen")) == [("Fire", "1")]
+    assert keys(
+        SNAPSHOT.search(city="Lititz", address="broad st", phone="717-555-0209")
+    ) == [("Medical", "9")]
+    assert keys(SNAPSHOT.search(name="lancaster", phone="717-555-0301")) == [("Traffic", "1")]
+
+
+def test_scanned_filters_alone_search_every_agency():
+    assert keys(SNAPSHOT.search(phone="717-555-0155")) == [("Fire", "55")]
+    assert len(SNAPSHOT.search(state="pa")) == 6
+
+
+def test_no_filters_match_nothing():
+    assert SNAPSHOT.search() == []
+    assert SNAPSHOT.search(category=None, name=None) == []
+
+
+def test_get_by_category_and_station():
+    assert SNAPSHOT.get(IncidentCategory.MEDICAL, "9").name == "Lititz Ambulance"
+    assert SNAPSHOT.get("Traffic", "9") is None
@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+
+import pytest
+from lcwc.agencies.agency import Agency
+from lcwc.category import IncidentCategory
+
+from app.database.models.agency import Agency as AgencyModel
+from app.services.agencyindex import AgencyIndex
+from app.services.agencyupdater import AgencyUpdater
+
+EARLIER = datetime.datetime(2024, 1, 1)
+
+
+class FakeAgencyClient:
+    """Serves the agency pages from a dictionary, by category"""
+
+    def __init__(self):
+        self.pages: dict[IncidentCategory, list[Agency]] = {}
+
+    async def get_agencies(
+        self, session, categories: list[IncidentCategory]
+    ) -> list[Agency]:
+        [category] = categories
+        return self.pages[category]
+
+
+def agency(category: IncidentCategory, station_number: str, name: str) -> Agency:
+    return Agency(
+        category=category,
+        station_number=station_number,
+        name=name,
+        url=f"https://example.com/{station_number}",
+        address=f"{station_number} Main St",
+        city="Lancaster",
+        state="PA",
+        zip_code=17602,
+        phone="717-555-0100",
+    )
+
+
+@pytest.fixture
+def client():
+    client = FakeAgencyClient()
+    client.pages = {
+        IncidentCategory.FIRE: [
+            agency(IncidentCategory.FIRE, "1", "Station 1"),
+            agency(IncidentCategory.FIRE, "2", "Station 2"),
+            agency(IncidentCategory.FIRE, "3", "Station 3"),
+        ],
+        IncidentCategory.MEDICAL: [agency(IncidentCategory.MEDICAL, "1", "EMS 1")],
+        IncidentCategory.TRAFFIC: [agency(IncidentCategory.TRAFFIC, "1", "Traffic 1")],
+    }
+    return client
+
+
+@pytest.fixture
+def updater(database, client):
+    updater = AgencyUpdater(database, None, agency_index=AgencyIndex())
+    updater.agency_client = client
+    assert asyncio.run(updater.update_agencies())
+    # stored long enough ago that a rewrite would show in updated_at
+    AgencyModel.update(updated_at=EARLIER).execute()
+    return updater
+
+
+def stored() -> dict[tuple[str, str], AgencyModel]:
+    return {
+        (agency.category, agency.station_id): agency for agency in AgencyModel.select()
+    }
+
+
+def test_first_refresh_inserts_every_agency(updater):
+    assert set(stored()) == {
+        ("Fire", "1"),
+        ("Fire", "2"),
+        ("Fire", "3"),
+        ("Medical", "1"),
+        ("Traffic", "1"),
+    }
+    assert updater.last_timings["Fire"]["inserted"] == 3
+
+
+def test_unchanged_agencies_are_not_rewritten(updater):
+    assert not asyncio.run(updater.update_agencies())
+
+    assert all(agency.updated_at == EARLIER for agency in stored().values())
+    assert all(
+        updater.last_timings[category][count] == 0
+        for category in ("Fire", "Medical", "Traffic")
+        for count in ("inserted", "updated", "removed")
+    )
+
+
+def test_changed_agencies_are_updated_and_removed_ones_deleted(updater, client):
+    client.pages[IncidentCategory.FIRE] = [
+        agency(IncidentCategory.FIRE, "1", "Station 1"),
+        agency(IncidentCategory.FIRE, "2", "Station 2 (Rohrerstown)"),
+        agency(IncidentCategory.FIRE, "4", "Station 4"),
+    ]
+
+    assert asyncio.run(updater.update_agencies())
+
+    agencies = stored()
+    assert ("Fire", "3") not in agencies
+    assert agencies[("Fire", "1")].updated_at == EARLIER
+    assert agencies[("Fire", "2")].name == "Station 2 (Rohrerstown)"
+    assert agencies[("Fire", "2")].updated_at > EARLIER
+    assert agencies[("Fire", "4")].name == "Station 4"
+    assert agencies[("Medical", "1")].updated_at == EARLIER
+    fire = updater.last_timings["Fire"]
+    assert (fire["inserted"], fire["updated"], fire["removed"]) == (1, 1, 1)
+
+    # the index is rebuilt from the changed table
+    snapshot = updater.agency_index.current()
+    assert snapshot.get("Fire", "3") is None
+    assert snapshot.get("Fire", "2").name == "Station 2 (Rohrerstown)"
+
+
+def test_a_category_that_failed_keeps_its_agencies(updater, client):
+    client.pages[IncidentCategory.FIRE] = []
+    client.pages[IncidentCategory.MEDICAL] = [
+        agency(IncidentCategory.MEDICAL, "1", "EMS 1"),
+        agency(IncidentCategory.MEDICAL, "2", "EMS 2"),
+    ]
+
+    assert asyncio.run(updater.update_agencies())
+
+    agencies = stored()
+    assert {key for key in agencies if key[0] == "Fire"} == {
+        ("Fire", "1"),
+        ("Fire", "2"),
+        ("Fire", "3"),
+    }
+    assert ("Medical", "2") in agencies
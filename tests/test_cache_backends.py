@@ -0,0 +1,154 @@
+import asyncio
+
+import fakeredis
+import pytest
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from app.cache import backends
+from app.cache.backends import LayeredBackend, LocalCache, cache_refresh
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(backends.time, "monotonic", lambda: now[0])
+    return now
+
+
+class CountingBackend(InMemoryBackend):
+    """The shared tier, counting the reads that reach it"""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    async def get_with_ttl(self, key):
+        self.reads += 1
+        return await super().get_with_ttl(key)
+
+
+def test_least_recently_used_entries_are_evicted_first(now):
+    cache = LocalCache(max_bytes=10, max_ttl=60)
+    cache.set("a", b"1234")
+    cache.set("b", b"1234")
+    cache.get_with_ttl("a")
+
+    cache.set("c", b"1234")
+
+    assert cache.get_with_ttl("b") == (0, None)
+    assert cache.get_with_ttl("a")[1] == b"1234"
+    assert cache.get_with_ttl("c")[1] == b"1234"
+    assert cache.size == 8
+    assert cache.stats.evictions == 1
+
+
+def test_values_larger_than_the_cache_are_not_stored(now):
+    cache = LocalCache(max_bytes=10, max_ttl=60)
+    cache.set("a", b"1234")
+    cache.set("b", b"x" * 11)
+
+    assert cache.get_with_ttl("b") == (0, None)
+    assert cache.get_with_ttl("a")[1] == b"1234"
+
+
+def test_entries_expire_after_their_ttl_capped_at_the_max_ttl(now):
+    cache = LocalCache(max_bytes=100, max_ttl=60)
+    cache.set("short", "value", expire=10)
+    cache.set("long", "value", expire=600)
+
+    now[0] += 9.5
+    assert cache.get_with_ttl("short") == (1, b"value")
+
+    now[0] += 1
+    assert cache.get_with_ttl("short") == (0, None)
+    assert cache.get_with_ttl("long") == (50, b"value")
+
+    now[0] += 50
+    assert cache.get_with_ttl("long") == (0, None)
+    assert cache.stats.expirations == 2
+    assert cache.size == 0
+
+
+def test_clear_removes_a_namespace(now):
+    cache = LocalCache(max_bytes=100, max_ttl=60)
+    cache.set("incidents:1", "a")
+    cache.set("incidents:2", "b")
+    cache.set("agencies:1", "c")
+
+    assert cache.clear("incidents") == 2
+    assert len(cache) == 1
+    assert cache.get_with_ttl("agencies:1")[1] == b"c"
+
+
+def test_reads_are_served_by_the_local_tier_first(now):
+    async def run():
+        shared = CountingBackend()
+        await shared.set("key", b"value", 30)
+        layered = LayeredBackend(shared, LocalCache(max_bytes=100, max_ttl=60))
+
+        assert await layered.get_with_ttl("key") == (30, b"value")
+        assert await layered.get_with_ttl("key") == (30, b"value")
+        assert shared.reads == 1
+
+        # a refresh skips both tiers, so the endpoint is recomputed
+        token = cache_refresh.set(True)
+        try:
+            assert await layered.get_with_ttl("key") == (0, None)
+        finally:
+            cache_refresh.reset(token)
+
+    asyncio.run(run())
+
+
+def test_writes_evict_the_local_copies_of_other_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        shared = InMemoryBackend()
+        workers = [
+            LayeredBackend(
+                shared,
+                LocalCache(max_bytes=100, max_ttl=60),
+                redis=fakeredis.aioredis.FakeRedis(server=server),
+                channel="test:evictions",
+            )
+            for _ in range(2)
+        ]
+        writer, reader = workers
+        for worker in workers:
+            await worker.start()
+
+        async def wait_until(condition):
+            for _ in range(100):
+                if await condition():
+                    return
+                await asyncio.sleep(0.01)
+            raise AssertionError("timed out")
+
+        async def subscribed():
+            [(_, subscribers)] = await writer.redis.pubsub_numsub("test:evictions")
+            return subscribers == 2
+
+        async def evicted(key):
+            return reader.local.get_with_ttl(key)[1] is None
+
+        await wait_until(subscribed)
+
+        await writer.set("incidents:1", "old", 30)
+        reader.local.set("incidents:1", "old")
+
+        await writer.set("incidents:1", "new", 30)
+        await wait_until(lambda: evicted("incidents:1"))
+        # the writer keeps its own copy
+        assert writer.local.get_with_ttl("incidents:1")[1] == b"new"
+        assert await reader.get("incidents:1") == "new"
+
+        reader.local.set("incidents:2", "old")
+        reader.local.set("agencies:1", "old")
+        await writer.clear(namespace="incidents")
+        await wait_until(lambda: evicted("incidents:2"))
+        assert reader.local.get_with_ttl("agencies:1")[1] == b"old"
+
+        for worker in workers:
+            await worker.stop()
+
+    asyncio.run(run())
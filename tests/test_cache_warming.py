@@ -0,0 +1,133 @@
+import asyncio
+import math
+from collections import Counter
+
+import pytest
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+from app.cache import sketch as sketch_module
+from app.cache import warmer
+from app.cache.backends import LayeredBackend, LocalCache, cache_refresh
+from app.cache.sketch import AccessSketch
+from app.cache.warmer import CacheWarmer, is_warming
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sketch_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_estimates_never_undercount_and_stay_within_the_error_bound(now):
+    sketch = AccessSketch(width=64, depth=4)
+    counts = Counter()
+    for i in range(2000):
+        # a few hot keys and a long tail
+        key = f"/api/v1/incidents/{i % 7}" if i % 2 else f"/api/v1/incident/{i}"
+        counts[key] += 1
+        sketch.record(key)
+
+    errors = [sketch.estimate(key) - count for key, count in counts.items()]
+    assert min(errors) >= 0
+    # count-min guarantees an error of at most e / width of the total with high probability
+    bound = math.e / sketch.width * sketch.total
+    assert sum(error <= bound for error in errors) / len(errors) > 0.95
+    assert all(
+        sketch.estimate(f"/api/v1/incidents/{i}") - counts[f"/api/v1/incidents/{i}"] <= bound
+        for i in range(7)
+    )
+
+
+def test_counts_are_halved_every_half_life(now):
+    sketch = AccessSketch(half_life=60)
+    for _ in range(8):
+        sketch.record("/hot")
+    sketch.record("/once")
+
+    now[0] += 60
+    assert sketch.record("/hot") == 5
+    assert sketch.estimate("/once") == 0
+    # keys whose count decayed to nothing are no longer heavy hitters
+    assert sketch.top(10) == [("/hot", 5)]
+
+
+def test_top_filters_by_prefix_and_minimum_hits(now):
+    sketch = AccessSketch()
+    for key, hits in [
+        ("/api/v1/incidents/active", 5),
+        ("/api/v1/incident/1", 3),
+        ("/api/v1/agencies/Fire", 4),
+        ("/api/v1/incidents/stats", 1),
+    ]:
+        for _ in range(hits):
+            sketch.record(key)
+
+    assert sketch.top(10, prefixes=("/api/v1/incidents", "/api/v1/incident/"), min_hits=2) == [
+        ("/api/v1/incidents/active", 5),
+        ("/api/v1/incident/1", 3),
+    ]
+    assert sketch.top(1) == [("/api/v1/incidents/active", 5)]
+
+
+def test_heavy_hitters_replace_the_coldest_key_once_full(now):
+    sketch = AccessSketch(capacity=2)
+    for key, hits in [("/a", 3), ("/b", 1), ("/c", 2)]:
+        for _ in range(hits):
+            sketch.record(key)
+
+    assert sketch.top(10) == [("/a", 3), ("/c", 2)]
+
+
+def test_warming_requests_the_hottest_keys_under_the_prefixes(monkeypatch, now):
+    sketch = AccessSketch()
+    for key, hits in [
+        ("/api/v1/incidents/active", 6),
+        ("/api/v1/incidents/stats", 5),
+        ("/api/v1/incident/number/1", 4),
+        ("/api/v1/incidents/search?municipality=LANCASTER", 1),
+        ("/api/v1/agencies/Fire", 9),
+    ]:
+        for _ in range(hits):
+            sketch.record(key)
+
+    requested = []
+
+    async def app(scope, receive, send):
+        path = scope["path"]
+        if scope["query_string"]:
+            path += "?" + scope["query_string"].decode()
+        requested.append((path, is_warming(scope), cache_refresh.get()))
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    layered = LayeredBackend(InMemoryBackend(), LocalCache(max_bytes=100, max_ttl=60))
+    monkeypatch.setattr(warmer.FastAPICache, "get_backend", lambda: layered)
+    cache_warmer = CacheWarmer(
+        app, sketch, max_keys=2, time_budget=10, cpu_budget=10, min_hits=2
+    )
+
+    warmed = asyncio.run(cache_warmer.warm(("/api/v1/incidents", "/api/v1/incident/")))
+
+    assert warmed == 2
+    # the hottest keys first, each marked as warming and bypassing the cache reads
+    assert requested == [
+        ("/api/v1/incidents/active", True, True),
+        ("/api/v1/incidents/stats", True, True),
+    ]
+    assert not cache_refresh.get()
+
+
+def test_warming_is_skipped_without_the_layered_backend(monkeypatch, now):
+    sketch = AccessSketch()
+    sketch.record("/api/v1/incidents/active")
+    sketch.record("/api/v1/incidents/active")
+
+    async def app(scope, receive, send):
+        raise AssertionError("no request expected")
+
+    monkeypatch.setattr(warmer.FastAPICache, "get_backend", lambda: InMemoryBackend())
+    cache_warmer = CacheWarmer(app, sketch, max_keys=2, time_budget=10, cpu_budget=10)
+
+    assert asyncio.run(cache_warmer.warm(("/api/v1/incidents",))) == 0
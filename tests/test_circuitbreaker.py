@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from app.services.circuitbreaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+class Timer:
+    """A monotonic clock advanced by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return Timer()
+
+
+@pytest.fixture
+def breaker(timer):
+    return CircuitBreaker("feed", failure_threshold=3, reset_timeout=60, clock=timer)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    # a success in between resets the count
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.healthy
+    assert not breaker.allow()
+    assert breaker.stats()["trips"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_a_single_probe_is_let_through_after_the_reset_timeout(breaker, timer):
+    for _ in range(3):
+        breaker.record_failure()
+
+    timer.now += 59
+    assert not breaker.allow()
+
+    timer.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # the probe is still running
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_a_failed_probe_opens_the_breaker_for_another_timeout(breaker, timer):
+    for _ in range(3):
+        breaker.record_failure()
+    timer.now += 60
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    # reopening is not another trip
+    assert breaker.trips == 1
+
+    timer.now += 30
+    assert not breaker.allow()
+    timer.now += 30
+    assert breaker.allow()
+
+
+def test_call_counts_timeouts_and_rejects_while_open(breaker):
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(asyncio.TimeoutError):
+                await breaker.call(slow, timeout=0.01)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(slow)
+
+    asyncio.run(run())
+    assert breaker.state == OPEN
+
+
+def test_a_cancelled_probe_lets_the_next_call_probe(breaker, timer):
+    for _ in range(3):
+        breaker.record_failure()
+    timer.now += 60
+
+    async def run():
+        probe = asyncio.create_task(breaker.call(asyncio.sleep, 1))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert breaker.state == HALF_OPEN
+        return await breaker.call(asyncio.sleep, 0, "probed")
+
+    assert asyncio.run(run()) == "probed"
+    assert breaker.state == CLOSED
@@ -0,0 +1,145 @@
+import asyncio
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+from app.database.models.archive import ArchivedIncident, ArchivedUnit
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+from app.services import export
+
+START = datetime.datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def history(store_incident):
+    """Stores incidents in both tiers, with runs sharing a dispatch time across chunk boundaries"""
+
+    incidents = []
+    for minutes, model in [
+        (0, ArchivedIncident),
+        (0, ArchivedIncident),
+        (0, ArchivedIncident),
+        (0, ArchivedIncident),
+        (5, Incident),
+        (10, ArchivedIncident),
+        (10, Incident),
+        (10, Incident),
+        (10, Incident),
+        (20, Incident),
+        (30, ArchivedIncident),
+    ]:
+        incidents.append(
+            store_incident(
+                model,
+                dispatched_at=START + datetime.timedelta(minutes=minutes),
+                municipality="LANCASTER CITY" if minutes < 20 else "LITITZ BOROUGH",
+            )
+        )
+
+    for incident in incidents[:2]:
+        ArchivedUnit.create(
+            incident=incident, short_name="ENG1", added_at=START, last_seen=START
+        )
+    Unit.create(incident=incidents[4], short_name="MED2", added_at=START, last_seen=START)
+    Unit.create(
+        incident=incidents[4],
+        short_name="ENG3",
+        added_at=START + datetime.timedelta(minutes=1),
+        last_seen=START,
+    )
+
+    # dispatch order, ties broken by id
+    return sorted(incidents, key=lambda incident: (incident.dispatched_at, str(incident.id)))
+
+
+def numbers(incidents) -> list[int]:
+    return [incident.number for incident in incidents]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_tier_chunks_page_through_ties_without_skipping_or_repeating(history, chunk_size):
+    conditions = export.search_conditions()
+    for model in (Incident, ArchivedIncident):
+        chunks = list(export.tier_chunks(model, conditions, chunk_size))
+
+        assert all(len(chunk) <= chunk_size for chunk in chunks)
+        assert numbers(sum(chunks, [])) == numbers(
+            incident for incident in history if type(incident) is model
+        )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_history_merges_both_tiers_in_dispatch_order(history, chunk_size):
+    merged = list(export.select_history(export.search_conditions(), chunk_size))
+
+    assert numbers(merged) == numbers(history)
+    assert [type(incident) for incident in merged] == [type(incident) for incident in history]
+
+
+def test_chunks_carry_their_units(history):
+    stored = {}
+    for unit_model in (Unit, ArchivedUnit):
+        for unit in unit_model.select().order_by(unit_model.added_at):
+            stored.setdefault(unit.incident.number, []).append(unit.short_name)
+
+    units = {
+        incident.number: [unit.short_name for unit in incident.units]
+        for incident in export.select_history(export.search_conditions(), 2)
+    }
+
+    assert units == {
+        incident.number: stored.get(incident.number, []) for incident in history
+    }
+    assert sorted(stored.values()) == [["ENG1"], ["ENG1"], ["MED2", "ENG3"]]
+
+
+def test_conditions_apply_to_both_tiers(history):
+    conditions = export.search_conditions(
+        municipality="LITITZ", start=START.date(), end=START.date()
+    )
+    merged = list(export.select_history(conditions, 1))
+
+    assert numbers(merged) == numbers(history[-2:])
+    assert isinstance(merged[-1], ArchivedIncident)
+
+    after = export.search_conditions(start=START.date() + datetime.timedelta(days=1))
+    assert list(export.select_history(after, 1)) == []
+
+
+def test_stream_ndjson(history):
+    async def collect():
+        return [
+            chunk
+            async for chunk in export.stream_history(
+                export.search_conditions(), "ndjson", chunk_size=4
+            )
+        ]
+
+    chunks = asyncio.run(collect())
+
+    # a write per chunk
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode().splitlines()
+    assert [json.loads(line)["number"] for line in lines] == numbers(history)
+
+
+def test_stream_csv(history):
+    async def collect():
+        return b"".join(
+            [
+                chunk
+                async for chunk in export.stream_history(
+                    export.search_conditions(), "csv", chunk_size=4
+                )
+            ]
+        )
+
+    rows = list(csv.DictReader(io.StringIO(asyncio.run(collect()).decode())))
+
+    assert [int(row["number"]) for row in rows] == numbers(history)
+    assert list(rows[0]) == export.CSV_COLUMNS
+    assert {row["units"] for row in rows} == {"", "ENG1", "MED2 ENG3"}
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.feedsources import FeedSource, HedgedFeed, InvalidFeedError
+
+
+def incident(number: int, **fields):
+    return SimpleNamespace(
+        number=number, category="Medical", date=datetime.datetime(2024, 3, 1), **fields
+    )
+
+
+class FakeClient:
+    """A feed client answering after a delay, or failing"""
+
+    name = "FakeClient"
+
+    def __init__(
+        self, delay: float = 0.0, incidents: list = None, error: Exception = None
+    ):
+        self.delay = delay
+        self.incidents = [incident(1)] if incidents is None else incidents
+        self.error = error
+        self.calls = 0
+        self.cancelled = False
+
+    async def get_incidents(self, session, throw_on_error: bool = False):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.incidents
+
+
+def feed(*clients: FakeClient, initial_delay: float = 0.05) -> HedgedFeed:
+    return HedgedFeed(
+        [FeedSource(f"source{i}", client) for i, client in enumerate(clients)],
+        initial_delay=initial_delay,
+    )
+
+
+def test_a_fast_source_is_not_hedged():
+    primary, replica = FakeClient(), FakeClient()
+    hedged = feed(primary, replica)
+
+    source, incidents, _ = asyncio.run(hedged.get_incidents(None))
+
+    assert source.name == "source0"
+    assert [i.number for i in incidents] == [1]
+    assert (primary.calls, replica.calls, hedged.hedges) == (1, 0, 0)
+
+
+def test_the_first_response_wins_and_the_slower_request_is_cancelled():
+    slow = FakeClient(delay=5, incidents=[incident(1)])
+    fast = FakeClient(delay=0.01, incidents=[incident(2)])
+    hedged = feed(slow, fast)
+
+    source, incidents, latency = asyncio.run(hedged.get_incidents(None))
+
+    assert source.name == "source1"
+    assert [i.number for i in incidents] == [2]
+    assert hedged.hedges == 1
+    assert slow.cancelled
+    assert hedged.sources[0].cancelled == 1
+    assert (hedged.sources[0].wins, hedged.sources[1].wins) == (0, 1)
+    assert list(hedged.sources[1].latencies) == [latency]
+
+
+def test_a_failing_source_is_replaced_without_waiting_for_the_hedge():
+    failing = FakeClient(error=ConnectionError("reset"))
+    replica = FakeClient(incidents=[incident(3)])
+    hedged = feed(failing, replica, initial_delay=10)
+
+    source, incidents, _ = asyncio.run(
+        asyncio.wait_for(hedged.get_incidents(None), timeout=1)
+    )
+
+    assert source.name == "source1"
+    assert [i.number for i in incidents] == [3]
+    assert hedged.hedges == 0
+    assert hedged.sources[0].failures == 1
+
+
+def test_a_replica_failing_after_the_hedge_leaves_the_other_running():
+    slow = FakeClient(delay=0.1, incidents=[incident(4)])
+    failing = FakeClient(delay=0.01, error=ConnectionError("reset"))
+    hedged = feed(slow, failing, initial_delay=0.02)
+
+    source, incidents, _ = asyncio.run(hedged.get_incidents(None))
+
+    assert source.name == "source0"
+    assert [i.number for i in incidents] == [4]
+    assert not slow.cancelled
+    assert hedged.sources[1].failures == 1
+
+
+def test_invalid_incidents_count_as_a_failure():
+    invalid = FakeClient(incidents=[incident(1), incident(None)])
+    hedged = feed(invalid, FakeClient(incidents=[incident(5)]))
+
+    source, incidents, _ = asyncio.run(hedged.get_incidents(None))
+
+    assert source.name == "source1"
+    assert hedged.sources[0].failures == 1
+
+
+def test_the_last_error_is_raised_when_every_source_fails():
+    hedged = feed(
+        FakeClient(error=ConnectionError("reset")),
+        FakeClient(incidents={"error": "not a list"}),
+    )
+
+    with pytest.raises(InvalidFeedError):
+        asyncio.run(hedged.get_incidents(None))
+    assert [source.failures for source in hedged.sources] == [1, 1]
+
+
+def test_sources_are_ranked_by_their_median_latency_once_measured():
+    hedged = feed(FakeClient(), FakeClient(), FakeClient())
+    first, second, untried = hedged.sources
+    first.latencies.extend([0.5] * HedgedFeed.MIN_SAMPLES)
+    second.latencies.extend([0.2] * HedgedFeed.MIN_SAMPLES)
+
+    assert hedged.ranked() == [second, first, untried]
+    assert hedged.hedge_delay(second) == 0.2
+    assert hedged.hedge_delay(untried) == hedged.initial_delay
+
+
+def test_repeated_names_are_separate_replicas():
+    hedged = HedgedFeed.from_names(["arcgis", "arcgis"])
+
+    assert [source.name for source in hedged.sources] == [
+        "ArcGISClient",
+        "ArcGISClient/2",
+    ]
+    assert hedged.sources[0].client is not hedged.sources[1].client
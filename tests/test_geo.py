@@ -0,0 +1,137 @@
+import datetime
+
+import pytest
+
+from app.database.models.archive import ArchivedIncident
+from app.database.models.incident import Incident
+from app.services import geosearch
+from app.utils import geo
+
+# Lancaster's Penn Square
+LATITUDE, LONGITUDE = 40.0379, -76.3055
+
+
+def test_encode_matches_known_geohashes():
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    # a prefix of the geohash is the geohash at a lower precision
+    assert geo.encode(LATITUDE, LONGITUDE).startswith(geo.encode(LATITUDE, LONGITUDE, 4))
+
+
+def test_decoded_bounds_contain_the_point():
+    min_lat, min_lng, max_lat, max_lng = geo.decode_bounds(geo.encode(LATITUDE, LONGITUDE, 7))
+    assert min_lat <= LATITUDE <= max_lat
+    assert min_lng <= LONGITUDE <= max_lng
+    assert (max_lat - min_lat, max_lng - min_lng) == pytest.approx(geo.cell_size(7))
+
+
+def test_cover_includes_the_cells_of_every_point_in_the_box():
+    box = (39.95, -76.45, 40.1, -76.2)
+    cells = geo.cover(*box)
+
+    assert 0 < len(cells) <= 16
+    assert len(set(cells)) == len(cells)
+    for i in range(21):
+        for j in range(21):
+            latitude = box[0] + (box[2] - box[0]) * i / 20
+            longitude = box[1] + (box[3] - box[1]) * j / 20
+            assert geo.encode(latitude, longitude).startswith(tuple(cells))
+
+
+def test_cover_coarsens_until_the_cell_limit_is_met():
+    cells = geo.cover(39.0, -77.0, 41.0, -75.0, max_cells=4)
+    assert len(cells) <= 4
+    assert len({len(cell) for cell in cells}) == 1
+
+
+def test_haversine_and_bounding_box():
+    # one degree of latitude
+    assert geo.haversine(40, -76, 41, -76) == pytest.approx(111195, rel=1e-3)
+
+    min_lat, min_lng, max_lat, max_lng = geo.bounding_box(LATITUDE, LONGITUDE, 5000)
+    assert geo.haversine(LATITUDE, LONGITUDE, max_lat, LONGITUDE) == pytest.approx(5000)
+    assert geo.haversine(LATITUDE, LONGITUDE, LATITUDE, max_lng) >= 5000 * 0.999
+    assert min_lat < LATITUDE < max_lat and min_lng < LONGITUDE < max_lng
+
+
+@pytest.fixture
+def located(store_incident):
+    """Stores incidents at known distances from Penn Square, one of them archived"""
+
+    def store(model=Incident, latitude=LATITUDE, longitude=LONGITUDE, **fields):
+        return store_incident(
+            model,
+            latitude=latitude,
+            longitude=longitude,
+            geohash=geo.encode(latitude, longitude),
+            **fields,
+        )
+
+    return {
+        "center": store(dispatched_at=datetime.datetime(2024, 3, 1, 12, 45)),
+        # about 1.1km north
+        "north": store(latitude=LATITUDE + 0.01, resolved_at=datetime.datetime(2024, 3, 1, 14)),
+        # about 4.3km east, archived
+        "east": store(
+            ArchivedIncident,
+            longitude=LONGITUDE + 0.05,
+            dispatched_at=datetime.datetime(2024, 1, 2),
+            resolved_at=datetime.datetime(2024, 1, 2, 2),
+        ),
+        # about 11km south
+        "south": store(latitude=LATITUDE - 0.1),
+    }
+
+
+def test_near_returns_the_incidents_of_both_tiers_within_the_radius_most_recent_first(located):
+    results = geosearch.incidents_near(LATITUDE, LONGITUDE, 5000)
+
+    assert [incident.number for incident, _ in results] == [
+        located["center"].number,
+        located["north"].number,
+        located["east"].number,
+    ]
+    distances = [distance for _, distance in results]
+    assert distances[0] == pytest.approx(0, abs=1)
+    assert distances[1] == pytest.approx(1112, rel=0.01)
+    assert distances[2] == pytest.approx(4260, rel=0.01)
+    assert isinstance(results[2][0], ArchivedIncident)
+
+
+def test_near_filters_active_incidents_and_dates(located):
+    active = geosearch.incidents_near(LATITUDE, LONGITUDE, 5000, active_only=True)
+    assert [incident.number for incident, _ in active] == [located["center"].number]
+
+    january = geosearch.incidents_near(
+        LATITUDE, LONGITUDE, 5000, start=datetime.date(2024, 1, 1), end=datetime.date(2024, 1, 31)
+    )
+    assert [incident.number for incident, _ in january] == [located["east"].number]
+
+
+def test_within_returns_the_incidents_inside_the_box(located):
+    results = geosearch.incidents_within(
+        LATITUDE - 0.005, LONGITUDE - 0.005, LATITUDE + 0.02, LONGITUDE + 0.06
+    )
+    assert {incident.number for incident in results} == {
+        located["center"].number,
+        located["north"].number,
+        located["east"].number,
+    }
+
+    limited = geosearch.incidents_within(
+        LATITUDE - 0.005, LONGITUDE - 0.005, LATITUDE + 0.02, LONGITUDE + 0.06, limit=1
+    )
+    assert [incident.number for incident in limited] == [located["center"].number]
+
+
+def test_backfill_populates_missing_geohashes(store_incident):
+    missing = [
+        store_incident(latitude=LATITUDE + i / 100, longitude=LONGITUDE) for i in range(5)
+    ]
+    store_incident(latitude=None, longitude=None)
+
+    assert geosearch.backfill_geohashes(batch_size=2) == 5
+    for incident in missing:
+        assert Incident.get_by_id(incident.id).geohash == geo.encode(
+            LATITUDE + missing.index(incident) / 100, LONGITUDE
+        )
+    assert geosearch.backfill_geohashes() == 0
@@ -0,0 +1,73 @@
+import asyncio
+import datetime
+
+import pytest
+
+from app.database.models.incident import Incident
+from app.database.models.unit import Unit
+from app.services.incidentresolver import IncidentResolver
+
+THRESHOLD = datetime.timedelta(hours=6)
+
+
+@pytest.fixture
+def resolver(database):
+    return IncidentResolver(THRESHOLD, chunk_size=3)
+
+
+def hours_ago(hours: float) -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+
+
+def test_stale_incidents_are_resolved_in_chunks(resolver, store_incident):
+    stale = [store_incident(updated_at=hours_ago(7)) for _ in range(7)]
+    fresh = [store_incident(updated_at=hours_ago(1)) for _ in range(2)]
+    resolved_earlier = hours_ago(8)
+    resolved = store_incident(updated_at=hours_ago(9), resolved_at=resolved_earlier)
+
+    run = asyncio.run(resolver.resolve_hanging_incidents())
+
+    assert run.incidents == 7
+    # the ids are spread over chunks of three, and the chunk bounds skip the fresh ones in between
+    assert run.chunks == 3
+    assert run.errors == []
+    for incident in stale:
+        incident = Incident.get_by_id(incident.id)
+        assert incident.resolved_at == run.started_at
+        assert incident.automatically_resolved
+    for incident in fresh:
+        assert Incident.get_by_id(incident.id).resolved_at is None
+    assert Incident.get_by_id(resolved.id).resolved_at == resolved_earlier
+    assert not Incident.get_by_id(resolved.id).automatically_resolved
+    assert resolver.stats()["incidents"] == 7
+
+
+def test_stale_units_are_removed_in_chunks_across_incidents(resolver, store_incident):
+    incidents = [store_incident(updated_at=hours_ago(1)) for _ in range(3)]
+    for incident in incidents:
+        for short_name, last_seen in [("ENG1", 7), ("MED2", 7), ("TRK3", 1)]:
+            Unit.create(
+                incident=incident,
+                short_name=short_name,
+                added_at=hours_ago(8),
+                last_seen=hours_ago(last_seen),
+            )
+
+    run = asyncio.run(resolver.resolve_hanging_incidents())
+
+    assert run.incidents == 0
+    assert run.units == 6
+    assert run.chunks == 2
+    removed = Unit.select().where(Unit.removed_at.is_null(False))
+    assert {(unit.incident_id, unit.short_name) for unit in removed} == {
+        (incident.id, short_name) for incident in incidents for short_name in ("ENG1", "MED2")
+    }
+    assert all(unit.automatically_removed for unit in removed)
+
+
+def test_nothing_to_resolve(resolver, store_incident):
+    store_incident(updated_at=hours_ago(1))
+
+    run = asyncio.run(resolver.resolve_hanging_incidents())
+
+    assert (run.incidents, run.units, run.chunks) == (0, 0, 0)
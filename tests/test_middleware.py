@@ -0,0 +1,202 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+
+from app.cache.backends import LocalCache
+from app.cache.versions import DataVersions
+from app.middleware import (
+    CompressionMiddleware,
+    ConditionalRequestMiddleware,
+    LoadSheddingMiddleware,
+    RateLimitMiddleware,
+    StaleDataMiddleware,
+    etag_match,
+)
+from app.services.circuitbreaker import CircuitBreaker
+from app.services.loadshedding import LoadShedder
+from app.services.ratelimit import Limit, RateLimiter
+
+ETAGS = ['"current"', '"previous"']
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ('"current"', '"current"'),
+        ('W/"current"', '"current"'),
+        ('"stale", "previous"', '"previous"'),
+        ("*", '"current"'),
+        ('"stale"', None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_etag_match(header, expected):
+    assert etag_match(header, ETAGS) == expected
+
+
+ORIGIN = {"Origin": "https://example.com"}
+
+
+@pytest.fixture
+def api():
+    """A route behind the compression store, the ETags and CORS, layered as in app.main"""
+
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.get("/api/v1/incidents/active")
+    async def active():
+        app.state.calls += 1
+        return JSONResponse(
+            {"data": ["incident"] * 200}, headers={"Cache-Control": "max-age=10"}
+        )
+
+    versions = DataVersions()
+    routes = {"/api/v1/incidents": "incidents"}
+    app.add_middleware(
+        CompressionMiddleware,
+        versions=versions,
+        routes=routes,
+        store=LocalCache(max_bytes=1_000_000, max_ttl=60),
+        min_size=100,
+    )
+    app.add_middleware(ConditionalRequestMiddleware, versions=versions, routes=routes)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+
+def test_stored_responses_keep_the_headers_of_the_route(api, http):
+    responses = [
+        http(api, "/api/v1/incidents/active", headers=ORIGIN) for _ in range(2)
+    ]
+
+    # the second response comes from the store
+    assert api.state.calls == 1
+    for response in responses:
+        assert response.status_code == 200
+        assert response.headers["access-control-allow-origin"] == "*"
+        assert response.headers["cache-control"] == "max-age=10"
+        assert "Accept-Encoding" in response.headers["vary"]
+    assert responses[0].json() == responses[1].json()
+
+
+def test_not_modified_responses_carry_cors_headers(api, http):
+    etag = http(api, "/api/v1/incidents/active").headers["etag"]
+
+    response = http(
+        api,
+        "/api/v1/incidents/active",
+        headers={**ORIGIN, "If-None-Match": etag},
+    )
+
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert api.state.calls == 1
+
+
+@pytest.fixture
+def protected_api():
+    """A route behind the rate limiter, the load shedder and CORS, layered as in app.main"""
+
+    app = FastAPI()
+
+    @app.get("/api/v1/incidents/active")
+    async def active():
+        return {"data": []}
+
+    limiter = RateLimiter(limits={"default": Limit(rate=0.01, burst=1)}, routes={})
+    app.state.shedder = LoadShedder(max_in_flight=10, max_db_latency=1, retry_after=7)
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    app.add_middleware(
+        LoadSheddingMiddleware, shedder=app.state.shedder, limiter=limiter
+    )
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Retry-After"],
+    )
+    return app
+
+
+def test_limited_responses_are_readable_cross_origin(protected_api, http):
+    assert http(protected_api, "/api/v1/incidents/active", headers=ORIGIN).status_code == 200
+
+    response = http(protected_api, "/api/v1/incidents/active", headers=ORIGIN)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "100"
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "Retry-After" in response.headers["access-control-expose-headers"]
+
+
+def test_shed_responses_are_readable_cross_origin(protected_api, http):
+    protected_api.state.shedder.db_latency = 5
+
+    response = http(protected_api, "/api/v1/incidents/active", headers=ORIGIN)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+@pytest.fixture
+def stale_api():
+    """Routes of two data domains behind the stale data marker"""
+
+    app = FastAPI()
+
+    @app.get("/api/v1/incidents/active")
+    async def active():
+        return {"data": ["incident"]}
+
+    @app.get("/api/v1/meta/stats")
+    async def stats():
+        return {}
+
+    app.state.breaker = CircuitBreaker("feed", failure_threshold=1)
+    app.add_middleware(
+        StaleDataMiddleware,
+        breakers={"incidents": app.state.breaker},
+        routes={"/api/v1/incidents": "incidents"},
+    )
+    return app
+
+
+def test_stored_data_is_served_and_marked_stale_while_the_feed_fails(
+    stale_api, http
+):
+    breaker = stale_api.state.breaker
+    breaker.record_success()
+    assert "x-data-stale" not in http(stale_api, "/api/v1/incidents/active").headers
+
+    breaker.record_failure()
+    breaker.last_success_at = time.time() - 42
+
+    response = http(stale_api, "/api/v1/incidents/active")
+    assert response.status_code == 200
+    assert response.json() == {"data": ["incident"]}
+    assert int(response.headers["x-data-stale"]) in (42, 43)
+    # routes of other domains are not affected by the feed
+    assert "x-data-stale" not in http(stale_api, "/api/v1/meta/stats").headers
+
+    breaker.record_success()
+    assert "x-data-stale" not in http(stale_api, "/api/v1/incidents/active").headers
+
+
+def test_stale_age_is_unknown_without_a_success(stale_api, http):
+    stale_api.state.breaker.record_failure()
+
+    response = http(stale_api, "/api/v1/incidents/active")
+    assert response.status_code == 200
+    assert response.headers["x-data-stale"] == "unknown"
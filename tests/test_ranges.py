@@ -0,0 +1,34 @@
+import pytest
+
+from app.utils.ranges import RangeNotSatisfiable, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=900-2000", (900, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        (" bytes=5-5 ", (5, 5)),
+    ],
+)
+def test_satisfiable_ranges(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header", [None, "", "bytes=-", "bytes=0-1,5-6", "items=0-10", "bytes=a-b"]
+)
+def test_missing_or_unsupported_ranges_serve_the_whole_file(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize(
+    "header, size",
+    [("bytes=1000-", 1000), ("bytes=10-5", 1000), ("bytes=-0", 1000), ("bytes=-10", 0)],
+)
+def test_unsatisfiable_ranges(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, size)
@@ -0,0 +1,60 @@
+import pytest
+
+from app.services import ratelimit
+from app.services.ratelimit import Decision, Limit, LocalBuckets
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_allows_a_burst_then_refills_at_the_rate(now):
+    buckets = LocalBuckets()
+    limit = Limit(rate=2, burst=3)
+
+    assert [buckets.take("client", limit)[0] for _ in range(4)] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+
+    now[0] += 0.5
+    assert buckets.take("client", limit) == (True, 0.0)
+    assert buckets.take("client", limit)[0] is False
+
+    # a long idle period refills no more than the burst
+    now[0] += 60
+    assert buckets.take("client", limit) == (True, 2.0)
+
+
+def test_buckets_are_kept_per_client(now):
+    buckets = LocalBuckets()
+    limit = Limit(rate=1, burst=1)
+
+    assert buckets.take("a", limit)[0]
+    assert not buckets.take("a", limit)[0]
+    assert buckets.take("b", limit)[0]
+
+
+def test_least_recently_seen_buckets_are_evicted(now, monkeypatch):
+    monkeypatch.setattr(LocalBuckets, "MAX_BUCKETS", 2)
+    buckets = LocalBuckets()
+    limit = Limit(rate=1, burst=1)
+
+    buckets.take("a", limit)
+    buckets.take("b", limit)
+    buckets.take("c", limit)
+    # "a" starts over with a full bucket
+    assert buckets.take("a", limit)[0]
+    assert not buckets.take("c", limit)[0]
+
+
+def test_limit_parse_and_retry_after():
+    limit = Limit.parse("0.5,10")
+    assert limit == Limit(rate=0.5, burst=10)
+    assert Decision(False, limit, remaining=0.2).retry_after == 2
+    assert Decision(False, Limit(rate=100, burst=1), remaining=0.9).retry_after == 1
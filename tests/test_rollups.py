@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from app.database.models.incident import Incident
+from app.database.models.rollups import HeatmapCell, IncidentCount
+from app.services.rollups import IncidentFacts, Rollup, heatmap_rollup, timeseries_rollup
+from app.services.updater import IncidentUpdater
+
+ROLLUPS = [heatmap_rollup, timeseries_rollup]
+
+
+def counts(rollup) -> dict[tuple, int]:
+    """The stored counts of a rollup, without the rows that dropped to zero"""
+    return {
+        tuple(getattr(row, name) for name in rollup.key_fields): row.count
+        for row in rollup.model.select()
+        if row.count
+    }
+
+
+@pytest.mark.parametrize("rollup", ROLLUPS, ids=lambda rollup: rollup.__class__.__name__)
+def test_applied_counts_match_a_rebuild(database, clock, make_incident, rollup):
+    updater = IncidentUpdater(database, rollups=ROLLUPS, clock=clock)
+
+    snapshots = [
+        [make_incident(1), make_incident(2, category="Fire", agency="STATION 1")],
+        [
+            make_incident(1, municipality="MANHEIM TOWNSHIP"),
+            make_incident(2, category="Fire", agency="STATION 1"),
+            make_incident(3, date="2024-03-02T23:59:00+00:00", coordinates=[-76.5, 39.9]),
+        ],
+        [
+            # moved to another cell, and a new incident in an earlier month
+            make_incident(1, municipality="MANHEIM TOWNSHIP", coordinates=[-76.1, 40.2]),
+            make_incident(4, category="Traffic", date="2024-02-29T08:00:00-05:00"),
+        ],
+    ]
+    for snapshot in snapshots:
+        clock.advance(minutes=1)
+        updater.process_live_incidents(snapshot)
+
+    applied = counts(rollup)
+    assert applied
+
+    assert rollup.rebuild() == Incident.select().count()
+    assert counts(rollup) == applied
+
+
+def test_apply_adds_and_removes_the_keys_of_changed_incidents(database):
+    before = IncidentFacts(
+        category="Medical",
+        dispatched_at=datetime.datetime(2024, 3, 1, 12, 30),
+        municipality="LANCASTER CITY",
+        agency="LEMSA",
+        geohash="dr1ugh9d",
+    )
+    after = before._replace(municipality="MANHEIM TOWNSHIP")
+
+    timeseries_rollup.apply([(None, before)])
+    timeseries_rollup.apply([(before, after)])
+
+    series = timeseries_rollup.query(
+        "day",
+        "municipality",
+        datetime.datetime(2024, 3, 1),
+        datetime.datetime(2024, 3, 2),
+    )
+    assert series == {"MANHEIM TOWNSHIP": {datetime.datetime(2024, 3, 1): 1}}
+
+    # only the municipality changed, so the other dimensions are left alone
+    assert IncidentCount.select().where(IncidentCount.count != 0).count() == 6
+    assert HeatmapCell.select().count() == 0
+
+
+def test_rollups_must_define_their_keys():
+    class Keyless(Rollup):
+        model = IncidentCount
+
+    with pytest.raises(TypeError):
+        Keyless()
@@ -0,0 +1,126 @@
+import datetime
+
+import pytest
+
+from app.database.models.incident import Incident
+from app.database.models.pending_resolution import PendingResolution
+from app.services.updater import IncidentUpdater
+
+GRACE = datetime.timedelta(minutes=2)
+
+
+@pytest.fixture
+def updater(database, clock):
+    return IncidentUpdater(database, resolution_grace=GRACE, clock=clock)
+
+
+def resolved_at(number: int):
+    return Incident.get(Incident.number == number).resolved_at
+
+
+def pending_numbers() -> set[int]:
+    return {row.number for row in PendingResolution.select()}
+
+
+def test_missing_incident_is_pending_until_the_grace_period_passes(
+    updater, clock, make_incident
+):
+    updater.process_live_incidents([make_incident(1), make_incident(2)])
+
+    clock.advance(seconds=30)
+    updater.process_live_incidents([make_incident(1)])
+    assert pending_numbers() == {2}
+    assert resolved_at(2) is None
+
+    clock.advance(seconds=60)
+    updater.process_live_incidents([make_incident(1)])
+    assert resolved_at(2) is None
+
+    clock.advance(seconds=60)
+    updater.process_live_incidents([make_incident(1)])
+    # resolved at the first snapshot past the grace period, not when it went missing
+    assert resolved_at(2) == clock.now
+    assert Incident.get(Incident.number == 2).automatically_resolved
+    assert pending_numbers() == set()
+    assert resolved_at(1) is None
+
+
+def test_incident_reappearing_within_the_grace_period_stays_active(
+    updater, clock, make_incident
+):
+    updater.process_live_incidents([make_incident(1)])
+
+    clock.advance(seconds=60)
+    updater.process_live_incidents([])
+    assert pending_numbers() == {1}
+
+    clock.advance(seconds=30)
+    updater.process_live_incidents([make_incident(1)])
+    assert pending_numbers() == set()
+
+    clock.advance(minutes=10)
+    updater.process_live_incidents([make_incident(1)])
+    assert resolved_at(1) is None
+
+
+def test_pending_resolutions_survive_a_restart(
+    database, updater, clock, make_incident
+):
+    updater.process_live_incidents([make_incident(1), make_incident(2)])
+    clock.advance(seconds=30)
+    updater.process_live_incidents([make_incident(1)])
+
+    restarted = IncidentUpdater(database, resolution_grace=GRACE, clock=clock)
+
+    clock.advance(seconds=90)
+    restarted.process_live_incidents([make_incident(1)])
+    assert resolved_at(2) is None
+
+    # the grace period runs from when the incident went missing before the restart
+    clock.advance(seconds=30)
+    restarted.process_live_incidents([make_incident(1)])
+    assert resolved_at(2) == clock.now
+    assert pending_numbers() == set()
+
+
+def test_incident_resolved_elsewhere_keeps_its_resolution(
+    updater, clock, make_incident
+):
+    updater.process_live_incidents([make_incident(1)])
+    clock.advance(seconds=30)
+    updater.process_live_incidents([])
+
+    resolved_by_resolver = clock.now
+    Incident.update(resolved_at=resolved_by_resolver).where(
+        Incident.number == 1
+    ).execute()
+
+    clock.advance(minutes=5)
+    updater.process_live_incidents([])
+    assert resolved_at(1) == resolved_by_resolver
+    assert not Incident.get(Incident.number == 1).automatically_resolved
+    assert pending_numbers() == set()
+
+
+def test_failed_resolution_is_rolled_back_and_retried(
+    monkeypatch, updater, clock, make_incident
+):
+    updater.process_live_incidents([make_incident(1), make_incident(2)])
+    clock.advance(seconds=30)
+    updater.process_live_incidents([make_incident(1)])
+
+    def fail():
+        raise RuntimeError("connection lost")
+
+    clock.advance(minutes=5)
+    with monkeypatch.context() as patched:
+        patched.setattr(PendingResolution, "delete", fail)
+        updater.process_live_incidents([make_incident(1)])
+    # the incident was resolved before the failure, the savepoint undoes it
+    assert resolved_at(2) is None
+    assert pending_numbers() == {2}
+
+    clock.advance(seconds=30)
+    updater.process_live_incidents([make_incident(1)])
+    assert resolved_at(2) == clock.now
+    assert pending_numbers() == set()